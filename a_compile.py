@@ -1,18 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import sys
+import glob
+import json
+import hashlib
 import argparse
 import stat
 import shutil
 import subprocess
 import platform
 import zipfile
+import concurrent.futures
 from distutils.dir_util import copy_tree
 
-parser = argparse.ArgumentParser(description='Pigz script')
-parser.add_argument('--rebuild', help='Rebuild', action='store_const', const=True, default=None)
-args, unknown = parser.parse_known_args()
-
 
 def rmtree(top):
     """Delete folder and contents: shutil.rmtree has issues with read-only files on Windows"""
@@ -80,8 +81,356 @@ def install_neuro_corpus():
     rmtree(indir)
 
 
-def compile_pigz(rebuild=True):
-    """compile variants of pigz"""
+def _repository(url, mirror=''):
+    """
+    return the local copy of repository 'url' when folder 'mirror' has one,
+    e.g. 'mirror/zlib-ng/zlib-ng' or 'mirror/zlib-ng/zlib-ng.git' for 'https://github.com/zlib-ng/zlib-ng'
+    """
+
+    if len(mirror) < 1:
+        return url
+    owner, name = url.rstrip('/').split('/')[-2:]
+    for candidate in [name, name + '.git']:
+        local = os.path.join(os.path.abspath(mirror), owner, candidate)
+        if os.path.isdir(local):
+            return local
+    return url
+
+
+def _clone(url, folder, basedir, rebuild, mirror=''):
+    """clone 'url' to 'basedir/folder' unless it exists (always when 'rebuild')"""
+
+    if rebuild or not os.path.exists(os.path.join(basedir, folder)):
+        if os.path.isdir(os.path.join(basedir, folder)):
+            rmtree(os.path.join(basedir, folder))
+        print("Checking out {0}".format(folder))
+        cmd = 'git clone {0} {1}'.format(_repository(url, mirror), folder)
+        subprocess.call(cmd, shell=True, cwd=basedir)
+
+
+def _git_head(folder):
+    """commit hash checked out in 'folder' plus a hash of uncommitted changes, '' if it is not a git repository"""
+
+    proc = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=folder,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    head = proc.stdout.decode().strip()
+    proc = subprocess.run(['git', 'diff', 'HEAD'], cwd=folder,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if len(proc.stdout) > 0:
+        head += '+' + hashlib.sha256(proc.stdout).hexdigest()[:16]
+    return head
+
+
+def _tree_hash(folder):
+    """sha256 of the names and contents of all files in 'folder'"""
+
+    h = hashlib.sha256()
+    for root, dirs, files in sorted(os.walk(folder)):
+        dirs.sort()
+        for name in sorted(files):
+            fnm = os.path.join(root, name)
+            h.update(os.path.relpath(fnm, folder).encode())
+            with open(fnm, 'rb') as fh:
+                h.update(fh.read())
+    return h.hexdigest()
+
+
+def _launcher():
+    """cmake option to compile through ccache when it is installed"""
+
+    if shutil.which('ccache'):
+        return ' -DCMAKE_C_COMPILER_LAUNCHER=ccache'
+    return ''
+
+
+def compile_zlib_shared(method, basedir, libdir, jobs=1, rebuild=True):
+    """
+    build zlib variant 'method' as a shared library and copy it to 'libdir'
+
+    Parameters
+    ----------
+    method : dict
+        zlib variant, as listed in compile_pigz, its source is in 'zlib-<name>'
+    basedir : str
+        folder containing the zlib source folders
+    libdir : str
+        folder where the library is saved as 'libz-<name>' with the platform extension
+    jobs : int
+        number of parallel compile jobs (default 1)
+    rebuild : bool
+        start from an empty build folder (default True)
+    """
+
+    zlibdir = os.path.join(basedir, 'zlib-{0}'.format(method['name']))
+    builddir = os.path.join(zlibdir, 'build-shared')
+    if rebuild and os.path.isdir(builddir):
+        rmtree(builddir)
+    if not os.path.isdir(builddir):
+        os.mkdir(builddir)
+    cmd = 'cmake .. -DBUILD_SHARED_LIBS=ON -DCMAKE_BUILD_TYPE=Release' + _launcher()
+    if 'cmake_args' in method:
+        cmd += ' ' + method['cmake_args']
+    subprocess.call(cmd, shell=True, cwd=builddir)
+    cmd = 'cmake --build . --config Release --parallel {0}'.format(jobs)
+    subprocess.call(cmd, shell=True, cwd=builddir)
+
+    ext = '.so'
+    patterns = ['libz.so*', 'libz-ng.so*']
+    if platform.system() == 'Darwin':
+        ext = '.dylib'
+        patterns = ['libz*.dylib']
+    elif platform.system() == 'Windows':
+        ext = '.dll'
+        patterns = [os.path.join('Release', 'zlib*.dll'), 'zlib*.dll', 'libz*.dll']
+    for pattern in patterns:
+        libs = sorted(glob.glob(os.path.join(builddir, pattern)))
+        libs = [lib for lib in libs if not os.path.islink(lib)]
+        if len(libs) > 0:
+            outnm = os.path.join(libdir, 'libz-{0}{1}'.format(method['name'], ext))
+            shutil.copyfile(libs[0], outnm)
+            print(libs[0] + '->' + outnm)
+            return outnm
+    print('Unable to find shared library for zlib-{0}'.format(method['name']))
+    return ''
+
+
+def train_pgo(pigzexe, corpus, builddir):
+    """
+    run an instrumented pigz over the files in folder 'corpus' to collect a profile
+
+    Each file is compressed at levels 1, 6 and 9 and decompressed again, so
+    both directions are represented in the profile
+
+    Parameters
+    ----------
+    pigzexe : str
+        pigz built with -fprofile-generate
+    corpus : str
+        folder with training files
+    builddir : str
+        folder for the temporary compressed file
+    """
+
+    tmpnm = os.path.join(builddir, 'pgo-train.gz')
+    for f in sorted(os.listdir(corpus)):
+        fnm = os.path.join(corpus, f)
+        if not os.path.isfile(fnm) or f.startswith('.'):
+            continue
+        for lvl in [1, 6, 9]:
+            with open(tmpnm, 'wb') as fh:
+                subprocess.call([pigzexe, '-c', '-{0}'.format(lvl), fnm], stdout=fh)
+            subprocess.call([pigzexe, '-d', '-c', tmpnm], stdout=subprocess.DEVNULL)
+    if os.path.isfile(tmpnm):
+        os.remove(tmpnm)
+
+
+def _pigz_exe(builddir, ext):
+    """find the pigz executable in a cmake build folder, '' if the build failed"""
+
+    for pigzexe in [os.path.join(builddir, 'bin', 'pigz' + ext),
+                    os.path.join(builddir, 'pigz' + ext),
+                    os.path.join(builddir, 'Release', 'pigz' + ext)]:
+        if os.path.exists(pigzexe):
+            return pigzexe
+    return ''
+
+
+def build_flavor(method, flavor, basedir, exedir, jobs=1, rebuild=True,
+                 previous=None, corpus=''):
+    """
+    build pigz with zlib variant 'method' and the compiler options of 'flavor', unless nothing changed
+
+    Parameters
+    ----------
+    method : dict
+        zlib variant, as listed in compile_pigz, its sources are already checked out
+    flavor : dict
+        build flavor, as listed in compile_pigz
+    basedir : str
+        folder for source and build folders
+    exedir : str
+        folder where 'pigz-<name>' or 'pigz-<name>-<flavor>' is saved
+    jobs : int
+        number of parallel compile jobs (default 1)
+    rebuild : bool
+        build from scratch (default True)
+    previous : dict
+        manifest entry of the last build of this variant and flavor (default None)
+    corpus : str
+        folder with files to train profile guided builds (default '')
+
+    Returns
+    -------
+    manifest entry: zlib and pigz commits, cmake options, compiler flags and pigz CMake files hash
+    """
+
+    ext = ''
+    if platform.system() == 'Windows':
+        ext = '.exe'
+    if manifest is None:
+        manifest = {}
+    zlibname = 'zlib-{0}'.format(method['name'])
+    pigzname = 'pigz-{0}'.format(method['name'])
+    builddir = 'build'
+    if len(flavor['name']) > 0:
+        pigzname += '-' + flavor['name']
+        builddir += '-' + flavor['name']
+    pigzdir = os.path.join(basedir, 'pigz-{0}'.format(method['name']))
+    cmake_args = ' '.join(a for a in [method.get('cmake_args', ''),
+                                      flavor.get('cmake_args', '')] if a)
+    entry = {'zlib': _git_head(os.path.join(basedir, zlibname)),
+             'pigz': _git_head(pigzdir), 'cmake_args': cmake_args,
+             'c_flags': flavor.get('c_flags', ''),
+             'cmake_files': _tree_hash(os.path.join(basedir, 'pigz'))}
+    if flavor.get('pgo', False):
+        if platform.system() == 'Windows':
+            print('Skipping {0}: profile guided builds need gcc or clang'.format(pigzname))
+            return {}
+        if not os.path.isdir(corpus):
+            print('Skipping {0}: unable to find training corpus "{1}"'.format(pigzname, corpus))
+            return {}
+        entry['train'] = _tree_hash(corpus)
+    outnm = os.path.join(exedir, pigzname + ext)
+    if not rebuild and previous == entry and os.path.isfile(outnm):
+        print('Skipping build of {0}: unchanged since the last build'.format(pigzname))
+        return entry
+
+    builddir = os.path.join(pigzdir, builddir)
+    if rebuild or not os.path.exists(builddir):
+        if os.path.isdir(builddir):
+            rmtree(builddir)
+        os.mkdir(builddir)
+
+    cmd = 'cmake  .. -DZLIB_ROOT:PATH=../{0} -DBUILD_SHARED_LIBS=OFF'.format(zlibname)
+    cmd += _launcher()
+    if len(cmake_args) > 0:
+        cmd += ' ' + cmake_args
+    if platform.system() == 'Windows':
+        cmd += ' -DPTHREADS4W_ROOT:PATH=../pthreads4w'
+    build = 'cmake --build . --config Release --parallel {0}'.format(jobs)
+    c_flags = flavor.get('c_flags', '')
+    if len(c_flags) < 1:
+        subprocess.call(cmd, shell=True, cwd=builddir)
+        subprocess.call(build, shell=True, cwd=builddir)
+    else:
+        cmd += ' -DCMAKE_BUILD_TYPE=Release'
+        release = '-DCMAKE_C_FLAGS_RELEASE="{0} -DNDEBUG"'
+        if flavor.get('pgo', False):
+            profdir = os.path.join(builddir, 'pgo-data')
+            if os.path.isdir(profdir):
+                rmtree(profdir)
+            gen = '{0} -fprofile-generate={1} -fprofile-update=atomic'.format(c_flags, profdir)
+            subprocess.call(cmd + ' ' + release.format(gen), shell=True, cwd=builddir)
+            subprocess.call(build, shell=True, cwd=builddir)
+            pigzexe = _pigz_exe(builddir, ext)
+            if len(pigzexe) < 1:
+                print('Unable to build instrumented {0}'.format(pigzname))
+                return {}
+            print('Training {0} on {1}'.format(pigzname, corpus))
+            train_pgo(pigzexe, corpus, builddir)
+            # clang writes .profraw files that must be merged first, gcc uses .gcda files as they are
+            raws = glob.glob(os.path.join(profdir, '*.profraw'))
+            if len(raws) > 0:
+                if not shutil.which('llvm-profdata'):
+                    print('Skipping {0}: llvm-profdata is needed to merge the clang profile'.format(pigzname))
+                    return {}
+                subprocess.call(['llvm-profdata', 'merge', '-output=' +
+                                 os.path.join(profdir, 'default.profdata')] + raws)
+            c_flags = '{0} -fprofile-use={1} -fprofile-correction -Wno-missing-profile'.format(c_flags, profdir)
+            os.remove(pigzexe)
+            subprocess.call(build + ' --target clean', shell=True, cwd=builddir)
+        subprocess.call(cmd + ' ' + release.format(c_flags), shell=True, cwd=builddir)
+        subprocess.call(build, shell=True, cwd=builddir)
+
+    pigzexe = _pigz_exe(builddir, ext)
+    if len(pigzexe) < 1:
+        print('Unable to build {0}'.format(pigzname))
+        return {}
+    shutil.move(pigzexe, outnm)
+    print(pigzexe + '->' + outnm)
+    return entry
+
+
+def build_method(method, flavors, basedir, exedir, libdir, jobs=1, rebuild=True,
+                 manifest=None, mirror='', corpus=''):
+    """
+    fetch and build pigz with zlib variant 'method' for each build flavor
+
+    The flavors of one variant are built one after another, as they share its zlib sources
+
+    Parameters
+    ----------
+    method : dict
+        zlib variant, as listed in compile_pigz
+    flavors : list of dict
+        build flavors, as listed in compile_pigz
+    basedir : str
+        folder for source and build folders
+    exedir : str
+        folder where 'pigz-<name>[-<flavor>]' is saved
+    libdir : str
+        folder where 'libz-<name>' is saved
+    jobs : int
+        number of parallel compile jobs (default 1)
+    rebuild : bool
+        clone the sources again and build from scratch (default True)
+    manifest : dict
+        manifest entries of the last builds, by executable name (default None, none)
+    mirror : str
+        folder with local clones to use instead of the remote repositories (default '')
+    corpus : str
+        folder with files to train profile guided builds (default '')
+
+    Returns
+    -------
+    manifest entries of the executables, by name 'pigz-<name>[-<flavor>]'
+    """
+
+    zlibname = 'zlib-{0}'.format(method['name'])
+    pigzname = 'pigz-{0}'.format(method['name'])
+    _clone(method['repository'], zlibname, basedir, rebuild, mirror)
+    _clone('https://github.com/madler/pigz', pigzname, basedir, rebuild, mirror)
+    if 'branch' in method and method['branch']:
+        cmd = 'git checkout {0}'.format(method['branch'])
+        subprocess.call(cmd, shell=True, cwd=os.path.join(basedir, zlibname))
+    copy_tree(os.path.join(basedir, 'pigz'), os.path.join(basedir, pigzname))
+
+    entries = {}
+    for flavor in flavors:
+        name = pigzname
+        if len(flavor['name']) > 0:
+            name += '-' + flavor['name']
+        entries[name] = build_flavor(method, flavor, basedir, exedir, jobs,
+                                     rebuild, manifest.get(name), corpus)
+        if len(flavor['name']) > 0 or len(entries[name]) < 1:
+            continue
+        libs = glob.glob(os.path.join(libdir, 'libz-{0}.*'.format(method['name'])))
+        if rebuild or manifest.get(name) != entries[name] or len(libs) < 1:
+            # shared copy of the same zlib for in-process tests (g_zlib_inprocess.py)
+            compile_zlib_shared(method, basedir, libdir, jobs, rebuild)
+    return entries
+
+
+def compile_pigz(rebuild=True, jobs=0, mirror='', flavor_names=(), corpus=''):
+    """
+    compile variants of pigz, all variants are configured and built at the same time
+
+    Besides the default build 'pigz-<name>', each selected flavor is saved
+    as 'pigz-<name>-<flavor>', e.g. 'pigz-ng-pgo'
+
+    Parameters
+    ----------
+    rebuild : bool
+        clone the sources again and build everything from scratch (default True)
+    jobs : int
+        total number of parallel compile jobs (default 0, one per CPU)
+    mirror : str
+        folder with local clones of the repositories (default '')
+    flavor_names : list of str
+        extra build flavors, from 'O2', 'O3', 'native', 'lto' and 'pgo' (default none)
+    corpus : str
+        folder with files to train the 'pgo' flavor (default '', use './corpus')
+    """
 
     methods = [
         {'name': 'madler',
@@ -93,82 +442,75 @@ def compile_pigz(rebuild=True):
          'branch': 'develop',
          'cmake_args': '-DZLIB_COMPAT=ON'}
     ]
+    # compiler options of each build flavor, '' is the default build of the cmake files
+    flavors = [
+        {'name': ''},
+        {'name': 'O2',
+         'c_flags': '-O2'},
+        {'name': 'O3',
+         'c_flags': '-O3'},
+        {'name': 'native',
+         'c_flags': '-O3 -march=native'},
+        {'name': 'lto',
+         'c_flags': '-O3 -flto',
+         'cmake_args': '-DCMAKE_EXE_LINKER_FLAGS=-flto'},
+        {'name': 'pgo',
+         'c_flags': '-O3',
+         'pgo': True}
+    ]
+    unknown = set(flavor_names) - set(f['name'] for f in flavors)
+    if len(unknown) > 0:
+        sys.exit('Unknown build flavors: ' + ', '.join(sorted(unknown)))
+    flavors = [f for f in flavors if len(f['name']) < 1 or f['name'] in flavor_names]
     basedir = os.getcwd()
+    if len(corpus) < 1:
+        corpus = os.path.join(basedir, 'corpus')
     exedir = os.path.join(basedir, 'exe')
+    libdir = os.path.join(basedir, 'lib')
+    if rebuild:
+        for folder in [exedir, libdir]:
+            if os.path.isdir(folder):
+                rmtree(folder)
+    for folder in [exedir, libdir]:
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
 
-    if os.path.isdir(exedir):
-        rmtree(exedir)
-    if not os.path.isdir(exedir):
-        os.mkdir(exedir)
-
-    ext = ''
     if platform.system() == 'Windows':
-        ext = '.exe'
-
-    for method in methods:
-        os.chdir(basedir)
-
-        pthreads4wdir = os.path.join(basedir, 'pthreads4w')
-        if rebuild or not os.path.exists('pthreads4w') and platform.system() == 'Windows':
-            cmd = 'git clone https://github.com/jwinarske/pthreads4w'
-            subprocess.call(cmd, shell=True)
-
-        zlibname = 'zlib-{0}'.format(method['name'])
-        if rebuild or not os.path.exists(zlibname):
-            if os.path.isdir(zlibname):
-                rmtree(zlibname)
-            print("Checking out zlib source code for {0}".format(method['name']))
-            cmd = 'git clone {0} {1}'.format(method['repository'], zlibname)
-            subprocess.call(cmd, shell=True)
-
-        pigzname = 'pigz-{0}'.format(method['name'])
-        if rebuild or not os.path.exists(pigzname):
-            if os.path.isdir(pigzname):
-                rmtree(pigzname)
-            print("Checking out pigz source code for {0}".format(method['name']))
-            cmd = 'git clone https://github.com/madler/pigz {0}'.format(pigzname)
-            subprocess.call(cmd, shell=True)
-
-        os.chdir(zlibname)
-        if 'branch' in method and method['branch']:
-            cmd = 'git checkout {0}'.format(method['branch'])
-            subprocess.call(cmd, shell=True)
-
-        pigzdir = os.path.join(basedir, pigzname)
-        copy_tree(os.path.join(basedir, 'pigz'), pigzdir)
-        builddir = os.path.join(pigzdir, 'build')
-        if rebuild or not os.path.exists(builddir):
-            if os.path.isdir(builddir):
-                rmtree(builddir)
-            os.mkdir(builddir)
-
-        os.chdir(builddir)
-
-        cmd = 'cmake  .. -DZLIB_ROOT:PATH=../{0} -DBUILD_SHARED_LIBS=OFF'.format(zlibname)
-        if 'cmake_args' in method:
-            cmd += ' ' + method['cmake_args']
-        if platform.system() == 'Windows':
-            cmd += ' -DPTHREADS4W_ROOT:PATH=../pthreads4w'
-        subprocess.call(cmd, shell=True)
+        _clone('https://github.com/jwinarske/pthreads4w', 'pthreads4w', basedir, rebuild, mirror)
 
-        cmd = 'cmake --build . --config Release'
-        subprocess.call(cmd, shell=True)
-
-        pigzexe = os.path.join(builddir, 'bin', 'pigz' + ext)
-        if not os.path.exists(pigzexe):
-            pigzexe = os.path.join(builddir, 'pigz' + ext)
-        if not os.path.exists(pigzexe):
-            pigzexe = os.path.join(builddir, 'Release', 'pigz' + ext)
-
-        outnm = os.path.join(exedir, pigzname + ext)
-        shutil.move(pigzexe, outnm)
-        print(pigzexe + '->' + outnm)
+    manifest_file = os.path.join(basedir, 'build_manifest.json')
+    manifest = {}
+    if not rebuild and os.path.isfile(manifest_file):
+        with open(manifest_file) as fh:
+            manifest = json.load(fh)
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    # the compile jobs are shared between the variants built at the same time
+    jobs_each = max(jobs // len(methods), 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(methods)) as pool:
+        futures = [pool.submit(build_method, method, flavors, basedir, exedir,
+                               libdir, jobs_each, rebuild, manifest, mirror,
+                               os.path.abspath(corpus))
+                   for method in methods]
+        for future in futures:
+            manifest.update(future.result())
+    with open(manifest_file, 'w') as fh:
+        json.dump(manifest, fh, indent=1)
 
 
 if __name__ == '__main__':
     """compile variants of pigz and sample compression corpus"""
 
+    parser = argparse.ArgumentParser(description='Pigz script')
+    parser.add_argument('--rebuild', help='Rebuild', action='store_const', const=True, default=None)
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='parallel compile jobs (default: number of CPUs)')
+    parser.add_argument('--mirror', default='', help='folder with local clones of the zlib and pigz repositories')
+    parser.add_argument('--flavors', default='', help='comma separated extra builds: O2,O3,native,lto,pgo')
+    parser.add_argument('--train', default='', help='folder with files to train the pgo flavor (default ./corpus)')
+    args, unknown = parser.parse_known_args()
+
     install_neuro_corpus()
     install_silesia_corpus()
 
-    compile_pigz(args.rebuild)
+    flavor_names = [f for f in args.flavors.split(',') if len(f) > 0]
+    compile_pigz(args.rebuild, args.jobs, args.mirror, flavor_names, args.train)
@@ -3,16 +3,27 @@
 # python3 2test.py          : compress files of folder 'corpus' at level 6
 # python3 2test.py indir    : compress files of folder 'indir' at level 6
 # python3 2test.py indir 2  : compress files of folder 'indir' at level 2
+# python3 b_speed_threads.py indir 3 --threads 1,2,4,8,16,32,64 : speedup and serial fraction sweep
+# python3 b_speed_threads.py indir 3 --placement os,compact,spread,node,interleave : thread placement sweep
+# python3 b_speed_threads.py indir 3 --preflight --warmup 1 --retries 2 : check the host, re-run disturbed cells
+# python3 b_speed_threads.py indir 3 --cores : per-thread and per-core CPU use, main/writer thread saturation
 
 import os
 import sys
+import argparse
 import stat
 import shutil
-import pandas as pd
 import psutil
 import ntpath
-import subprocess
-import time
+import stats
+import runner
+import staging
+import results
+import perf
+import sampler
+import topology
+import preflight
+import utilization
 #import distutils.spawn
 
 def _cmp(
@@ -20,20 +31,117 @@ def _cmp(
     fnm,
     lvl,
     threads,
+    stream=False,
     ):
-    """Use executable 'exe' to compress file 'fnm' at level 'lvl' with 'threads' cores"""
+    """Use executable 'exe' to compress file 'fnm' at level 'lvl' with 'threads' cores
 
-    env = os.environ
-    if threads < 1:
-        cmd = exe + ' -f -k -' + str(lvl) + ' "' + fnm + '"'
-    else:
-        cmd = exe + ' -f -k -' + str(lvl) + ' -p ' + str(threads) \
-            + ' "' + fnm + '"'
-    subprocess.call(cmd, shell=True)
+    With 'stream' the output goes to a pipe (-c) and is counted instead of being saved.
+    Returns the wall, user and sys seconds and peak memory of the child process"""
+
+    opts = ' -f -k -'
+    args = runner.command(exe, opts, lvl)
+    if threads > 0:
+        args += ['-p', str(threads)]
+    if stream:
+        return runner.run_stream(args + ['-c', fnm])
+    args.append(fnm)
+    return runner.run(args)
+
+
+def _test_cell(exe, indir, level, threads, repeats, rel_width, budget,
+               stream=False, storage='disk'):
+    """
+    compress every file in folder 'indir', repeating until the timing is stable
+
+    Parameters
+    ----------
+    exe : str
+        name of compression executable
+    indir : str
+        folder with files to compress
+    level : int
+        compression level
+    threads : int
+        number of threads, 0 to use the default of exe
+    repeats : int
+        number of repeats (minimum number when adaptive)
+    rel_width : float
+        target relative width of the 95% CI, 0 for a fixed number of repeats
+    budget : float
+        maximum seconds spent on adaptive repeats
+    stream : bool
+        send compressed data to a pipe rather than to disk (default False)
+    storage : str
+        page cache state before each repeat, see staging.prepare (default 'disk')
+
+    Returns
+    -------
+    summary of the repeat durations (see stats.repeat) and one list of per file rows for each repeat
+    """
+
+    meth = ntpath.basename(exe)
+    reps = []
+
+    def measure():
+        staging.prepare(indir, storage)
+        rep_rows = []
+        for f in os.listdir(indir):
+            if not os.path.isfile(os.path.join(indir, f)):
+                continue
+            if f.startswith('.'):
+                continue
+            if not f.endswith('.zst') and not f.endswith('.gz') \
+                and not f.endswith('.bz2'):
+                fnm = os.path.join(indir, f)
+                usage = _cmp(exe, fnm, level, threads, stream)
+                if not stream:
+                    fnmz = fnm + '.gz'
+                    usage['bytes_out'] = 0
+                    if os.path.isfile(fnmz):
+                        usage['bytes_out'] = os.stat(fnmz).st_size
+                    else:
+                        print('Error: missing "' + fnmz + '"')
+                row = {'exe': meth, 'level': level, 'threads': threads,
+                       'file': f, 'rep': len(reps), 'stream': int(stream),
+                       'storage': storage,
+                       'bytes_in': os.stat(fnm).st_size}
+                row.update(usage)
+                rep_rows.append(row)
+        reps.append(rep_rows)
+        return sum(r['wall'] for r in rep_rows)
 
+    summary = stats.repeat(measure, repeats, rel_width, budget)
+    return summary, reps
 
-def test_cmp(exe='gzip', indir='', max_threads=0, repeats = 1, resultsFile = 'gz.pkl'):
-    """Test compression of executable 'exe' for files in folder 'indir' up to 'max_threads' cores"""
+
+def thread_steps(max_threads):
+    """thread counts tested by default: the exe default (0), then 1, 2, 3, 4 and steps of 4 up to 'max_threads'"""
+
+    steps = []
+    threads = 0
+    while threads <= max_threads:
+        steps.append(threads)
+        inc = max(threads, 1)
+        inc = min(inc, 4)
+        threads = threads + inc
+    return steps
+
+
+def test_cmp(exe='gzip', indir='', max_threads=0, repeats = 1, resultsFile = 'gz.db',
+             rel_width=0, budget=60.0, stream=False, storage='disk', thread_list=None,
+             placement='os', warmup=0, retries=2):
+    """Test compression of executable 'exe' for files in folder 'indir' up to 'max_threads' cores
+
+    With 'rel_width' > 0 each cell is repeated until the 95% confidence interval of
+    its median time is narrower than 'rel_width' (e.g. 0.02) or 'budget' seconds pass.
+    With 'stream' compressed data is counted from a pipe and never written to disk.
+    'storage' is recorded with the results and sets the page cache state (staging.prepare).
+    'thread_list' replaces the default thread steps with a scaling sweep: every count
+    is tested, speedup is relative to -p 1 and serial fractions are fitted per level.
+    'placement' pins each thread count to CPUs chosen by a topology.policies policy.
+    'warmup' untimed repeats run before each cell. With preflight.enabled the host
+    is monitored during each cell, which is run up to 'retries' more times while
+    preflight.end() reports interference"""
 
     if len(indir) < 1:
         indir = \
@@ -47,66 +155,131 @@ def test_cmp(exe='gzip', indir='', max_threads=0, repeats = 1, resultsFile = 'gz
         print('Skipping test: Unable to find "' + exe + '"')
         return ()
     meth = ntpath.basename(exe)
-    print('exe\tlevel\tms\tmb/s\t%\tthreads')
-    threads = 0
-    while threads <= max_threads:
-        for level in [3, 6, 9]:
-            seconds = float("inf")
-            size = 0
-            nsize = 0
-            for rep in range(repeats):
-                t0 = time.time()
-                for f in os.listdir(indir):
-                    if not os.path.isfile(os.path.join(indir, f)):
-                        continue
-                    if f.startswith('.'):
-                        continue
-                    if not f.endswith('.zst') and not f.endswith('.gz') \
-                        and not f.endswith('.bz2'):
-                        fnm = os.path.join(indir, f)
-                        _cmp(exe, fnm, level, threads)
-                        if rep > 0:
-                            continue
-                        size = size + os.stat(fnm).st_size
-                        fnmz = fnm + '.gz'
-                        if os.path.isfile(fnmz):
-                            nsize = nsize + os.stat(fnmz).st_size
-                        else:
-                            print('Error: missing "' + fnmz + '"')
-                seconds = min(seconds, time.time() - t0)
+    exe_hash = results.exe_hash(exe)
+    levels = [3, 6, 9]
+    scaling = thread_list is not None
+    if scaling:
+        # the speedup of every count is relative to a single thread
+        thread_list = sorted(set([1] + [t for t in thread_list if t > 0]))
+    else:
+        thread_list = thread_steps(max_threads)
+    single = {}
+    speedups = {level: [] for level in levels}
+    print('exe\tlevel\tms\tmb/s\t%\tthreads\tcpu s/gb\tefficiency\tspeedup\tmedian\tci %\tn\tplacement\tcpus')
+    for threads in thread_list:
+        where = topology.apply(placement, threads)
+        cpus = topology.label(where)
+        for level in levels:
+            attempts = 0
+            while True:
+                baseline = float('nan')
+                if warmup > 0:
+                    # untimed, brings caches and clock frequency to a steady state
+                    warm = None
+                    if preflight.enabled:
+                        warm = preflight.begin()
+                    _, warm_reps = _test_cell(exe, indir, level, threads, warmup, 0,
+                                              budget, stream, storage)
+                    if warm is not None:
+                        # the frequency under this load is the baseline of the cell
+                        warm_cpu = sum(r['user'] + r['sys'] for rows in warm_reps for r in rows)
+                        baseline = preflight.end(warm, warm_cpu)['loaded mhz']
+                monitor = None
+                if preflight.enabled:
+                    monitor = preflight.begin(baseline)
+                summary, reps = _test_cell(exe, indir, level, threads, repeats,
+                                           rel_width, budget, stream, storage)
+                env = {}
+                if monitor is not None:
+                    child_cpu = sum(r['user'] + r['sys'] for rows in reps for r in rows)
+                    env = preflight.end(monitor, child_cpu)
+                attempts += 1
+                if len(env.get('interference', '')) < 1:
+                    break
+                if attempts > retries:
+                    print('Warning: {} level {} threads {} still disturbed: {}'.format(
+                          meth, level, threads, env['interference']))
+                    break
+                print('Re-running {} level {} threads {}: {}'.format(
+                      meth, level, threads, env['interference']))
+            seconds = summary['min']
+            best = min(reps, key=lambda rows: sum(r['wall'] for r in rows))
+            file_rows = [row for rows in reps for row in rows]
+            size = sum(r['bytes_in'] for r in best)
+            nsize = sum(r['bytes_out'] for r in best)
             bytes_per_mb = 1000000
             speed = size / bytes_per_mb / seconds
-            print('{}\t{}\t{:.0f}\t{:.0f}\t{:.2f}\t{}'.format(
+            cpu_gb = runner.cpu_seconds_per_gb(best)
+            efficiency = runner.parallel_efficiency(best, max(threads, 1))
+            if threads == 1:
+                single[level] = seconds
+            speedup = float('nan')
+            if level in single:
+                speedup = single[level] / seconds
+                speedups[level].append((threads, speedup))
+            print('{}\t{}\t{:.0f}\t{:.0f}\t{:.2f}\t{}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.0f}\t{:.1f}\t{}\t{}\t{}'.format(
                 meth,
                 level,
                 seconds * 1000,
                 speed,
                 nsize / size * 100,
                 threads,
+                cpu_gb,
+                efficiency,
+                speedup,
+                summary['median'] * 1000,
+                summary['rel_ci'] * 100,
+                summary['n'],
+                placement,
+                cpus,
                 ))
             threads0 = threads
             if threads0 < 1:
                 threads0 = max_threads + 1
-            row_df = pd.DataFrame([[meth, nsize / size * 100, speed,
-                                  level, threads0]])
+            row = {'exe': meth, 'exe_hash': exe_hash, 'size %': nsize / size * 100,
+                   'speed mb/s': speed, 'level': level, 'threads': threads0,
+                   'cpu s/gb': cpu_gb, 'efficiency': efficiency,
+                   'speedup': speedup, 'scaling efficiency': speedup / max(threads, 1),
+                   'stream': int(stream), 'storage': storage,
+                   'placement': placement, 'cpus': cpus}
+            row.update(stats.cell_fields(summary))
+            if len(env) > 0:
+                row.update(env)
+                row['attempts'] = attempts
+            row.update(perf.totals(best))
+            row['peak rss mb'] = max(r['maxrss'] for r in best) / bytes_per_mb
+            timeline_rows = _timeline_rows(file_rows, exe_hash)
+            if len(timeline_rows) > 0:
+                row['sampled rss mb'] = max(sampler.peak(r.get('timeline', [])) for r in best) / bytes_per_mb
+            thread_rows, core_rows = _utilization_rows(file_rows, exe_hash)
+            if utilization.enabled:
+                row.update(_utilization_cell(best))
+                print('{}\t{}\tactive cores {:.2f}\tpeak {:.1f}\tmain saturated {:.0f}%\twriter saturated {:.0f}%'.format(
+                      meth, level, row['active cores'], row['peak cores'],
+                      row['main saturated %'], row['writer saturated %']))
+            for r in file_rows:
+                r.pop('timeline', None)
+                r.pop('thread timeline', None)
+                r.pop('core timeline', None)
+            rows = [row]
             if threads < 1 and max_threads < 1:
 
                 # for gzip we only test 1 thread, we need two points to show up on a line plot
 
-                row_df0 = pd.DataFrame([[meth, nsize / size * 100,
-                        speed, level, 0]])
-                row_df = pd.concat([row_df, row_df0], ignore_index=True)
-            row_df.columns = ['exe', 'size %', ' speed mb/s   ', 'level'
-                              , 'threads']
-            try:
-                df = pd.read_pickle(resultsFile)
-                df = pd.concat([row_df, df], ignore_index=True)
-            except (OSError, IOError) as e:
-                df = row_df
-            df.to_pickle(resultsFile)
-        inc = max(threads, 1)
-        inc = min(inc, 4)
-        threads = threads + inc
+                row0 = dict(row)
+                row0['threads'] = 0
+                rows.append(row0)
+            results.append(resultsFile, 'cells', rows)
+            # per file and per run resource usage
+            for row in file_rows:
+                row['exe_hash'] = exe_hash
+                row['placement'] = placement
+            results.append(resultsFile, 'files', file_rows)
+            if len(timeline_rows) > 0:
+                results.append(resultsFile, 'timeline', timeline_rows)
+            if len(thread_rows) > 0:
+                results.append(resultsFile, 'thread_timeline', thread_rows)
+                results.append(resultsFile, 'core_timeline', core_rows)
         # clean up
         for f in os.listdir(indir):
             if not os.path.isfile(os.path.join(indir, f)):
@@ -115,10 +288,99 @@ def test_cmp(exe='gzip', indir='', max_threads=0, repeats = 1, resultsFile = 'gz
                 or f.endswith('.bz2'):
                 fnm = os.path.join(indir, f)
                 os.remove(fnm)
+    topology.apply('os', 0)
+    if scaling:
+        fit_scaling(meth, exe_hash, speedups, resultsFile, placement)
+
+
+def _timeline_rows(file_rows, exe_hash):
+    """one row per RSS sample of each file and repeat, see sampler.track"""
+
+    rows = []
+    for r in file_rows:
+        for seconds, rss in r.get('timeline', []):
+            rows.append({'exe': r['exe'], 'exe_hash': exe_hash,
+                         'level': r['level'], 'threads': r['threads'],
+                         'file': r['file'], 'rep': r['rep'],
+                         'seconds': seconds, 'rss mb': rss / 1000000})
+    return rows
+
+
+def _utilization_rows(file_rows, exe_hash):
+    """one row per thread and per core for each CPU sample of each file and repeat, see utilization.summarize"""
+
+    thread_rows = []
+    core_rows = []
+    for r in file_rows:
+        keys = {'exe': r['exe'], 'exe_hash': exe_hash, 'level': r['level'],
+                'threads': r['threads'], 'file': r['file'], 'rep': r['rep']}
+        for seconds, thread, util in r.get('thread timeline', []):
+            row = dict(keys)
+            row.update({'seconds': seconds, 'thread': thread, 'utilization': util})
+            thread_rows.append(row)
+        for seconds, cpu, util in r.get('core timeline', []):
+            row = dict(keys)
+            row.update({'seconds': seconds, 'cpu': cpu, 'utilization': util})
+            core_rows.append(row)
+    return thread_rows, core_rows
+
+
+def _utilization_cell(rows):
+    """CPU use of the files in 'rows' (one repeat), each file weighted by its wall time"""
+
+    peaks = [r['peak cores'] for r in rows if r['peak cores'] == r['peak cores']]
+    cell = {'peak cores': max(peaks) if len(peaks) > 0 else float('nan'),
+            'cores used': max(r['cores used'] for r in rows)}
+    for key in ['active cores', 'main saturated %', 'writer saturated %']:
+        timed = [(r[key], r['wall']) for r in rows if r[key] == r[key]]
+        cell[key] = float('nan')
+        if len(timed) > 0 and sum(w for v, w in timed) > 0:
+            cell[key] = sum(v * w for v, w in timed) / sum(w for v, w in timed)
+    return cell
+
+
+def fit_scaling(meth, exe_hash, speedups, resultsFile, placement='os'):
+    """Fit Amdahl and Gustafson serial fractions to the speedups of each level
+
+    Parameters
+    ----------
+    meth : str
+        name of compression executable
+    exe_hash : str
+        hash of the executable, see results.exe_hash
+    speedups : dict
+        for each level a list of (threads, speedup) relative to one thread
+    resultsFile : str
+        SQLite file where the 'scaling' table is appended
+    placement : str
+        thread placement policy the speedups were measured with (default 'os')
+    """
+
+    print('exe\tlevel\tamdahl s\tgustafson s\tmax speedup\tthreads >= 75% efficient')
+    rows = []
+    for level, points in speedups.items():
+        if len(points) < 2:
+            continue
+        threads = [p[0] for p in points]
+        speedup = [p[1] for p in points]
+        amdahl = stats.amdahl_fit(threads, speedup)
+        gustafson = stats.gustafson_fit(threads, speedup)
+        limit = float('inf')
+        if amdahl > 0:
+            limit = 1 / amdahl
+        efficient = stats.efficient_threads(threads, speedup)
+        print('{}\t{}\t{:.3f}\t{:.3f}\t{:.1f}\t{}'.format(meth, level, amdahl,
+              gustafson, limit, efficient))
+        rows.append({'exe': meth, 'exe_hash': exe_hash, 'level': level,
+                     'max threads': max(threads), 'amdahl serial': amdahl,
+                     'gustafson serial': gustafson, 'max speedup': limit,
+                     'efficient threads': efficient, 'placement': placement})
+    if len(rows) > 0:
+        results.append(resultsFile, 'scaling', rows)
 
 
 def plot(resultsFile):
-    """Generate line-plot showing how compression speed increases with threads"""
+    """Generate line-plots showing how compression speed and peak memory increase with threads"""
 
     if not os.path.exists(resultsFile):
         print('No file named "' + resultsFile + '"')
@@ -128,13 +390,63 @@ def plot(resultsFile):
         return ()
     import seaborn as sns
     import matplotlib.pyplot as plt
-    df = pd.read_pickle(resultsFile)
+    df = results.load(resultsFile, 'cells',
+                      ['exe', 'speed mb/s', 'peak rss mb', 'threads', 'level'],
+                      'run_id = ?', (results.latest_run(resultsFile),))
     sns.set()
-    ax = sns.lineplot(x=' speed mb/s   ', y='threads', hue='exe',
-                      style='level', data=df, marker='o')
+    fig, (ax, ax_mem) = plt.subplots(1, 2, figsize=(12, 5))
+    sns.lineplot(x='speed mb/s', y='threads', hue='exe',
+                 style='level', data=df, marker='o', ax=ax)
     ax.set_title('Parallel Compression Speed')
+    sns.lineplot(x='peak rss mb', y='threads', hue='exe',
+                 style='level', data=df, marker='o', ax=ax_mem, legend=False)
+    ax_mem.set_title('Peak Memory')
     #plt.show()
-    plt.savefig(resultsFile.replace('.pkl', '.png'))
+    plt.savefig(resultsFile.replace('.db', '.png'))
+
+
+def plot_scaling(resultsFile):
+    """Generate line-plot of speedup versus threads, with ideal linear scaling for reference"""
+
+    if not os.path.exists(resultsFile):
+        print('No file named "' + resultsFile + '"')
+        return ()
+    if os.name == 'posix' and 'DISPLAY' not in os.environ:
+        print('Plot the results on a machine with a graphical display')
+        return ()
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    df = results.load(resultsFile, 'cells',
+                      ['exe', 'speedup', 'threads', 'level'],
+                      'run_id = ? AND speedup IS NOT NULL', (results.latest_run(resultsFile),))
+    sns.set()
+    plt.figure()
+    ax = sns.lineplot(x='threads', y='speedup', hue='exe',
+                      style='level', data=df, marker='o')
+    top = df['threads'].max()
+    ax.plot([1, top], [1, top], color='gray', linestyle=':')
+    ax.set_title('Speedup relative to one thread')
+    plt.savefig(resultsFile.replace('.db', '_scaling.png'))
+
+
+def plot_placement(resultsFile):
+    """Generate line-plots of compression speed versus threads for each placement policy, one panel per level"""
+
+    if not os.path.exists(resultsFile):
+        print('No file named "' + resultsFile + '"')
+        return ()
+    if os.name == 'posix' and 'DISPLAY' not in os.environ:
+        print('Plot the results on a machine with a graphical display')
+        return ()
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    df = results.load(resultsFile, 'cells',
+                      ['exe', 'speed mb/s', 'threads', 'level', 'placement'],
+                      'run_id = ?', (results.latest_run(resultsFile),))
+    sns.set()
+    sns.relplot(x='threads', y='speed mb/s', hue='placement', style='exe',
+                col='level', data=df, kind='line', marker='o')
+    plt.savefig(resultsFile.replace('.db', '_placement.png'))
 
 
 if __name__ == '__main__':
@@ -145,32 +457,108 @@ if __name__ == '__main__':
     indir : str
         folder with files to compress (default './corpus')
     repeats : int
-     how many times is each file compressed (default 3)    
+     how many times is each file compressed (default 7)    
+    --adaptive : float
+     repeat each cell until its 95% CI is narrower than this fraction of the median
+    --budget : float
+     maximum seconds spent on adaptive repeats of one cell (default 60)
+    --stream
+     compress to a pipe and count the output instead of writing .gz files
+    --storage : str
+     'disk' (default), 'warm' or 'cold' page cache, or 'ram' to stage the corpus in tmpfs
+    --scaling
+     test every thread count from 1 to the number of logical CPUs, report speedup and serial fraction
+    --threads : str
+     comma separated thread counts for the scaling sweep, e.g. 1,2,4,8,16,32,64
+    --perf
+     record cycles, instructions, IPC, branch and cache misses and context switches with perf stat
+    --timeline
+     sample the RSS of each compressor with psutil and store the timeline
+    --placement : str
+     comma separated thread placement policies: os (default), compact, spread, node, interleave
+    --preflight
+     check governor, turbo, load and temperature first, monitor each cell and re-run disturbed cells
+    --warmup : int
+     untimed repeats before each cell (default 0)
+    --retries : int
+     re-runs of a cell flagged by --preflight (default 2)
+    --cores
+     sample the CPU use of every compressor thread and core, report active cores and main/writer saturation
     """
 
-    indir = './silesia'
-    if len(sys.argv) > 1:
-        indir = sys.argv[1]
+    parser = argparse.ArgumentParser(description='Compression speed versus threads')
+    parser.add_argument('indir', nargs='?', default='./silesia', help='folder with files to compress')
+    parser.add_argument('repeats', nargs='?', type=int, default=7, help='repeats (minimum repeats when adaptive)')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='REL',
+                        help='repeat until the 95%% CI of the median is narrower than REL, e.g. 0.02')
+    parser.add_argument('--budget', type=float, default=60.0, help='maximum seconds for adaptive repeats of one cell')
+    parser.add_argument('--stream', action='store_true',
+                        help='compress to a pipe (-c) and count the bytes instead of writing files')
+    parser.add_argument('--storage', choices=staging.storage_modes, default='disk',
+                        help='disk: as is, warm/cold: page cache before each repeat, ram: stage corpus to tmpfs')
+    parser.add_argument('--scaling', action='store_true',
+                        help='test every thread count up to the logical CPU count and fit the serial fraction')
+    parser.add_argument('--threads', default='',
+                        help='comma separated thread counts for the scaling sweep (implies --scaling)')
+    parser.add_argument('--perf', action='store_true',
+                        help='record hardware performance counters with perf stat, if available')
+    parser.add_argument('--timeline', action='store_true',
+                        help='sample the memory (RSS) of each compressor while it runs')
+    parser.add_argument('--placement', default='os',
+                        help='comma separated placement policies: ' + ', '.join(topology.policies))
+    parser.add_argument('--preflight', action='store_true',
+                        help='check the host before timing, monitor each cell and re-run it on interference')
+    parser.add_argument('--warmup', type=int, default=0, help='untimed repeats before each cell')
+    parser.add_argument('--retries', type=int, default=2, help='re-runs of a cell disturbed by other load (with --preflight)')
+    parser.add_argument('--cores', action='store_true',
+                        help='sample per-thread and per-core CPU use from /proc while each compressor runs')
+    args = parser.parse_args()
+    indir = args.indir
+    perf.enabled = args.perf
+    preflight.enabled = args.preflight
+    utilization.enabled = args.cores
+    sampler.enabled = args.timeline
     if not os.path.isdir(indir):
         sys.exit('Run a_compile.py first: Unable to find ' + indir)
-    repeats = 7
-    if len(sys.argv) > 2:
-        repeats = int(sys.argv[2])
+    placements = args.placement.split(',')
+    for placement in placements:
+        if placement not in topology.policies:
+            sys.exit('Unknown placement "{}", choose from {}'.format(placement, ', '.join(topology.policies)))
+    thread_list = None
+    if len(args.threads) > 0:
+        thread_list = [int(x) for x in args.threads.split(',')]
+    elif args.scaling:
+        thread_list = list(range(1, psutil.cpu_count(logical = True) + 1))
+    indir, _ = staging.stage(indir, args.storage)
+    repeats = args.repeats
     exedir = './exe'
     if not os.path.isdir(exedir):
         sys.exit('Run 1compile.py before first: Unable to find '+ exedir)
-    resultsFile = ntpath.basename(indir)+'_speed_threads.pkl'
-    if os.path.exists(resultsFile):
-        os.remove(resultsFile)
+    resultsFile = ntpath.basename(indir)+'_speed_threads.db'
     max_threads = psutil.cpu_count(logical = False)
-    test_cmp('gzip', indir, 0, repeats, resultsFile)
-    for exe in os.listdir(exedir):
-        exe = os.path.join(exedir, exe)
-        if os.path.isfile(exe):
-            st = os.stat(exe)
-            mode = st.st_mode
-            executable = stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH
-            if mode & executable:
-                exe = os.path.abspath(exe)
-                test_cmp(exe, indir, max_threads, repeats, resultsFile)
+    if len(placements) > 1 or placements[0] != 'os':
+        cpus = topology.read()
+        print('{} logical CPUs, {} physical cores, NUMA nodes {}'.format(
+              len(cpus), topology.physical_cores(cpus),
+              ','.join(str(n) for n in topology.nodes(cpus))))
+    if args.preflight:
+        preflight.check()
+    for placement in placements:
+        test_cmp('gzip', indir, 0, repeats, resultsFile, args.adaptive, args.budget,
+                 args.stream, args.storage, None, placement, args.warmup, args.retries)
+        for exe in os.listdir(exedir):
+            exe = os.path.join(exedir, exe)
+            if os.path.isfile(exe):
+                st = os.stat(exe)
+                mode = st.st_mode
+                executable = stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH
+                if mode & executable:
+                    exe = os.path.abspath(exe)
+                    test_cmp(exe, indir, max_threads, repeats, resultsFile,
+                             args.adaptive, args.budget, args.stream, args.storage,
+                             thread_list, placement, args.warmup, args.retries)
     plot(resultsFile)
+    if thread_list is not None:
+        plot_scaling(resultsFile)
+    if len(placements) > 1:
+        plot_placement(resultsFile)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# In-process Python compression backends.
+#
+# Each backend is a dict: 'name' (the 'exe' column of the results tables),
+# 'module' (import name of the package, a backend is skipped when it is not
+# installed), 'ext', the default 'levels', and 'compress'/'decompress'
+# functions working on bytes. compress_chunks() splits the data into chunks
+# compressed by a thread pool. For the gzip and zstd backends every chunk is
+# a complete member or frame, so the joined chunks are a valid file that any
+# gzip or zstd tool can read. decompress_chunks() inflates the chunks in
+# parallel. These libraries release the GIL while they work, so threads scale
+# like pigz.
+# Backends with 'threads' set (mgzip) run their own thread pool instead.
+
+import gzip
+import zlib
+import importlib
+import importlib.metadata
+import concurrent.futures
+
+
+def _zlib_compress(data, lvl):
+    return zlib.compress(data, lvl)
+
+
+def _gzip_compress(data, lvl):
+    return gzip.compress(data, lvl, mtime=0)
+
+
+def _mgzip_compress(data, lvl, threads=0, chunk=10 ** 6):
+    import mgzip
+    return mgzip.compress(data, lvl, thread=threads or None, blocksize=chunk)
+
+
+def _mgzip_decompress(data, threads=0, chunk=10 ** 6):
+    import mgzip
+    return mgzip.decompress(data, thread=threads or None, blocksize=chunk)
+
+
+def _isal_compress(data, lvl):
+    from isal import igzip
+    return igzip.compress(data, lvl, mtime=0)
+
+
+def _isal_decompress(data):
+    from isal import igzip
+    return igzip.decompress(data)
+
+
+def _zlib_ng_compress(data, lvl):
+    from zlib_ng import gzip_ng
+    return gzip_ng.compress(data, lvl, mtime=0)
+
+
+def _zlib_ng_decompress(data):
+    from zlib_ng import gzip_ng
+    return gzip_ng.decompress(data)
+
+
+def _zstd_compress(data, lvl):
+    import zstandard
+    return zstandard.ZstdCompressor(level=lvl).compress(data)
+
+
+def _zstd_decompress(data):
+    import zstandard
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+backends = [
+    {'name': 'py-zlib', 'module': 'zlib', 'ext': '.zz', 'levels': range(1, 10),
+     'compress': _zlib_compress, 'decompress': zlib.decompress},
+    {'name': 'py-gzip', 'module': 'gzip', 'ext': '.gz', 'levels': range(1, 10),
+     'compress': _gzip_compress, 'decompress': gzip.decompress},
+    {'name': 'py-mgzip', 'module': 'mgzip', 'ext': '.gz', 'levels': range(1, 10),
+     'compress': _mgzip_compress, 'decompress': _mgzip_decompress, 'threads': True},
+    {'name': 'py-isal', 'module': 'isal', 'ext': '.gz', 'levels': range(0, 4),
+     'compress': _isal_compress, 'decompress': _isal_decompress},
+    {'name': 'py-zlib-ng', 'module': 'zlib_ng', 'ext': '.gz', 'levels': range(1, 10),
+     'compress': _zlib_ng_compress, 'decompress': _zlib_ng_decompress},
+    {'name': 'py-zstd', 'module': 'zstandard', 'ext': '.zst', 'levels': [1, 3, 5, 7, 9, 12, 15, 19],
+     'compress': _zstd_compress, 'decompress': _zstd_decompress},
+]
+
+
+def available(names=None):
+    """
+    backends whose package is installed
+
+    Parameters
+    ----------
+    names : list of str
+        only these backends, e.g. ['py-isal', 'py-zstd'] (default None, all)
+    """
+
+    found = []
+    for backend in backends:
+        if names is not None and backend['name'] not in names:
+            continue
+        try:
+            mod = importlib.import_module(backend['module'])
+        except ImportError:
+            print('Skipping test: Unable to import "' + backend['module'] + '"')
+            continue
+        backend = dict(backend)
+        backend['version'] = getattr(mod, '__version__', None) or ''
+        if len(backend['version']) < 1:
+            try:
+                backend['version'] = importlib.metadata.version(backend['module'])
+            except importlib.metadata.PackageNotFoundError:
+                pass
+        if backend['module'] in ['zlib', 'gzip']:
+            backend['version'] = zlib.ZLIB_RUNTIME_VERSION
+        found.append(backend)
+    return found
+
+
+def get(name):
+    """backend called 'name' (e.g. 'py-mgzip'), None if it is unknown or not installed"""
+
+    for backend in available([name]):
+        return backend
+    return None
+
+
+def _split(data, chunk):
+    view = memoryview(data)
+    if chunk < 1 or len(view) <= chunk:
+        return [view]
+    return [view[i:i + chunk] for i in range(0, len(view), chunk)]
+
+
+def compress_chunks(backend, data, lvl, pool=None, chunk=10 ** 6, threads=0):
+    """
+    compress 'data' as independent chunks
+
+    Parameters
+    ----------
+    backend : dict
+        entry of 'backends'
+    data : bytes
+        uncompressed data
+    lvl : int
+        compression level
+    pool : concurrent.futures.Executor
+        pool compressing the chunks (default None, one after the other)
+    chunk : int
+        uncompressed bytes per chunk, 0 for a single chunk (default 10**6)
+    threads : int
+        threads of backends with their own pool (default 0, their default)
+
+    Returns
+    -------
+    list of compressed chunks, b''.join() of them is a valid compressed file
+    """
+
+    if backend.get('threads', False):
+        return [backend['compress'](data, lvl, threads, chunk)]
+    pieces = _split(data, chunk)
+    if pool is None or len(pieces) < 2:
+        return [backend['compress'](piece, lvl) for piece in pieces]
+    return list(pool.map(lambda piece: backend['compress'](piece, lvl), pieces))
+
+
+def decompress_chunks(backend, chunks, pool=None, threads=0):
+    """
+    decompress a list of chunks made by compress_chunks
+
+    Parameters
+    ----------
+    backend : dict
+        entry of 'backends'
+    chunks : list of bytes
+        compressed chunks
+    pool : concurrent.futures.Executor
+        pool decompressing the chunks (default None, one after the other)
+    threads : int
+        threads of backends with their own pool (default 0, their default)
+
+    Returns
+    -------
+    uncompressed bytes
+    """
+
+    if backend.get('threads', False):
+        return b''.join(backend['decompress'](c, threads) for c in chunks)
+    if pool is None or len(chunks) < 2:
+        return b''.join(backend['decompress'](c) for c in chunks)
+    return b''.join(pool.map(backend['decompress'], chunks))
+
+
+def pool(threads):
+    """thread pool for compress_chunks/decompress_chunks, None for a single thread"""
+
+    if threads < 2:
+        return None
+    return concurrent.futures.ThreadPoolExecutor(max_workers=threads)
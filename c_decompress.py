@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 # python3 c_decompress.py        : test compression for files in folder 'corpus'
 # python3 c_decompress.py indir  : test compression for files in folder 'indir'
+# python3 c_decompress.py indir --storage ram : as above, with corpus and temporary files in RAM
+# python3 c_decompress.py indir --compressors zstd,xz,lz4 : compare gzip with these tools from compressors.json
 
 import sys
 import os
@@ -9,151 +11,134 @@ import sys
 import stat
 import ntpath
 import shutil
-import subprocess
-import time
-import filecmp
+import cache
+import validate
+import argparse
+import staging
+import runner
+import results
+import registry
 
 
-def compress_corpus(
-    exe,
-    indir,
-    tmpdir,
-    ext='.gz',
-    opts=' -q -f -k -',
-    max_level=9,
-    ):
+def compress_corpus(entry, indir, tmpdir):
     """
-    compress all files  in folder 'indir' using 'exe' and save to folder 'tmpdir'
+    compress all files  in folder 'indir' at every level of compressor 'entry'
+    and save to folder 'tmpdir', reusing cached outputs
     
     Parameters
     ----------
-    exe : str
-        name of compression executable
+    entry : dict
+        compressor from the registry, see registry.py
     indir : str
         folder with files to compress
     tmpdir : str
         folder where compressed files are saved
-    ext : str
-        folder with input files to compress        
-    opts : str
-        command line options for executable (default, ' -f -k -')         
-    max_level : int
-        maximum compression level to test (default 9)
         
     """
 
     size = 0
-    for lvl in range(1, max_level + 1):
+    exe = entry['exe']
+    ext = entry['ext']
+    # outputs of every known compressor are not inputs
+    exts = tuple(registry.exts(registry.load().values()))
+    for lvl in registry.levels(entry):
         for f in os.listdir(indir):
             if not os.path.isfile(os.path.join(indir, f)):
                 continue
             if f.startswith('.'):
                 continue
-            if not f.endswith('.zst') and not f.endswith('.gz') \
-                and not f.endswith('.bz2'):
+            if not f.endswith(exts):
                 fnm = os.path.join(indir, f)
                 size = size + os.stat(fnm).st_size
-                cmd = exe + ' -q -f -k -' + str(lvl) + ' "' + fnm + '"'
-                subprocess.call(cmd, shell=True)
-                outnm = ntpath.basename(fnm)
-                fnm = fnm + ext
-                if not os.path.isfile(fnm):
-                    sys.exit('Unable to find ' + fnm)
-                outnm = os.path.join(tmpdir, str(lvl) + '_' + outnm
-                        + ext)
-                shutil.move(fnm, outnm)
+                outnm = os.path.join(tmpdir, str(lvl) + '_' + f + ext)
+                if cache.fetch(exe, entry['compress'], lvl, fnm, outnm):
+                    continue
+                runner.run(registry.command(entry, 'compress', fnm, lvl))
+                if not os.path.isfile(fnm + ext):
+                    sys.exit('Unable to find ' + fnm + ext)
+                shutil.move(fnm + ext, outnm)
+                cache.store(exe, entry['compress'], lvl, fnm, outnm)
     bytes_per_mb = 1000000
     return size / bytes_per_mb
 
 
 def decompress_corpus(
-    exe,
+    entry,
     tmpdir,
     mb,
-    ext='.gz',
-    opts=' -q -f -k -d ',
+    storage='disk',
     ):
     """
-    decompress all files  in folder 'tmpdir' using 'exe' and save to folder 'tmpdir'
+    decompress all files  in folder 'tmpdir' using compressor 'entry' and save to folder 'tmpdir'
     
     Parameters
     ----------
-    exe : str
-        name of compression executable
+    entry : dict
+        compressor from the registry, see registry.py
     tmpdir : str
         folder with files to decompress
-    ext : str
-        folder with files to decompress        
-    opts : str
-        command line options for executable (default, ' -f -k -d ')         
+    mb : float
+        uncompressed megabytes of all files
+    storage : str
+        page cache state before timing, see staging.prepare (default 'disk')
         
     """
 
     print('Method\tms\tmb/s')
-    meth = ntpath.basename(exe)
-    t0 = time.time()
+    meth = ntpath.basename(entry['exe'])
+    staging.prepare(tmpdir, storage)
+    seconds = 0
     for f in os.listdir(tmpdir):
         if not os.path.isfile(os.path.join(tmpdir, f)):
             continue
         if f.startswith('.'):
             continue
-        if f.endswith(ext):
+        if f.endswith(entry['ext']):
             fnm = os.path.join(tmpdir, f)
-            cmd = exe + ' ' + opts + ' "' + fnm + '"'
-            subprocess.call(cmd, shell=True)
-    seconds = time.time() - t0
+            seconds += runner.run(registry.command(entry, 'decompress', fnm))['wall']
     speed = mb / seconds
     print('{}\t{:.0f}\t{:.2f}'.format(meth, seconds * 1000, speed))
 
 
-def tst_alt(indir='./corpus', exe='pbzip2'):
+def tst_alt(indir='./corpus', name='pbzip2', tmpdir='./temp', storage='disk'):
     """
-    time decompression for all files  in folder 'indir' using 'exe'
+    time decompression for all files  in folder 'indir' using compressor 'name'
     
     Parameters
     ----------
-    exe : str
-        name of compression executable
+    name : str
+        compressor in compressors.json, e.g. 'zstd'
     indir : str
         folder with files to compress/decompress      
+    tmpdir : str
+        temporary folder, it is emptied first (default './temp')
+    storage : str
+        page cache state before timing, see staging.prepare (default 'disk')
         
     """
 
-    if not os.path.exists(exe) and not shutil.which(exe):
-        print('Skipping test: Unable to find "' + exe + '"')
+    entry = registry.get(name)
+    if entry is None:
+        print('Skipping test: Unknown compressor "' + name + '"')
+        return ()
+    if not registry.installed(entry):
         return ()
-    executable = stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH
     if not os.path.isdir(indir):
         sys.exit('Run a_compile.py before running this script: Unable to find '
                   + indir)
-    tmpdir = './temp'
     if os.path.isdir(tmpdir):
         shutil.rmtree(tmpdir)
     try:
         os.mkdir(tmpdir)
     except OSError:
         print('Unable to create folder "' + tmpdir + '"')
-    if exe == 'pbzip2':
-        mb = compress_corpus(exe, indir, tmpdir, '.bz2')
-        decompress_corpus(exe, tmpdir, mb, '.bz2')
-    elif exe == 'zstd':
-        mb = compress_corpus(
-            exe,
-            indir,
-            tmpdir,
-            '.zst',
-            ' -T0 -q -f -k -',
-            19,
-            )
-        decompress_corpus(exe, tmpdir, mb, '.zst', ' -T0 -q -f -k -d ')
-    else:
-        print('Skipping test: Unknown compressor "' + exe + '"')
-        return ()
+    mb = compress_corpus(entry, indir, tmpdir)
+    decompress_corpus(entry, tmpdir, mb, storage)
 
 
 def compress_corpus_gz(methods, indir, tmpdir):
     """
-    compress all files  in folder 'indir' using each method
+    compress all files  in folder 'indir' using each method, reusing cached outputs
     
     Parameters
     ----------
@@ -167,6 +152,9 @@ def compress_corpus_gz(methods, indir, tmpdir):
     """
 
     size = 0
+    # outputs of every known compressor are not inputs
+    exts = tuple(registry.exts(registry.load().values()))
+    ext = registry.get('pigz')['ext']
     for method in methods:
         meth = ntpath.basename(method)
         for lvl in range(1, 10):
@@ -175,30 +163,28 @@ def compress_corpus_gz(methods, indir, tmpdir):
                     continue
                 if f.startswith('.'):
                     continue
-                if not f.endswith('.zst') and not f.endswith('.gz') \
-                    and not f.endswith('.bz2'):
+                if not f.endswith(exts):
                     fnm = os.path.join(indir, f)
                     size = size + os.stat(fnm).st_size
-                    cmd = method + ' -f -k -' + str(lvl) + ' "' + fnm \
-                        + '"'
-                    subprocess.call(cmd, shell=True)
-
-                    # outnm=os.path.splitext(ntpath.basename(fnm))[0]
-
-                    outnm = ntpath.basename(fnm)
-                    fnm = fnm + '.gz'
-                    if not os.path.isfile(fnm):
-                        sys.exit('Unable to find ' + fnm)
                     outnm = os.path.join(tmpdir, meth + str(lvl) + '_'
-                            + outnm + '.gz')
-                    shutil.move(fnm, outnm)
+                            + f + ext)
+                    if cache.fetch(method, ' -f -k -', lvl, fnm, outnm):
+                        continue
+                    runner.run(runner.command(method, ' -f -k -', lvl, fnm))
+                    if not os.path.isfile(fnm + ext):
+                        sys.exit('Unable to find ' + fnm + ext)
+                    shutil.move(fnm + ext, outnm)
+                    cache.store(method, ' -f -k -', lvl, fnm, outnm)
     bytes_per_mb = 1000000
     return size / bytes_per_mb
 
 
-def decompress_corpus_gz(methods, tmpdir, mb):
+def decompress_corpus_gz(methods, tmpdir, mb, storage='disk', results_file=''):
     """
     decompress all files  in folder 'tmpdir' using each method
+
+    Only the decompressor processes are timed: the wall time of every child
+    is summed, without the directory loop around them
     
     Parameters
     ----------
@@ -206,30 +192,51 @@ def decompress_corpus_gz(methods, tmpdir, mb):
         names of compression executables
     tmpdir : str
         folder with files to decompress      
+    mb : float
+        uncompressed megabytes of all files
+    storage : str
+        page cache state before timing each method, see staging.prepare (default 'disk')
+    results_file : str
+        SQLite file where per method 'cells' and per file 'files' rows are appended (default '', none)
         
     """
 
     print('Method\tms\tmb/s')
+    ext = registry.get('pigz')['ext']
     for method in methods:
         meth = ntpath.basename(method)
-        t0 = time.time()
+        exe_hash = results.exe_hash(method)
+        staging.prepare(tmpdir, storage)
+        file_rows = []
         for f in os.listdir(tmpdir):
             if not os.path.isfile(os.path.join(tmpdir, f)):
                 continue
             if f.startswith('.'):
                 continue
-            if f.endswith('.gz'):
+            if f.endswith(ext):
                 fnm = os.path.join(tmpdir, f)
-                cmd = method + ' -d -k -f -N "' + fnm + '"'
-                subprocess.call(cmd, shell=True)
-        seconds = time.time() - t0
+                row = {'exe': meth, 'exe_hash': exe_hash, 'mode': 'decompress',
+                       'file': f, 'storage': storage,
+                       'bytes_in': os.stat(fnm).st_size}
+                row.update(runner.run([method, '-d', '-k', '-f', '-N', fnm]))
+                file_rows.append(row)
+        seconds = sum(r['wall'] for r in file_rows)
         speed = mb / seconds
         print('{}\t{:.0f}\t{:.2f}'.format(meth, seconds * 1000, speed))
+        if len(results_file) > 0:
+            results.append(results_file, 'cells',
+                           [{'exe': meth, 'exe_hash': exe_hash, 'mode': 'decompress',
+                             'storage': storage, 'ms': seconds * 1000, 'speed mb/s': speed,
+                             'peak rss mb': max(r['maxrss'] for r in file_rows) / 1000000}])
+            results.append(results_file, 'files', file_rows)
 
 
-def decompress_corpus_validation_gz(methods, indir, tmpdir):
+def decompress_corpus_validation_gz(methods, indir, tmpdir, workers=0):
     """
     ensure compression/decompress of files does not corrupt data
+
+    Every method decompresses every .gz file to a pipe, and the output is
+    compared with cached digests of the original (see validate.py)
     
     Parameters
     ----------
@@ -239,12 +246,14 @@ def decompress_corpus_validation_gz(methods, indir, tmpdir):
         folder with accurately uncompressed files      
     tmpdir : str
         temporary folder for files to compress/decompress      
+    workers : int
+        number of files decompressed at once (default 0, one per logical CPU)
         
     """
 
     err = 0
+    jobs = []
     for exe in methods:
-        meth = ntpath.basename(exe)
         for f in os.listdir(tmpdir):
             if not os.path.isfile(os.path.join(tmpdir, f)):
                 continue
@@ -252,26 +261,20 @@ def decompress_corpus_validation_gz(methods, indir, tmpdir):
                 continue
             if f.endswith('.gz'):
                 fnm = os.path.join(tmpdir, f)
-                cmd = exe + ' -d -k -f -N "' + fnm + '"'
-                subprocess.call(cmd, shell=True)
                 fbase = os.path.splitext(f)[0]
                 fbase = fbase.split('_', 1)[1]
                 orignm = os.path.join(indir, fbase)
-                decompnm = os.path.join(tmpdir, fbase)
-                try:
-                    if not filecmp.cmp(orignm, decompnm):
-                        err = err + 1
-                        print(meth + ' files do not match: ' + orignm \
-                            + ' != ' + decompnm)
-                except:
+                if not os.path.isfile(orignm):
                     err = err + 1
-                    print(meth + ' files do not exist: ' + orignm \
-                        + ' != ' + decompnm)
+                    print(ntpath.basename(exe) + ' files do not exist: ' + orignm)
+                    continue
+                jobs.append(([exe, '-d', '-c', fnm], orignm))
+    err = err + validate.check_all(jobs, workers)
     if err < 1:
         print('no errors detected during validation')
 
 
-def tst_gz(indir='./corpus'):
+def tst_gz(indir='./corpus', tmpdir='./temp', storage='disk', results_file=''):
     """
     test decompression speed and accuracy of files in folder indir
     
@@ -279,6 +282,12 @@ def tst_gz(indir='./corpus'):
     ----------
     indir : str
         folder with uncompressed files to test (default, './corpus')     
+    tmpdir : str
+        temporary folder, it is emptied first (default './temp')
+    storage : str
+        page cache state before timing, see staging.prepare (default 'disk')
+    results_file : str
+        SQLite file where the decompression results are appended (default '', none)
         
     """
 
@@ -290,7 +299,6 @@ def tst_gz(indir='./corpus'):
     if not os.path.isdir(exedir):
         sys.exit('Run a_compile.py before running this script: Unable to find '
                   + exedir)
-    tmpdir = './temp'
     if os.path.isdir(tmpdir):
         shutil.rmtree(tmpdir)
     try:
@@ -306,17 +314,28 @@ def tst_gz(indir='./corpus'):
                 exeName = os.path.abspath(exeName)
                 methods.append(exeName)
     mb = compress_corpus_gz(methods, indir, tmpdir)
-    decompress_corpus_gz(methods, tmpdir, mb)
+    decompress_corpus_gz(methods, tmpdir, mb, storage, results_file)
     decompress_corpus_validation_gz(methods, indir, tmpdir)
 
 
 if __name__ == '__main__':
-    indir = './corpus'
-    if len(sys.argv) > 1:
-        indir = sys.argv[1]
+    parser = argparse.ArgumentParser(description='Decompression speed')
+    parser.add_argument('indir', nargs='?', default='./corpus', help='folder with files to compress')
+    parser.add_argument('--storage', choices=staging.storage_modes, default='disk',
+                        help='disk: as is, warm/cold: page cache before timing, ram: stage files to tmpfs')
+    parser.add_argument('--compressors', default='zstd,pbzip2',
+                        help='comma separated other tools from compressors.json, e.g. zstd,xz,lz4')
+    args = parser.parse_args()
+    indir = args.indir
     if not os.path.isdir(indir):
         sys.exit('Run 1compile.py before running this script: Unable to find '
                   + indir)
-    tst_gz(indir)
-    tst_alt(indir, 'zstd')
-    tst_alt(indir, 'pbzip2')
+    # every gz method writes 9 levels to temp, each also decompressed there
+    methods = 1
+    if os.path.isdir('./exe'):
+        methods += len(os.listdir('./exe'))
+    results_file = ntpath.basename(os.path.normpath(indir)) + '_decompress.db'
+    indir, tmpdir = staging.stage(indir, args.storage, './temp', methods * 9 * 1.5)
+    tst_gz(indir, tmpdir, args.storage, results_file)
+    for name in args.compressors.split(','):
+        tst_alt(indir, name, tmpdir, args.storage)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Content-addressed cache of compressed files shared by the benchmark scripts.
+#
+# Each entry is keyed by the hash of the compressor binary, its options and
+# level, and the hash of the input file, so decompression benchmarks can reuse
+# the outputs of previous runs until the binary or the corpus changes. The
+# least recently used entries are evicted once the cache exceeds its size cap.
+
+import os
+import shlex
+import shutil
+import hashlib
+import results
+
+cache_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cache')
+max_bytes = 10 * 1000 ** 3
+
+_usage = {}
+
+
+def key(exe, opts, lvl, fnm):
+    """
+    cache key for the output of compressing file 'fnm' with executable 'exe'
+
+    Parameters
+    ----------
+    exe : str
+        name of compression executable
+    opts : str
+        command line options for executable, e.g. ' -q -f -k -'
+    lvl : int
+        compression level
+    fnm : str
+        name of uncompressed input file
+    """
+
+    h = hashlib.sha256()
+    for item in [results.exe_hash(exe), ' '.join(shlex.split(opts)), str(lvl),
+                 results.file_hash(fnm)]:
+        h.update(item.encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _entry(k, cachedir):
+    return os.path.join(cachedir, k[:2], k)
+
+
+def fetch(exe, opts, lvl, fnm, outnm, cachedir=''):
+    """
+    copy a cached compressed version of 'fnm' to 'outnm'
+
+    Parameters
+    ----------
+    exe : str
+        name of compression executable
+    opts : str
+        command line options for executable
+    lvl : int
+        compression level
+    fnm : str
+        name of uncompressed input file
+    outnm : str
+        where the compressed file is wanted
+    cachedir : str
+        cache folder (default '', use cache.cache_dir)
+
+    Returns
+    -------
+    True if the file was found in the cache
+    """
+
+    if len(cachedir) < 1:
+        cachedir = cache_dir
+    entry = _entry(key(exe, opts, lvl, fnm), cachedir)
+    if not os.path.isfile(entry):
+        return False
+    # mtime records when an entry was last used, for LRU eviction
+    os.utime(entry)
+    if os.path.exists(outnm):
+        os.remove(outnm)
+    try:
+        os.link(entry, outnm)
+    except OSError:
+        shutil.copyfile(entry, outnm)
+    return True
+
+
+def store(exe, opts, lvl, fnm, compressed, cachedir='', limit=0):
+    """
+    add compressed file 'compressed', made from 'fnm', to the cache
+
+    Parameters
+    ----------
+    exe : str
+        name of compression executable
+    opts : str
+        command line options for executable
+    lvl : int
+        compression level
+    fnm : str
+        name of uncompressed input file
+    compressed : str
+        name of compressed file created by exe
+    cachedir : str
+        cache folder (default '', use cache.cache_dir)
+    limit : int
+        size cap in bytes (default 0, use cache.max_bytes)
+    """
+
+    if len(cachedir) < 1:
+        cachedir = cache_dir
+    entry = _entry(key(exe, opts, lvl, fnm), cachedir)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmpnm = entry + '.tmp'
+    shutil.copyfile(compressed, tmpnm)
+    os.replace(tmpnm, entry)
+    if limit < 1:
+        limit = max_bytes
+    if cachedir not in _usage:
+        evict(cachedir, limit)
+    else:
+        _usage[cachedir] += os.stat(entry).st_size
+        if _usage[cachedir] > limit:
+            evict(cachedir, limit)
+
+
+def evict(cachedir='', limit=0):
+    """
+    remove least recently used entries until the cache is no larger than 'limit' bytes
+
+    Parameters
+    ----------
+    cachedir : str
+        cache folder (default '', use cache.cache_dir)
+    limit : int
+        size cap in bytes (default 0, use cache.max_bytes)
+    """
+
+    if len(cachedir) < 1:
+        cachedir = cache_dir
+    if limit < 1:
+        limit = max_bytes
+    entries = []
+    total = 0
+    for root, dirs, files in os.walk(cachedir):
+        if root == cachedir:
+            # entries live in subfolders, files at the top (e.g. digests) are kept
+            continue
+        for f in files:
+            fnm = os.path.join(root, f)
+            st = os.stat(fnm)
+            entries.append((st.st_mtime, st.st_size, fnm))
+            total += st.st_size
+    entries.sort()
+    for mtime, size, fnm in entries:
+        if total <= limit:
+            break
+        os.remove(fnm)
+        total -= size
+    _usage[cachedir] = total
@@ -6,120 +6,132 @@
 import os
 import sys
 import stat
-import time
-import shutil
 import ntpath
-import subprocess
-import pandas as pd
+import argparse
+import stats
+import runner
+import results
+import perf
+import registry
 
 
 def _cmp(
-    exe,
+    entry,
     fnm,
     lvl,
-    opts=' -f -k -',
     ):
     """
-    compress file 'fnm' using executable 'exe'
+    compress file 'fnm' using compressor 'entry'
     
     Parameters
     ----------
-    exe : str
-        name of compression executable
+    entry : dict
+        compressor from the registry, see registry.py
     fnm : str
         name of file to be compressed
     lvl : int
         compression level
-    opts : str
-        command line options for executable (default, ' -f -k -')                
+
+    Returns
+    -------
+    dict with wall, user and sys seconds and peak memory of the child process
     """
 
-    env = os.environ
-    cmd = exe + opts + str(lvl) + ' "' + fnm + '"'
-    subprocess.call(cmd, shell=True)
+    return runner.run(registry.command(entry, 'compress', fnm, lvl))
 
 
 def test_cmp(
-    exe='gzip',
+    entry,
     indir='',
     repeats=1,
-    ext='.gz',
-    opts=' -q -f -k -',
-    max_level=9,
+    results_file='speed_size.db',
+    rel_width=0,
+    budget=60.0,
     ):
     """
-    compress all files in folder 'indir' using executable 'exe'
+    compress all files in folder 'indir' at every level of compressor 'entry'
     
     Parameters
     ----------
-    exe : str
-        name of compression executable
+    entry : dict
+        compressor from the registry, see registry.py
     indir : str
         name of folder with files to compress
     repeats : int
         how many times is each file compressed. More is slower but better timing accuracy
-    ext : str
-        extension for files created by exe (default, '.gz')
-    opts : str
-        command line options for executable (default, ' -f -k -')
-    max_level : int
-        maximum compression level to test (default 9)            
+    results_file : str
+        SQLite file where results are appended (default 'speed_size.db')
+    rel_width : float
+        repeat each level until the 95% CI of the median time is narrower than
+        this fraction of it (default 0, exactly 'repeats' repeats)
+    budget : float
+        maximum seconds spent on adaptive repeats of one level (default 60)
     """
 
-    if not os.path.exists(exe) and not shutil.which(exe):
-        print('Skipping test: Unable to find "' + exe + '"')
+    if not registry.installed(entry):
         return ()
+    exe = entry['exe']
+    ext = entry['ext']
+    # outputs of every known compressor are skipped, and removed at the end
+    exts = tuple(registry.exts(registry.load().values()))
     if len(indir) < 1:
         indir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'corpus')
     if not os.path.isdir(indir):
         print('Run a_compile.py first: Unable to find "' + indir +'"')
         sys.exit()
     meth = ntpath.basename(exe)
-    print('Method\tLevel\tms\tmb/s\t%')
-    for lvl in range(1, max_level + 1):
-        t0 = time.time()
-        size = 0
-        nsize = 0
-        for rep in range(repeats):
+    exe_hash = results.exe_hash(exe)
+    print('Method\tLevel\tms\tmb/s\t%\tmedian\tci %\tn')
+    for lvl in registry.levels(entry):
+        reps = []
+
+        def measure():
+            rep_rows = []
             for f in os.listdir(indir):
                 if not os.path.isfile(os.path.join(indir, f)):
                     continue
                 if f.startswith('.'):
                     continue
-                if not f.endswith('.zst') and not f.endswith('.gz') \
-                    and not f.endswith('.bz2'):
+                if not f.endswith(exts):
                     fnm = os.path.join(indir, f)
-                    _cmp(exe, fnm, lvl, opts)
-                    if rep > 0:
-                        continue
-                    size = size + os.stat(fnm).st_size
-                    nsize = nsize + os.stat(fnm + ext).st_size
-        size = size * repeats
-        nsize = nsize * repeats
-        seconds = time.time() - t0
+                    # 0: the default thread count of the compressor, as in b_speed_threads.py
+                    row = {'exe': meth, 'exe_hash': exe_hash, 'level': lvl,
+                           'threads': 0, 'file': f, 'rep': len(reps)}
+                    row.update(_cmp(entry, fnm, lvl))
+                    row['bytes_in'] = os.stat(fnm).st_size
+                    row['bytes_out'] = os.stat(fnm + ext).st_size
+                    rep_rows.append(row)
+            reps.append(rep_rows)
+            return sum(r['wall'] for r in rep_rows)
+
+        summary = stats.repeat(measure, repeats, rel_width, budget)
+        size = sum(r['bytes_in'] for r in reps[0])
+        nsize = sum(r['bytes_out'] for r in reps[0])
+        seconds = summary['min']
+        best = min(reps, key=lambda rows: sum(r['wall'] for r in rows))
 
       # bytes_per_mb = 1024**2
 
         bytes_per_mb = 1000000
         speed = size / bytes_per_mb / seconds
-        print('{}\t{}\t{:.0f}\t{:.0f}\t{:.2f}'.format(meth, lvl,
-                seconds * 1000, speed, nsize / size * 100))
-        row_df = pd.DataFrame([[meth, nsize / size * 100, speed, lvl]])
-        row_df.columns = ['exe', 'size %', 'speed mb/s', 'level']
-        try:
-            df = pd.read_pickle('speed_size.pkl')
-            df = pd.concat([row_df, df], ignore_index=True)
-        except (OSError, IOError) as e:
-            df = row_df
-        df.to_pickle('speed_size.pkl')
+        print('{}\t{}\t{:.0f}\t{:.0f}\t{:.2f}\t{:.0f}\t{:.1f}\t{}'.format(meth, lvl,
+                seconds * 1000, speed, nsize / size * 100,
+                summary['median'] * 1000, summary['rel_ci'] * 100, summary['n']))
+        row = {'exe': meth, 'exe_hash': exe_hash, 'size %': nsize / size * 100,
+               'speed mb/s': speed, 'level': lvl, 'threads': 0}
+        row.update(stats.cell_fields(summary))
+        row.update(perf.totals(best))
+        row['peak rss mb'] = max(r['maxrss'] for r in best) / bytes_per_mb
+        results.append(results_file, 'cells', [row])
+        # per file and per repeat resource usage
+        results.append(results_file, 'files', [r for rows in reps for r in rows])
 
     # clean up
 
     for f in os.listdir(indir):
         if not os.path.isfile(os.path.join(indir, f)):
             continue
-        if f.endswith('.zst') or f.endswith('.gz') or f.endswith('.bz2'
-                ):
+        if f.endswith(exts):
             fnm = os.path.join(indir, f)
             os.remove(fnm)
 
@@ -130,7 +142,7 @@ def plot(resultsFile):
     Parameters
     ----------
     resultsFile : str
-        name of pickle format file to plot  
+        name of SQLite results file to plot  
     """
 
     if os.name == 'posix' and 'DISPLAY' not in os.environ:
@@ -138,7 +150,8 @@ def plot(resultsFile):
         exit()
     import seaborn as sns
     import matplotlib.pyplot as plt
-    df = pd.read_pickle(resultsFile)
+    df = results.load(resultsFile, 'cells', ['exe', 'speed mb/s', 'size %'],
+                      'run_id = ?', (results.latest_run(resultsFile),))
     sns.set()
     ax = sns.lineplot(x='speed mb/s', y='size %', hue='exe', data=df, marker='o')
     plt.show()
@@ -153,27 +166,35 @@ if __name__ == '__main__':
         folder with files to compress (default './corpus')
     repeats : int
      how many times is each file compressed. More (default 1)    
+    --adaptive : float
+     repeat each level until its 95% CI is narrower than this fraction of the median
+    --budget : float
+     maximum seconds spent on adaptive repeats of one level (default 60)
+    --perf
+     record cycles, instructions, IPC, branch and cache misses and context switches with perf stat
+    --compressors : str
+     comma separated tools from compressors.json (default pbzip2,zstd,gzip)
     """
 
-    indir = ''
-    if len(sys.argv) > 1:
-        indir = sys.argv[1]
-    repeats = 1
-    if len(sys.argv) > 2:
-        repeats = int(sys.argv[2])
-    resultsFile = 'speed_size.pkl'
-    if os.path.exists(resultsFile):
-        os.remove(resultsFile)
-    test_cmp('pbzip2', indir, repeats, '.bz2')
-    test_cmp(
-        'zstd',
-        indir,
-        repeats,
-        '.zst',
-        ' -T0 -q -f -k -',
-        19,
-        )
-    test_cmp('gzip', indir, repeats)
+    parser = argparse.ArgumentParser(description='Compression speed versus size')
+    parser.add_argument('indir', nargs='?', default='', help='folder with files to compress')
+    parser.add_argument('repeats', nargs='?', type=int, default=1, help='repeats (minimum repeats when adaptive)')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='REL',
+                        help='repeat until the 95%% CI of the median is narrower than REL, e.g. 0.02')
+    parser.add_argument('--budget', type=float, default=60.0, help='maximum seconds for adaptive repeats of one level')
+    parser.add_argument('--perf', action='store_true',
+                        help='record hardware performance counters with perf stat, if available')
+    parser.add_argument('--compressors', default='pbzip2,zstd,gzip',
+                        help='comma separated tools from compressors.json, e.g. zstd,xz,lz4,brotli')
+    args = parser.parse_args()
+    indir = args.indir
+    perf.enabled = args.perf
+    repeats = args.repeats
+    resultsFile = 'speed_size.db'
+    names = args.compressors.split(',')
+    for entry in registry.selected(names):
+        test_cmp(entry, indir, repeats, rel_width=args.adaptive,
+                 budget=args.budget)
 
     # test pigz variants
 
@@ -186,5 +207,6 @@ if __name__ == '__main__':
             mode = st.st_mode
             if mode & executable:
                 exe = os.path.abspath(exe)
-                test_cmp(exe, indir, repeats)
+                test_cmp(registry.get('pigz', exe), indir, repeats, rel_width=args.adaptive,
+                         budget=args.budget)
     plot(resultsFile)
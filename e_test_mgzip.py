@@ -1,53 +1,45 @@
 #!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 e_test_mgzip.py          : test mgzip on folder 'corpus'
+# python3 e_test_mgzip.py indir    : test mgzip on folder 'indir'
+# python3 e_test_mgzip.py indir 3  : as above, with 3 repeats of each level
+# l_python_backends.py runs the same test for every installed Python library
 
-import os       
-import gzip
-import shutil
-from glob import glob
-import time
-import mgzip
+import os
 import sys
-#import gzip
+import ntpath
+import argparse
+import backends
+import g_zlib_inprocess
+import l_python_backends
 
-def _cmp(fnm, lvl):
-    #print('>>>'+fnm)
-    fh = open(fnm, "rb")
-    #gh = mgzip.open(fnm + ".gz", "wb", compresslevel=lvl)
-    #thread=8, blocksize=2*10**8
-    #gh = gzip.open(fnm + ".gz", "wb", compresslevel=lvl)
-    gh = mgzip.open(fnm + ".gz", "wb", compresslevel=lvl, blocksize=10**6)
-    data = fh.read()
-    gh.write(data)
-    gh.close()
-
-indir = os.path.join((os.path.dirname(os.path.realpath(__file__))), "corpus")
-if (len(sys.argv) > 1):
-    indir = sys.argv[1]
-if (not os.path.isdir(indir)):
-    print("Unable to find "+indir)
-    sys.exit()
-print('Method\tLevel\tms\tmb/s\t%')
-for i in [1, 2, 3, 4, 5, 6, 7, 8, 9]:
-  t0 = time.time()
-  size = 0
-  nsize = 0
-  for f in os.listdir(indir):
-    if not os.path.isfile(os.path.join(indir, f)):
-        continue;
-    if f.startswith('.'):
-        continue;
-    if not f.endswith(".gz"):
-        fnm = os.path.join(indir, f)
-        _cmp(fnm, i)
-        size = size + os.stat(fnm).st_size
-        nsize = nsize + os.stat(fnm + ".gz").st_size
-  seconds = time.time() - t0
-  #bytesPerMb = 1024**2
-  bytesPerMb = 1000000
-  speed = (size / bytesPerMb)/seconds
-  print("mgzip\t{}\t{:.0f}\t{:.0f}\t{:.2f}".format(i, seconds*1000, speed, nsize/size*100))
-   
-  #print("Compressed {:.2f} MB data in {:.2f} S, Speed: {:.2f} MB/s, Rate: {:.2f} %".format(size / bytesPerMb, seconds, speed, nsize/size*100))
-            
+if __name__ == '__main__':
+    """Compression and decompression speed of mgzip
 
+    Parameters
+    ----------
+    indir : str
+        folder with files to compress (default './corpus')
+    repeats : int
+     how many times is each file compressed (default 1)
+    --threads : int
+     mgzip threads (default 0, one per CPU)
+    """
 
+    parser = argparse.ArgumentParser(description='mgzip speed')
+    parser.add_argument('indir', nargs='?',
+                        default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'corpus'),
+                        help='folder with files to compress')
+    parser.add_argument('repeats', nargs='?', type=int, default=1, help='repeats')
+    parser.add_argument('--threads', type=int, default=0, help='mgzip threads')
+    args = parser.parse_args()
+    if not os.path.isdir(args.indir):
+        sys.exit('Unable to find ' + args.indir)
+    backend = backends.get('py-mgzip')
+    if backend is None:
+        sys.exit('Install mgzip: pip install mgzip')
+    corpus = g_zlib_inprocess.read_corpus(args.indir)
+    results_file = ntpath.basename(os.path.normpath(args.indir)) + '_speed_size.db'
+    print('Backend\tLevel\tThreads\tcomp mb/s\tdecomp mb/s\t%')
+    l_python_backends.test_backend(backend, corpus, range(1, 10), [args.threads],
+                                   10 ** 6, args.repeats, results_file=results_file)
@@ -6,84 +6,112 @@
 import os
 import sys
 import stat
-import time
+import argparse
 import shutil
 import ntpath
-import filecmp
-import subprocess
-import pandas as pd
+import cache
+import validate
+import stats
+import runner
+import staging
+import results
+import perf
+import registry
 import seaborn as sns
 import matplotlib.pyplot as plt
 
 def _cmp(
-    exe,
+    entry,
     fnm,
     lvl,
-    opts=' -f -k -'):
+    stream=False):
     """
-    compress file 'fnm' using executable 'exe'
+    compress file 'fnm' using compressor 'entry'
     
     Parameters
     ----------
-    exe : str
-        name of compression executable
+    entry : dict
+        compressor from the registry, see registry.py
     fnm : str
         name of file to be compressed
     lvl : int
         compression level
-    opts : str
-        command line options for executable (default, ' -f -k -')                
+    stream : bool
+        write to a pipe (-c) and count the output instead of saving it (default False)
+
+    Returns
+    -------
+    dict with wall, user and sys seconds and peak memory of the child process
     """
 
-    env = os.environ
-    cmd = exe + opts + str(lvl) + ' "' + fnm + '"'
-    subprocess.call(cmd, shell=True)
+    if stream:
+        return runner.run_stream(registry.command(entry, 'compress', fnm, lvl, stdout=True))
+    return runner.run(registry.command(entry, 'compress', fnm, lvl))
+
+
+def _dcmp(entry, fnm, stream=False):
+    """
+    decompress file 'fnm' using compressor 'entry', see _cmp
+    """
+
+    if stream:
+        return runner.run_stream(registry.command(entry, 'decompress', fnm, stdout=True))
+    return runner.run(registry.command(entry, 'decompress', fnm))
 
 
 def test_cmp(
-    exe='gzip',
+    entry,
     indir='',
     repeats=1,
-    ext='.gz',
-    opts=' -q -f -k -',
-    max_level=9,
-    exts=['.gz', '.zstd']
+    exts=['.gz', '.zstd'],
+    rel_width=0,
+    budget=60.0,
+    stream=False,
+    storage='disk',
     ):
     """
-    compress all files in folder 'indir' using executable 'exe'
+    compress all files in folder 'indir' at every level of compressor 'entry'
     
     Parameters
     ----------
-    exe : str
-        name of compression executable
+    entry : dict
+        compressor from the registry, see registry.py
     indir : str
         name of folder with files to compress
     repeats : int
         how many times is each file compressed. More is slower but better timing accuracy
-    ext : str
-        extension for files created by exe (default, '.gz')
-    opts : str
-        command line options for executable (default, ' -f -k -')
-    max_level : int
-        maximum compression level to test (default 9)            
+    exts : list of str
+        all possible compression extensions, these files are not compressed
+    rel_width : float
+        repeat each level until the 95% CI of the median time is narrower than
+        this fraction of it (default 0, exactly 'repeats' repeats)
+    budget : float
+        maximum seconds spent on adaptive repeats of one level (default 60)
+    stream : bool
+        compress to a pipe and count the output, nothing is written to disk (default False)
+    storage : str
+        page cache state before each repeat, see staging.prepare (default 'disk')
     """
 
-    if not os.path.exists(exe) and not shutil.which(exe):
-        print('Skipping test: Unable to find "' + exe + '"')
+    if not registry.installed(entry):
         return ()
+    exe = entry['exe']
+    ext = entry['ext']
     if len(indir) < 1:
         indir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'corpus')
     if not os.path.isdir(indir):
         print('Run a_compile.py first: Unable to find "' + indir +'"')
         sys.exit()
     meth = ntpath.basename(exe)
-    print('CompressMethod\tLevel\tms\tmb/s\t%')
-    for lvl in range(1, max_level + 1):
-        size = 0
-        nsize = 0
-        seconds = float("inf")
-        for rep in range(repeats):
-            rep_seconds = time.time()
+    print('CompressMethod\tLevel\tms\tmb/s\t%\tcpu s/gb\tmedian\tci %\tn')
+    exe_hash = results.exe_hash(exe)
+    results_file = ntpath.basename(indir)+'_speed_size.db'
+    for lvl in registry.levels(entry):
+        reps = []
+
+        def measure():
+            staging.prepare(indir, storage)
+            rep_rows = []
             for f in os.listdir(indir):
                 if not os.path.isfile(os.path.join(indir, f)):
                     continue
@@ -92,30 +120,39 @@ def test_cmp(
                 if f.endswith(tuple(exts)):
                     continue
                 fnm = os.path.join(indir, f)
-                _cmp(exe, fnm, lvl, opts)
-                if rep > 0:
-                    continue
-                size = size + os.stat(fnm).st_size
-                nsize = nsize + os.stat(fnm + ext).st_size
-            rep_seconds = time.time() - rep_seconds
-            seconds = min(seconds, rep_seconds)
-        size = size
-        nsize = nsize
+                # 0: the default thread count of the compressor, as in b_speed_threads.py
+                row = {'exe': meth, 'exe_hash': exe_hash, 'mode': 'compress',
+                       'level': lvl, 'threads': 0, 'file': f, 'rep': len(reps),
+                       'stream': int(stream), 'storage': storage}
+                row.update(_cmp(entry, fnm, lvl, stream))
+                row['bytes_in'] = os.stat(fnm).st_size
+                if not stream:
+                    row['bytes_out'] = os.stat(fnm + ext).st_size
+                rep_rows.append(row)
+            reps.append(rep_rows)
+            return sum(r['wall'] for r in rep_rows)
+
+        summary = stats.repeat(measure, repeats, rel_width, budget)
+        seconds = summary['min']
+        best = min(reps, key=lambda rows: sum(r['wall'] for r in rows))
+        size = sum(r['bytes_in'] for r in best)
+        nsize = sum(r['bytes_out'] for r in best)
       # bytes_per_mb = 1024**2
 
         bytes_per_mb = 1000000
         speed = size / bytes_per_mb / seconds
-        print('{}\t{}\t{:.0f}\t{:.0f}\t{:.2f}'.format(meth, lvl,
-                seconds * 1000, speed, nsize / size * 100))
-        row_df = pd.DataFrame([[meth, nsize / size * 100, speed, lvl]])
-        row_df.columns = ['exe', 'size %', 'speed mb/s', 'level']
-        results_file = ntpath.basename(indir)+'_speed_size.pkl'
-        try:
-            df = pd.read_pickle(results_file)
-            df = pd.concat([row_df, df], ignore_index=True)
-        except (OSError, IOError) as e:
-            df = row_df
-        df.to_pickle(results_file)
+        cpu_gb = runner.cpu_seconds_per_gb(best)
+        print('{}\t{}\t{:.0f}\t{:.0f}\t{:.2f}\t{:.2f}\t{:.0f}\t{:.1f}\t{}'.format(meth, lvl,
+                seconds * 1000, speed, nsize / size * 100, cpu_gb,
+                summary['median'] * 1000, summary['rel_ci'] * 100, summary['n']))
+        row = {'exe': meth, 'exe_hash': exe_hash, 'mode': 'compress',
+               'size %': nsize / size * 100, 'speed mb/s': speed, 'level': lvl,
+               'threads': 0, 'cpu s/gb': cpu_gb, 'stream': int(stream), 'storage': storage}
+        row.update(stats.cell_fields(summary))
+        row.update(perf.totals(best))
+        row['peak rss mb'] = max(r['maxrss'] for r in best) / bytes_per_mb
+        results.append(results_file, 'cells', [row])
+        results.append(results_file, 'files', [row for rows in reps for row in rows])
     # clean up
     for f in os.listdir(indir):
         if not os.path.isfile(os.path.join(indir, f)):
@@ -130,49 +167,46 @@ def plot(results_file):
     Parameters
     ----------
     results_file : str
-        name of pickle format file to plot  
+        name of SQLite results file to plot  
     """
 
     #if os.name == 'posix' and 'DISPLAY' not in os.environ:
     #    print('Plot the results on a machine with a graphical display')
     #    exit()
-    df = pd.read_pickle(results_file)
+    df = results.load(results_file, 'cells', ['exe', 'speed mb/s', 'size %'],
+                      "mode = 'compress' AND run_id = ?",
+                      (results.latest_run(results_file),))
     sns.set()
     sns_plot = sns.lineplot(x='speed mb/s', y='size %', hue='exe', data=df, marker='o')
     #plt.show()
-    plt.savefig(results_file.replace('.pkl', '.png'))
+    plt.savefig(results_file.replace('.db', '.png'))
 
-def validate_decompress_corpus(exe, indir, tmpdir):
+def validate_decompress_corpus(entry, indir, tmpdir, workers=0):
     """
-    time decompression of all files in folder 'indir'
+    check that decompressing every file in 'tmpdir' restores the original in 'indir'
+
+    The output of each file is streamed from a pipe and compared with cached
+    digests of the original (see validate.py), several files at a time
     
     Parameters
     ----------
-    exe : dictionary
-       'exe' : str, exectuable name, e.g. 'zstd'
-       'uncompress': str, arguments, e.g.  ' -T0 -q -f -k -d '
-       'compress': str, arguemnt for compression, e.g. ' -T0 -q -f -k -' 
-       'max_level': int, maximum supported compression level, eg 19, 
-       'ext': extension used by this compressor, e.g. '.zst'
+    entry : dict
+        compressor from the registry, see registry.py
     indir : str
         folder with refence copies of uncompressed files 
     tmpdir : str
         folder with files to decompress 
-     
-    size_mb : float
-        uncompressed size for all files in indir
-    repeats : int
-        number of times each item is decompressed
+    workers : int
+        number of files decompressed at once (default 0, one per logical CPU)
 
     """
 
-    method = exe['exe']
-    ext = exe['ext']
-    opt = exe['uncompress']
-    meth = ntpath.basename(method)
-    if not os.path.exists(method) and not shutil.which(method):
-        print('Skipping test: Unable to find "' + method + '"')
+    if not registry.installed(entry):
         return ()
+    method = entry['exe']
+    ext = entry['ext']
+    meth = ntpath.basename(method)
+    jobs = []
     for f in os.listdir(tmpdir):
         if not os.path.isfile(os.path.join(tmpdir, f)):
             continue
@@ -180,50 +214,55 @@ def validate_decompress_corpus(exe, indir, tmpdir):
             continue
         if f.endswith(ext):
             fnm = os.path.join(tmpdir, f)
-            cmd = method + ' ' + opt + ' "' + fnm + '"'
-            subprocess.call(cmd, shell=True)
             fbase = os.path.splitext(f)[0]
-            decompnm = os.path.join(tmpdir, fbase)
-            if not os.path.isfile(decompnm):
-                sys.exit('Unable to find decompressed ' + decompnm)
             fbase = fbase.split('_', 1)[1]
             orignm = os.path.join(indir, fbase)
             if not os.path.isfile(orignm):
                 sys.exit('Unable to find reference ' + orignm)
-            if not filecmp.cmp(orignm, decompnm):
-                sys.exit('Files differ "{}":{}'.format(orignm, decompnm))
+            jobs.append((registry.command(entry, 'decompress', fnm, stdout=True), orignm))
+    if validate.check_all(jobs, workers) > 0:
+        sys.exit(meth + ' failed validation')
 
-def decompress_corpus(exe, indir, size_mb, repeats):
+def decompress_corpus(entry, indir, size_mb, repeats, results_file='', rel_width=0,
+                      budget=60.0, stream=False, storage='disk'):
     """
     time decompression of all files in folder 'indir'
     
     Parameters
     ----------
-    exe : dictionary
-       'exe' : str, exectuable name, e.g. 'zstd'
-       'uncompress': str, arguments, e.g.  ' -T0 -q -f -k -d '
-       'compress': str, arguemnt for compression, e.g. ' -T0 -q -f -k -' 
-       'max_level': int, maximum supported compression level, eg 19, 
-       'ext': extension used by this compressor, e.g. '.zst'
+    entry : dict
+        compressor from the registry, see registry.py
     indir : str
         folder with files to decompress      
     size_mb : float
         uncompressed size for all files in indir
     repeats : int
         number of times each item is decompressed
+    results_file : str
+        SQLite file where results are appended (default '', do not save)
+    rel_width : float
+        repeat until the 95% CI of the median time is narrower than this
+        fraction of it (default 0, exactly 'repeats' repeats)
+    budget : float
+        maximum seconds spent on adaptive repeats (default 60)
+    stream : bool
+        decompress to a pipe (-c) and count the output instead of saving it (default False)
+    storage : str
+        page cache state before each repeat, see staging.prepare (default 'disk')
 
     """
 
-    method = exe['exe']
-    ext = exe['ext']
-    opt = exe['uncompress']
-    meth = ntpath.basename(method)
-    if not os.path.exists(method) and not shutil.which(method):
-        print('Skipping test: Unable to find "' + method + '"')
+    if not registry.installed(entry):
         return ()
-    seconds = float("inf")
-    for r in range(repeats):
-        rep_seconds = time.time()
+    method = entry['exe']
+    ext = entry['ext']
+    meth = ntpath.basename(method)
+    exe_hash = results.exe_hash(method)
+    reps = []
+
+    def measure():
+        staging.prepare(indir, storage)
+        rep_rows = []
         for f in os.listdir(indir):
             if not os.path.isfile(os.path.join(indir, f)):
                 continue
@@ -231,25 +270,46 @@ def decompress_corpus(exe, indir, size_mb, repeats):
                 continue
             if f.endswith(ext):
                 fnm = os.path.join(indir, f)
-                cmd = method + ' ' + opt + ' "' + fnm + '"'
-                subprocess.call(cmd, shell=True)
-        rep_seconds = time.time() - rep_seconds
-        seconds = min(seconds, rep_seconds)
+                row = {'exe': meth, 'exe_hash': exe_hash, 'mode': 'decompress',
+                       'threads': 0, 'file': f, 'rep': len(reps), 'stream': int(stream),
+                       'storage': storage}
+                row.update(_dcmp(entry, fnm, stream))
+                row['bytes_in'] = os.stat(fnm).st_size
+                decompnm = os.path.splitext(fnm)[0]
+                if not stream and os.path.isfile(decompnm):
+                    row['bytes_out'] = os.stat(decompnm).st_size
+                rep_rows.append(row)
+        reps.append(rep_rows)
+        return sum(row['wall'] for row in rep_rows)
+
+    summary = stats.repeat(measure, repeats, rel_width, budget)
+    seconds = summary['min']
+    best = min(reps, key=lambda rows: sum(row['wall'] for row in rows))
     speed = (size_mb) / seconds
-    print('{}\t{:.0f}\t{:.2f}'.format(meth, seconds * 1000, speed))
+    cpu = sum(row['user'] + row['sys'] for row in best)
+    print('{}\t{:.0f}\t{:.2f}\t{:.0f}\t{:.0f}\t{:.1f}\t{}'.format(meth, seconds * 1000,
+          speed, cpu * 1000, summary['median'] * 1000, summary['rel_ci'] * 100,
+          summary['n']))
+    if len(results_file) > 0:
+        row = {'exe': meth, 'exe_hash': exe_hash, 'mode': 'decompress',
+               'threads': 0, 'speed mb/s': speed, 'stream': int(stream), 'storage': storage}
+        row.update(stats.cell_fields(summary))
+        row.update(perf.totals(best))
+        row['peak rss mb'] = max(r['maxrss'] for r in best) / 1000000
+        results.append(results_file, 'cells', [row])
+        results.append(results_file, 'files', [row for rows in reps for row in rows])
 
-def compress_all_levels(exe, indir, tmpdir, exts):
+def compress_all_levels(entry, indir, tmpdir, exts):
     """
     compress all files in folder 'indir' and copy to 'tmpdir'
+
+    Compressed files are reused from the cache when the executable, options,
+    level and input file are unchanged since a previous run
     
     Parameters
     ----------
-    exe : dictionary
-       'exe' : str, exectuable name, e.g. 'zstd'
-       'uncompress': str, arguments, e.g.  ' -T0 -q -f -k -d '
-       'compress': str, arguemnt for compression, e.g. ' -T0 -q -f -k -' 
-       'max_level': int, maximum supported compression level, eg 19, 
-       'ext': extension used by this compressor, e.g. '.zst'
+    entry : dict
+        compressor from the registry, see registry.py
     indir : str
         folder with files to compress      
     tmpdir : str
@@ -260,15 +320,13 @@ def compress_all_levels(exe, indir, tmpdir, exts):
     """
 
     size = 0
-    method = exe['exe']
-    ext = exe['ext']
-    opt = exe['compress']
-    max_level = exe['max_level']
+    method = entry['exe']
+    ext = entry['ext']
+    opt = entry['compress']
     meth = ntpath.basename(method)
-    if not os.path.exists(method) and not shutil.which(method):
-        print('Skipping test: Unable to find "' + method + '"')
+    if not registry.installed(entry):
         return 0
-    for lvl in range(1, max_level+1):
+    for lvl in registry.levels(entry):
         for f in os.listdir(indir):
             if not os.path.isfile(os.path.join(indir, f)):
                 continue
@@ -278,29 +336,26 @@ def compress_all_levels(exe, indir, tmpdir, exts):
                 continue
             fnm = os.path.join(indir, f)
             size = size + os.stat(fnm).st_size
-            cmd = method + opt + str(lvl) + ' "' + fnm + '"'
-            subprocess.call(cmd, shell=True)
-            outnm = ntpath.basename(fnm)
-            fnm = fnm + ext
-            if not os.path.isfile(fnm):
-                sys.exit('Unable to find ' + fnm)
-            outnm = os.path.join(tmpdir, meth + str(lvl) + '_' + outnm + ext)
-            shutil.move(fnm, outnm)
+            outnm = os.path.join(tmpdir, meth + str(lvl) + '_' + f + ext)
+            if cache.fetch(method, opt, lvl, fnm, outnm):
+                continue
+            runner.run(registry.command(entry, 'compress', fnm, lvl))
+            if not os.path.isfile(fnm + ext):
+                sys.exit('Unable to find ' + fnm + ext)
+            shutil.move(fnm + ext, outnm)
+            cache.store(method, opt, lvl, fnm, outnm)
     bytes_per_mb = 1000000
     return size / bytes_per_mb
 
-def test_decomp(exes, indir, exts, repeats):
+def test_decomp(entries, indir, exts, repeats, rel_width=0, budget=60.0, stream=False,
+                tmpdir='./temp', storage='disk'):
     """
-    test decompression speed for all files in folder 'indir' using each exes
+    test decompression speed for all files in folder 'indir' using each of 'entries'
     
     Parameters
     ----------
-    exes : dictionary where each entry has following properties
-       'exe' : str, exectuable name, e.g. 'zstd'
-       'uncompress': str, arguments, e.g.  ' -T0 -q -f -k -d '
-       'compress': str, arguemnt for compression, e.g. ' -T0 -q -f -k -' 
-       'max_level': int, maximum supported compression level, eg 19, 
-       'ext': extension used by this compressor, e.g. '.zst'
+    entries : list of dict
+        compressors from the registry that write the same extension, see registry.py
     indir : str
         folder with files to compress/decompress      
     tmpdir : str
@@ -310,10 +365,20 @@ def test_decomp(exes, indir, exts, repeats):
     repeats : int
         number of times each item is decompressed
         performance estimate based on fastest run
+    rel_width : float
+        repeat until the 95% CI of the median time is narrower than this
+        fraction of it (default 0, exactly 'repeats' repeats)
+    budget : float
+        maximum seconds spent on adaptive repeats of one exe (default 60)
+    stream : bool
+        decompress to a pipe and count the output instead of saving it (default False)
+    tmpdir : str
+        temporary folder for compressed files, it is emptied first (default './temp')
+    storage : str
+        page cache state before each repeat, see staging.prepare (default 'disk')
         
     """
 
-    tmpdir = './temp'
     if os.path.isdir(tmpdir):
         shutil.rmtree(tmpdir)
     try:
@@ -321,13 +386,15 @@ def test_decomp(exes, indir, exts, repeats):
     except OSError:
         sys.exit('Unable to create folder "' + tmpdir + '"')
     size_mb = 0;
-    for  i in range(len(exes)) :
-        size_mb += compress_all_levels(exes[i], indir, tmpdir, exts)
-    print('DecompressMethod\tms\tmb/s')
-    for  i in range(len(exes)) :
-        decompress_corpus(exes[i], tmpdir, size_mb, repeats)
-    for  i in range(len(exes)) :
-        validate_decompress_corpus(exes[i], indir, tmpdir)
+    for entry in entries:
+        size_mb += compress_all_levels(entry, indir, tmpdir, exts)
+    results_file = ntpath.basename(indir)+'_speed_size.db'
+    print('DecompressMethod\tms\tmb/s\tcpu ms\tmedian\tci %\tn')
+    for entry in entries:
+        decompress_corpus(entry, tmpdir, size_mb, repeats, results_file,
+                          rel_width, budget, stream, storage)
+    for entry in entries:
+        validate_decompress_corpus(entry, indir, tmpdir)
     
 if __name__ == '__main__':
     """Compare speed and size for different compression tools
@@ -337,30 +404,49 @@ if __name__ == '__main__':
     indir : str
         folder with files to compress (default './corpus')
     repeats : int
-     how many times is each file compressed (default 3)    
+     how many times is each file compressed (default 7)    
+    --adaptive : float
+     repeat each cell until its 95% CI is narrower than this fraction of the median
+    --budget : float
+     maximum seconds spent on adaptive repeats of one cell (default 60)
+    --stream
+     (de)compress to a pipe and count the output instead of writing files
+    --storage : str
+     'disk' (default), 'warm' or 'cold' page cache, or 'ram' to stage corpus and temp files in tmpfs
+    --perf
+     record cycles, instructions, IPC, branch and cache misses and context switches with perf stat
+    --compressors : str
+     comma separated tools from compressors.json (default those marked "default"), e.g. zstd,xz,lz4,brotli
     """
 
-    indir = ''
-    if len(sys.argv) > 1:
-        indir = sys.argv[1]
+    parser = argparse.ArgumentParser(description='Compression and decompression speed versus size')
+    parser.add_argument('indir', nargs='?', default='', help='folder with files to compress')
+    parser.add_argument('repeats', nargs='?', type=int, default=7, help='repeats (minimum repeats when adaptive)')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='REL',
+                        help='repeat until the 95%% CI of the median is narrower than REL, e.g. 0.02')
+    parser.add_argument('--budget', type=float, default=60.0, help='maximum seconds for adaptive repeats of one cell')
+    parser.add_argument('--stream', action='store_true',
+                        help='(de)compress to a pipe (-c) and count the bytes instead of writing files')
+    parser.add_argument('--storage', choices=staging.storage_modes, default='disk',
+                        help='disk: as is, warm/cold: page cache before each repeat, ram: stage files to tmpfs')
+    parser.add_argument('--perf', action='store_true',
+                        help='record hardware performance counters with perf stat, if available')
+    parser.add_argument('--compressors', default='',
+                        help='comma separated tools from compressors.json, e.g. zstd,xz,lz4,brotli')
+    args = parser.parse_args()
+    indir = args.indir
+    perf.enabled = args.perf
     if len(indir) < 1:
         indir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'silesia')
     if not os.path.isdir(indir):
         print('Run a_compile.py first: Unable to find "' + indir +'"')
         sys.exit()
-    repeats = 7
-    if len(sys.argv) > 2:
-        repeats = int(sys.argv[2])
-    results_file = ntpath.basename(indir)+'_speed_size.pkl'
-    if os.path.exists(results_file):
-        os.remove(results_file)
-    exes = []
-    exes.append({'exe': 'zstd', 'uncompress': ' -T0 -q -f -k -d ', 'compress': ' -T0 -q -f -k -', 'max_level': 19, 'ext': '.zst' })
-    #exes.append({'exe': 'pbzip2', 'uncompress': ' -q -f -k -d ', 'compress':  ' -q -f -k -', 'max_level': 9, 'ext': '.bz2' })
-    exes.append({'exe': 'lbzip2', 'uncompress': ' -q -f -k -d ', 'compress':  ' -q -f -k -', 'max_level': 9, 'ext': '.bz2' })
-    #exes.append({'exe': 'lz4', 'uncompress': ' -q -f -k -d ', 'compress':  ' -q -f -k -', 'max_level': 9, 'ext': '.lz4' })
-    #exes.append({'exe': 'xz', 'uncompress': ' -T0 -q -f -k -d ', 'compress':  ' -T0 -q -f -k -', 'max_level': 9, 'ext': '.xz' })
-    exes.append({'exe': 'gzip', 'uncompress': ' -q -f -k -d ', 'compress': ' -q -f -k -', 'max_level': 9, 'ext': '.gz' })
+    repeats = args.repeats
+    results_file = ntpath.basename(indir)+'_speed_size.db'
+    names = None
+    if len(args.compressors) > 0:
+        names = args.compressors.split(',')
+    entries = registry.selected(names)
     executable = stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH
     exeDir = './exe'
     if not os.path.isdir(exeDir):
@@ -372,27 +458,27 @@ if __name__ == '__main__':
                 st = os.stat(exe)
                 mode = st.st_mode
                 if mode & executable:
-                    exe = os.path.abspath(exe)
-                    exes.append({'exe': exe, 'uncompress': ' -q -f -k -d ', 'compress':  ' -q -f -k -', 'max_level': 9, 'ext': '.gz' })
-    exts = []
-    for  i in range(len(exes)) :
-        ext = exes[i]['ext']
-        if ext not in exts:
-            exts.append(ext)
-    for  i in range(len(exes)) :
+                    entries.append(registry.get('pigz', os.path.abspath(exe)))
+    exts = registry.exts(entries)
+    # temp holds every level of one extension group: compressed (about half
+    # the corpus) plus, unless streaming, decompressed copies
+    per_level = 0.5
+    if not args.stream:
+        per_level += 1.0
+    levels = [sum(len(registry.levels(e)) for e in entries if e['ext'] == ext) for ext in exts]
+    indir, tmpdir = staging.stage(indir, args.storage, './temp', max(levels + [1]) * per_level)
+    for entry in entries:
         test_cmp(
-            exes[i]['exe'],
+            entry,
             indir,
             repeats,
-            exes[i]['ext'],
-            exes[i]['compress'],
-            exes[i]['max_level'],
-            exts)
+            exts,
+            args.adaptive,
+            args.budget,
+            args.stream,
+            args.storage)
     plot(results_file)
-    for  i in range(len(exts)) :
-        ext = exts[i]
-        exes2 = []
-        for  i in range(len(exes)) :
-            if exes[i]['ext'] == ext :
-                exes2.append(exes[i])
-        test_decomp(exes2, indir, exts, repeats)
+    for ext in exts:
+        group = [entry for entry in entries if entry['ext'] == ext]
+        test_decomp(group, indir, exts, repeats, args.adaptive, args.budget,
+                    args.stream, tmpdir, args.storage)
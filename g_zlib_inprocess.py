@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 g_zlib_inprocess.py          : test zlib libraries in './lib' on folder 'corpus'
+# python3 g_zlib_inprocess.py indir    : test zlib libraries in './lib' on folder 'indir'
+# python3 g_zlib_inprocess.py indir 3  : as above, with 3 repeats of each cell
+
+import os
+import sys
+import time
+import ntpath
+import argparse
+import ctypes.util
+import stats
+import results
+import zlibctypes
+
+
+def read_corpus(indir):
+    """
+    read every file in folder 'indir' into memory
+
+    Parameters
+    ----------
+    indir : str
+        folder with uncompressed files
+    """
+
+    corpus = []
+    for f in sorted(os.listdir(indir)):
+        fnm = os.path.join(indir, f)
+        if not os.path.isfile(fnm):
+            continue
+        if f.startswith('.'):
+            continue
+        if f.endswith(('.gz', '.zst', '.bz2')):
+            continue
+        with open(fnm, 'rb') as fh:
+            corpus.append((f, fh.read()))
+    return corpus
+
+
+def find_libs(libdir='./lib'):
+    """
+    list zlib shared libraries built by a_compile.py, plus the system zlib
+
+    Parameters
+    ----------
+    libdir : str
+        folder with 'libz-<name>' libraries (default './lib')
+
+    Returns
+    -------
+    list of (name, path) tuples
+    """
+
+    libs = []
+    system = ctypes.util.find_library('z')
+    if system is not None:
+        libs.append(('libz-system', system))
+    if os.path.isdir(libdir):
+        for f in sorted(os.listdir(libdir)):
+            if f.startswith('libz-'):
+                libs.append((os.path.splitext(f)[0], os.path.abspath(os.path.join(libdir, f))))
+    return libs
+
+
+def test_lib(
+    name,
+    fnm,
+    corpus,
+    levels=range(1, 10),
+    wbits_list=(15, ),
+    repeats=3,
+    rel_width=0,
+    budget=60.0,
+    results_file='inprocess.db',
+    ):
+    """
+    time deflate and inflate of in-memory buffers with one zlib library
+
+    Parameters
+    ----------
+    name : str
+        label for the library, e.g. 'libz-ng'
+    fnm : str
+        shared library to load with ctypes
+    corpus : list of (str, bytes)
+        file names and contents, see read_corpus
+    levels : list of int
+        compression levels to test (default 1..9)
+    wbits_list : list of int
+        window sizes (log2, 9..15) to test (default 15)
+    repeats : int
+        number of repeats (minimum number when adaptive)
+    rel_width : float
+        target relative width of the 95% CI, 0 for a fixed number of repeats
+    budget : float
+        maximum seconds spent on adaptive repeats of one cell
+    results_file : str
+        SQLite file where results are appended
+    """
+
+    try:
+        lib = zlibctypes.load(fnm)
+    except OSError as e:
+        print('Skipping test: Unable to load "' + fnm + '": ' + str(e))
+        return ()
+    if fnm.startswith(os.sep):
+        lib_hash = results.file_hash(fnm)
+    else:
+        lib_hash = lib.zlibVersion().decode()
+    size = sum(len(data) for f, data in corpus)
+    bytes_per_mb = 1000000
+    for wbits in wbits_list:
+        for lvl in levels:
+            compressed = []
+
+            def measure_compress():
+                compressed.clear()
+                seconds = 0
+                for f, data in corpus:
+                    t0 = time.perf_counter()
+                    compressed.append(zlibctypes.compress(lib, data, lvl, wbits))
+                    seconds += time.perf_counter() - t0
+                return seconds
+
+            def measure_decompress():
+                seconds = 0
+                for (f, data), comp in zip(corpus, compressed):
+                    t0 = time.perf_counter()
+                    zlibctypes.decompress(lib, comp, len(data), wbits)
+                    seconds += time.perf_counter() - t0
+                return seconds
+
+            csummary = stats.repeat(measure_compress, repeats, rel_width, budget)
+            for (f, data), comp in zip(corpus, compressed):
+                if zlibctypes.decompress(lib, comp, len(data), wbits) != data:
+                    sys.exit('{} level {} window {}: round trip differs for {}'.format(
+                        name, lvl, wbits, f))
+            dsummary = stats.repeat(measure_decompress, repeats, rel_width, budget)
+            nsize = sum(len(comp) for comp in compressed)
+            cspeed = size / bytes_per_mb / csummary['min']
+            dspeed = size / bytes_per_mb / dsummary['min']
+            print('{}\t{}\t{}\t{:.0f}\t{:.0f}\t{:.2f}'.format(name, lvl, wbits,
+                  cspeed, dspeed, nsize / size * 100))
+            rows = []
+            for mode, speed, summary in [('compress', cspeed, csummary),
+                                         ('decompress', dspeed, dsummary)]:
+                row = {'exe': name, 'exe_hash': lib_hash, 'mode': mode,
+                       'level': lvl, 'window bits': wbits,
+                       'size %': nsize / size * 100, 'speed mb/s': speed}
+                row.update(stats.cell_fields(summary))
+                rows.append(row)
+            results.append(results_file, 'cells', rows)
+
+
+if __name__ == '__main__':
+    """Compare in-process deflate/inflate speed of zlib variants
+
+    Parameters
+    ----------
+    indir : str
+        folder with files to compress (default './corpus')
+    repeats : int
+     how many times is each buffer compressed (default 3)
+    --levels : str
+     comma separated compression levels (default 1..9)
+    --wbits : str
+     comma separated window sizes as log2 (default 9,12,15)
+    """
+
+    parser = argparse.ArgumentParser(description='In-process zlib speed')
+    parser.add_argument('indir', nargs='?', default='./corpus', help='folder with files to compress')
+    parser.add_argument('repeats', nargs='?', type=int, default=3, help='repeats (minimum repeats when adaptive)')
+    parser.add_argument('--levels', default='1,2,3,4,5,6,7,8,9', help='comma separated compression levels')
+    parser.add_argument('--wbits', default='9,12,15', help='comma separated window sizes (log2, 9..15)')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='REL',
+                        help='repeat until the 95%% CI of the median is narrower than REL, e.g. 0.02')
+    parser.add_argument('--budget', type=float, default=60.0, help='maximum seconds for adaptive repeats of one cell')
+    args = parser.parse_args()
+    indir = args.indir
+    if not os.path.isdir(indir):
+        sys.exit('Run a_compile.py first: Unable to find ' + indir)
+    libs = find_libs()
+    if len(libs) < 2:
+        print('Run a_compile.py to build the zlib variants into ./lib')
+    levels = [int(x) for x in args.levels.split(',')]
+    wbits_list = [int(x) for x in args.wbits.split(',')]
+    corpus = read_corpus(indir)
+    results_file = ntpath.basename(indir) + '_inprocess.db'
+    print('Library\tLevel\tWindow\tcomp mb/s\tdecomp mb/s\t%')
+    for name, fnm in libs:
+        test_lib(name, fnm, corpus, levels, wbits_list, args.repeats,
+                 args.adaptive, args.budget, results_file)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 h_pigz_params.py          : sweep pigz block size, threads and level for folder 'corpus'
+# python3 h_pigz_params.py indir    : as above for folder 'indir'
+# python3 h_pigz_params.py indir 3  : as above, with 3 repeats of each cell
+# python3 h_pigz_params.py indir 3 --blocks 128,1024,4096 --modes ",-i,--rsyncable"
+
+import os
+import sys
+import stat
+import zlib
+import ntpath
+import shutil
+import argparse
+import itertools
+import psutil
+import stats
+import runner
+import staging
+import results
+
+
+def _input_files(indir):
+    """uncompressed files of folder 'indir', with their size and CRC32"""
+
+    files = []
+    for f in sorted(os.listdir(indir)):
+        fnm = os.path.join(indir, f)
+        if not os.path.isfile(fnm):
+            continue
+        if f.startswith('.'):
+            continue
+        if f.endswith(('.gz', '.zst', '.bz2')):
+            continue
+        crc = 0
+        with open(fnm, 'rb') as fh:
+            while True:
+                data = fh.read(1 << 20)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+        files.append((f, os.stat(fnm).st_size, crc))
+    return files
+
+
+def _cmp(exe, fnm, outnm, lvl, threads, block, mode):
+    """
+    compress file 'fnm' to 'outnm' with pigz options for level, threads, block size and 'mode'
+
+    Parameters
+    ----------
+    exe : str
+        name of pigz executable
+    fnm : str
+        name of file to be compressed
+    outnm : str
+        name of compressed file to create
+    lvl : int
+        compression level
+    threads : int
+        number of threads (-p)
+    block : int
+        block size in KiB (-b)
+    mode : str
+        extra pigz options, e.g. '-i' or '--rsyncable' ('' for none)
+
+    Returns
+    -------
+    dict with wall, user and sys seconds and peak memory of the child process
+    """
+
+    args = runner.command(exe, mode + ' -c -', lvl)
+    args += ['-p', str(threads), '-b', str(block), fnm]
+    with open(outnm, 'wb') as fh:
+        return runner.run(args, stdout=fh)
+
+
+def test_cell(
+    exe,
+    indir,
+    tmpdir,
+    files,
+    lvl,
+    threads,
+    block,
+    mode='',
+    repeats=3,
+    rel_width=0,
+    budget=60.0,
+    storage='disk',
+    ):
+    """
+    time compression of every file with one set of pigz options, then decompression of the result
+
+    Parameters
+    ----------
+    exe : str
+        name of pigz executable
+    indir : str
+        folder with files to compress
+    tmpdir : str
+        folder where compressed files are written
+    files : list
+        (name, size, crc32) of each input file, see _input_files
+    lvl : int
+        compression level
+    threads : int
+        number of threads (-p)
+    block : int
+        block size in KiB (-b)
+    mode : str
+        extra pigz options, e.g. '-i' (default '')
+    repeats : int
+        number of repeats (minimum number when adaptive)
+    rel_width : float
+        target relative width of the 95% CI, 0 for a fixed number of repeats
+    budget : float
+        maximum seconds spent on adaptive repeats of one cell
+    storage : str
+        page cache state before each repeat, see staging.prepare (default 'disk')
+
+    Returns
+    -------
+    compression and decompression summaries (see stats.repeat), the compressed
+    size in bytes and the peak RSS in bytes of compression and decompression
+    """
+
+    outnms = [os.path.join(tmpdir, f + '.gz') for f, size, crc in files]
+    maxrss = {'compress': 0, 'decompress': 0}
+
+    def measure_compress():
+        staging.prepare(indir, storage)
+        seconds = 0
+        for (f, size, crc), outnm in zip(files, outnms):
+            usage = _cmp(exe, os.path.join(indir, f), outnm, lvl, threads,
+                         block, mode)
+            maxrss['compress'] = max(maxrss['compress'], usage['maxrss'])
+            seconds += usage['wall']
+        return seconds
+
+    def measure_decompress():
+        staging.prepare(tmpdir, storage)
+        seconds = 0
+        for (f, size, crc), outnm in zip(files, outnms):
+            usage = runner.run_stream([exe, '-d', '-c', outnm])
+            if usage['bytes_out'] != size or usage['crc32'] != crc:
+                sys.exit('{} {} -{} -p {} -b {}: decompressed {} differs from {}'.format(
+                    ntpath.basename(exe), mode, lvl, threads, block, outnm, f))
+            maxrss['decompress'] = max(maxrss['decompress'], usage['maxrss'])
+            seconds += usage['wall']
+        return seconds
+
+    csummary = stats.repeat(measure_compress, repeats, rel_width, budget)
+    nsize = sum(os.stat(outnm).st_size for outnm in outnms)
+    dsummary = stats.repeat(measure_decompress, repeats, rel_width, budget)
+    for outnm in outnms:
+        os.remove(outnm)
+    return csummary, dsummary, nsize, maxrss
+
+
+def test_exe(
+    exe,
+    indir,
+    tmpdir,
+    blocks,
+    thread_list,
+    levels,
+    modes,
+    repeats=3,
+    rel_width=0,
+    budget=60.0,
+    storage='disk',
+    results_file='pigz_params.db',
+    ):
+    """
+    sweep block size x threads x level x mode for pigz executable 'exe'
+
+    Parameters
+    ----------
+    exe : str
+        name of pigz executable
+    indir : str
+        folder with files to compress
+    tmpdir : str
+        folder where compressed files are written
+    blocks : list of int
+        block sizes in KiB (-b)
+    thread_list : list of int
+        thread counts (-p)
+    levels : list of int
+        compression levels
+    modes : list of str
+        extra pigz options for each cell, '' for none
+    repeats : int
+        number of repeats (minimum number when adaptive)
+    rel_width : float
+        target relative width of the 95% CI, 0 for a fixed number of repeats
+    budget : float
+        maximum seconds spent on adaptive repeats of one cell
+    storage : str
+        page cache state before each repeat, see staging.prepare (default 'disk')
+    results_file : str
+        SQLite file where results are appended
+    """
+
+    if not os.path.exists(exe) and not shutil.which(exe):
+        print('Skipping test: Unable to find "' + exe + '"')
+        return ()
+    meth = ntpath.basename(exe)
+    exe_hash = results.exe_hash(exe)
+    files = _input_files(indir)
+    size = sum(f[1] for f in files)
+    if size < 1:
+        sys.exit('No files to compress in ' + indir)
+    bytes_per_mb = 1000000
+    for mode, lvl, threads, block in itertools.product(modes, levels,
+                                                        thread_list, blocks):
+        csummary, dsummary, nsize, maxrss = test_cell(exe, indir, tmpdir,
+                                                      files, lvl, threads,
+                                                      block, mode, repeats,
+                                                      rel_width, budget,
+                                                      storage)
+        cspeed = size / bytes_per_mb / csummary['min']
+        dspeed = size / bytes_per_mb / dsummary['min']
+        print('{}\t{}\t{}\t{}\t{}\t{:.0f}\t{:.0f}\t{:.2f}'.format(meth, mode,
+              lvl, threads, block, cspeed, dspeed, nsize / size * 100))
+        rows = []
+        for direction, speed, summary in [('compress', cspeed, csummary),
+                                          ('decompress', dspeed, dsummary)]:
+            row = {'exe': meth, 'exe_hash': exe_hash, 'mode': direction,
+                   'options': mode, 'level': lvl, 'threads': threads,
+                   'block kb': block, 'size %': nsize / size * 100,
+                   'speed mb/s': speed, 'storage': storage,
+                   'peak rss mb': maxrss[direction] / bytes_per_mb}
+            row.update(stats.cell_fields(summary))
+            rows.append(row)
+        results.append(results_file, 'cells', rows)
+
+
+def plot(resultsFile):
+    """line-plot of compression and decompression speed versus block size
+
+    Parameters
+    ----------
+    resultsFile : str
+        name of SQLite results file to plot
+    """
+
+    if not os.path.exists(resultsFile):
+        print('No file named "' + resultsFile + '"')
+        return ()
+    if os.name == 'posix' and 'DISPLAY' not in os.environ:
+        print('Plot the results on a machine with a graphical display')
+        return ()
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    df = results.load(resultsFile, 'cells',
+                      ['exe', 'mode', 'level', 'block kb', 'speed mb/s'],
+                      'run_id = ?', (results.latest_run(resultsFile),))
+    sns.set()
+    grid = sns.relplot(x='block kb', y='speed mb/s', hue='exe', style='level',
+                       col='mode', data=df, kind='line', marker='o')
+    grid.set(xscale='log')
+    plt.savefig(resultsFile.replace('.db', '.png'))
+
+
+if __name__ == '__main__':
+    """Sweep pigz block size, threads, level and options
+
+    Parameters
+    ----------
+    indir : str
+        folder with files to compress (default './corpus')
+    repeats : int
+     how many times is each cell timed (default 3)
+    --blocks : str
+     comma separated block sizes in KiB (default 32,64,128,256,512,1024,2048,4096)
+    --threads : str
+     comma separated thread counts (default 1 and the number of physical cores)
+    --levels : str
+     comma separated compression levels (default 1,6,9)
+    --modes : str
+     comma separated extra options, empty for none, e.g. ",-i,--rsyncable,-n,-N,-m"
+    --adaptive : float
+     repeat each cell until its 95% CI is narrower than this fraction of the median
+    --budget : float
+     maximum seconds spent on adaptive repeats of one cell (default 60)
+    --storage : str
+     'disk' (default), 'warm' or 'cold' page cache, or 'ram' to stage the corpus in tmpfs
+    """
+
+    parser = argparse.ArgumentParser(description='pigz parameter sweep')
+    parser.add_argument('indir', nargs='?', default='./corpus', help='folder with files to compress')
+    parser.add_argument('repeats', nargs='?', type=int, default=3, help='repeats (minimum repeats when adaptive)')
+    parser.add_argument('--blocks', default='32,64,128,256,512,1024,2048,4096',
+                        help='comma separated block sizes in KiB (pigz -b)')
+    parser.add_argument('--threads', default='', help='comma separated thread counts (pigz -p)')
+    parser.add_argument('--levels', default='1,6,9', help='comma separated compression levels')
+    parser.add_argument('--modes', default=',-i',
+                        help='comma separated extra pigz options, an empty item for none')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='REL',
+                        help='repeat until the 95%% CI of the median is narrower than REL, e.g. 0.02')
+    parser.add_argument('--budget', type=float, default=60.0, help='maximum seconds for adaptive repeats of one cell')
+    parser.add_argument('--storage', choices=staging.storage_modes, default='disk',
+                        help='disk: as is, warm/cold: page cache before each repeat, ram: stage files to tmpfs')
+    args = parser.parse_args()
+    indir = args.indir
+    if not os.path.isdir(indir):
+        sys.exit('Run a_compile.py first: Unable to find ' + indir)
+    exedir = './exe'
+    if not os.path.isdir(exedir):
+        sys.exit('Run a_compile.py first: Unable to find ' + exedir)
+    blocks = [int(x) for x in args.blocks.split(',')]
+    levels = [int(x) for x in args.levels.split(',')]
+    modes = args.modes.split(',')
+    if len(args.threads) > 0:
+        thread_list = [int(x) for x in args.threads.split(',')]
+    else:
+        thread_list = sorted(set([1, psutil.cpu_count(logical=False) or 1]))
+    results_file = ntpath.basename(os.path.normpath(indir)) + '_pigz_params.db'
+    indir, tmpdir = staging.stage(indir, args.storage, './temp', 1.0)
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.mkdir(tmpdir)
+    print('exe\toptions\tlevel\tthreads\tblock kb\tcomp mb/s\tdecomp mb/s\t%')
+    for exe in sorted(os.listdir(exedir)):
+        exe = os.path.join(exedir, exe)
+        if os.path.isfile(exe):
+            st = os.stat(exe)
+            mode = st.st_mode
+            executable = stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH
+            if mode & executable:
+                exe = os.path.abspath(exe)
+                test_exe(exe, indir, tmpdir, blocks, thread_list, levels,
+                         modes, args.repeats, args.adaptive, args.budget,
+                         args.storage, results_file)
+    shutil.rmtree(tmpdir)
+    plot(results_file)
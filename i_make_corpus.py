@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 i_make_corpus.py                 : write the default synthetic corpus to folder 'synthetic'
+# python3 i_make_corpus.py outdir          : write it to folder 'outdir'
+# python3 i_make_corpus.py outdir --sizes 1K,1M,1G --kinds text,int16 --seed 7
+# python3 i_make_corpus.py outdir --sizes 1M,100M,10G --by-size : one folder per size for scaling studies
+
+import os
+import sys
+import json
+import struct
+import hashlib
+import argparse
+import numpy as np
+
+# largest piece generated at once, so memory stays bounded for huge files
+_chunk = 1 << 22
+
+kinds = ['random', 'entropy2', 'entropy4', 'entropy6', 'text', 'int16', 'float32']
+
+
+def parse_size(txt):
+    """
+    bytes in a size such as '1K', '64M' or '20G' (powers of 1000, as the benchmarks report mb/s)
+
+    Parameters
+    ----------
+    txt : str
+        number with an optional K, M, G or T suffix
+    """
+
+    units = {'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3, 'T': 1000 ** 4}
+    txt = txt.strip().upper().rstrip('B')
+    if len(txt) > 0 and txt[-1] in units:
+        return int(float(txt[:-1]) * units[txt[-1]])
+    return int(txt)
+
+
+def _rng(seed, kind, size):
+    """independent generator for each file, so a file does not depend on which others are made"""
+
+    return np.random.Generator(np.random.PCG64(
+        np.random.SeedSequence([seed, kinds.index(kind), size])))
+
+
+def _random(rng, size):
+    """incompressible bytes"""
+
+    while size > 0:
+        n = min(size, _chunk)
+        yield rng.bytes(n)
+        size -= n
+
+
+def _entropy(rng, size, bits):
+    """bytes drawn uniformly from 2**bits symbols, so the entropy is 'bits' per byte"""
+
+    symbols = 1 << bits
+    while size > 0:
+        n = min(size, _chunk)
+        yield rng.integers(0, symbols, n, dtype=np.uint8).tobytes()
+        size -= n
+
+
+def _text(rng, size):
+    """repetitive text: made-up words with Zipf frequencies, in lines of about 60 characters"""
+
+    letters = np.frombuffer(b'etaoinshrdlcumwfgypbvkjxqz', dtype=np.uint8)
+    weights = np.linspace(2.0, 0.1, len(letters))
+    weights /= weights.sum()
+    vocab = []
+    for length in rng.integers(1, 12, 5000):
+        vocab.append(rng.choice(letters, length, p=weights).tobytes())
+    vocab = np.array(vocab, dtype=object)
+    while size > 0:
+        idx = np.minimum(rng.zipf(1.3, 1 << 16), len(vocab)) - 1
+        words = vocab[idx]
+        lines = []
+        line = []
+        width = 0
+        for word in words:
+            line.append(word)
+            width += len(word) + 1
+            if width > 60:
+                lines.append(b' '.join(line))
+                line = []
+                width = 0
+        data = b'\n'.join(lines) + b'\n'
+        data = data[:size]
+        yield data
+        size -= len(data)
+
+
+def _smooth(field, width):
+    """box blur of a 2D array along both axes, 'width' voxels wide (cumulative sums, no scipy)"""
+
+    for axis in [0, 1]:
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (width, width)
+        c = np.cumsum(np.pad(field, pad, mode='reflect'), axis=axis)
+        hi = np.take(c, np.arange(2 * width, c.shape[axis]), axis=axis)
+        lo = np.take(c, np.arange(0, c.shape[axis] - 2 * width), axis=axis)
+        field = (hi - lo) / (2 * width)
+    return field
+
+
+# NIfTI-1 stores each dimension as a signed 16-bit integer
+_max_dim = 32767
+
+
+def volume_shape(size, itemsize):
+    """
+    dimensions of a NIfTI-like volume of about 'size' bytes: square slices of at most 256x256
+
+    Slices beyond 32767 (about 4 GB of int16) are split into time points, a 4D series
+
+    Parameters
+    ----------
+    size : int
+        requested file size in bytes
+    itemsize : int
+        bytes per voxel
+
+    Returns
+    -------
+    nx, ny, nz, nt
+    """
+
+    voxels = max((size - 352) // itemsize, 1)
+    nx = int(min(256, max(2, np.sqrt(voxels))))
+    slices = max(voxels // (nx * nx), 1)
+    nt = -(-slices // _max_dim)
+    if nt > _max_dim:
+        raise ValueError('{} bytes is too large for a NIfTI-1 volume'.format(size))
+    return nx, nx, slices // nt, nt
+
+
+def nifti_header(shape, dtype):
+    """
+    348 byte NIfTI-1 header plus the 4 byte extension flag, voxel data follows at offset 352
+
+    Parameters
+    ----------
+    shape : tuple of int
+        nx, ny, nz and optionally nt, each at most 32767
+    dtype : numpy dtype
+        int16 or float32
+    """
+
+    if max(shape) > _max_dim:
+        raise ValueError('NIfTI-1 dimensions are at most {}, not {}'.format(_max_dim, shape))
+    codes = {np.dtype(np.int16): (4, 16), np.dtype(np.float32): (16, 32)}
+    datatype, bitpix = codes[np.dtype(dtype)]
+    dims = list(shape) + [1] * (7 - len(shape))
+    ndim = 4 if len(shape) > 3 and shape[3] > 1 else 3
+    hdr = bytearray(348)
+    struct.pack_into('<i', hdr, 0, 348)
+    struct.pack_into('<8h', hdr, 40, ndim, *dims)
+    struct.pack_into('<2h', hdr, 70, datatype, bitpix)
+    struct.pack_into('<8f', hdr, 76, 1, 1, 1, 1, 1, 1, 1, 1)
+    struct.pack_into('<f', hdr, 108, 352)
+    struct.pack_into('<f', hdr, 112, 1)
+    hdr[123] = 10  # xyzt_units: mm and seconds
+    hdr[148:148 + 24] = b'synthetic i_make_corpus'.ljust(24, b'\0')
+    struct.pack_into('<h', hdr, 252, 1)  # qform_code: scanner
+    hdr[344:348] = b'n+1\0'
+    return bytes(hdr) + b'\0\0\0\0'
+
+
+def _volume(rng, shape, dtype):
+    """
+    NIfTI-like volume: a smooth head-shaped object in a zero background,
+    with noise, built one slice at a time (each slice correlated with the last).
+    Every time point of a 4D series repeats the object with new noise
+    """
+
+    dtype = np.dtype(dtype)
+    nx, ny, nz, nt = shape
+    yield nifti_header(shape, dtype)
+    x, y = np.meshgrid(np.linspace(-1, 1, nx), np.linspace(-1, 1, ny), indexing='ij')
+    width = max(nx // 32, 1)
+    prev = _smooth(rng.standard_normal((nx, ny)), width)
+    pieces = []
+    count = 0
+    for z in range(nz * nt):
+        zz = 2 * (z % nz + 0.5) / nz - 1
+        r2 = x ** 2 + (1.2 * y) ** 2 + (0.9 * zz) ** 2
+        mask = r2 < 0.8
+        tissue = _smooth(rng.standard_normal((nx, ny)), width)
+        tissue = 0.9 * prev + 0.44 * tissue
+        prev = tissue
+        img = np.where(mask, 600 + 150 * tissue + 250 * (r2 > 0.6), 0.0)
+        img += 5 * rng.standard_normal((nx, ny)) * mask
+        if dtype == np.int16:
+            img = np.clip(np.rint(img), -32768, 32767)
+        pieces.append(img.astype(dtype).T.tobytes())
+        count += nx * ny
+        if count * dtype.itemsize >= _chunk:
+            yield b''.join(pieces)
+            pieces = []
+            count = 0
+    if len(pieces) > 0:
+        yield b''.join(pieces)
+
+
+def generate(kind, size, seed=0):
+    """
+    chunks of bytes for one synthetic file, the same for the same kind, size and seed
+
+    Parameters
+    ----------
+    kind : str
+        one of 'kinds': random, entropy2/4/6 (bits per byte), text, int16 or float32
+    size : int
+        file size in bytes. Volumes are rounded to whole slices
+    seed : int
+        random seed (default 0)
+    """
+
+    if kind not in kinds:
+        sys.exit('Unknown kind "{}", use one of {}'.format(kind, kinds))
+    if kind in ['int16', 'float32']:
+        # before anything is written, so an impossible shape leaves no partial file
+        shape = volume_shape(size, np.dtype(kind).itemsize)
+    rng = _rng(seed, kind, size)
+    if kind == 'random':
+        return _random(rng, size)
+    if kind.startswith('entropy'):
+        return _entropy(rng, size, int(kind[len('entropy'):]))
+    if kind == 'text':
+        return _text(rng, size)
+    return _volume(rng, shape, kind)
+
+
+def write_file(fnm, kind, size, seed=0):
+    """
+    stream one synthetic file to disk
+
+    Returns
+    -------
+    bytes written and their sha256
+    """
+
+    digest = hashlib.sha256()
+    written = 0
+    chunks = generate(kind, size, seed)
+    with open(fnm, 'wb') as fh:
+        for data in chunks:
+            fh.write(data)
+            digest.update(data)
+            written += len(data)
+    return written, digest.hexdigest()
+
+
+def make_corpus(outdir, kind_list, sizes, seed=0, by_size=False):
+    """
+    write every kind at every size to folder 'outdir', with a manifest of sizes and hashes
+
+    Parameters
+    ----------
+    outdir : str
+        folder for the corpus
+    kind_list : list of str
+        kinds of data, see 'kinds'
+    sizes : list of str
+        sizes such as '1K' or '10G'
+    seed : int
+        random seed (default 0)
+    by_size : bool
+        put each size in its own subfolder, e.g. 'outdir/1M' (default False)
+    """
+
+    ext = {'text': '.txt', 'int16': '.nii', 'float32': '.nii'}
+    for txt in sizes:
+        for kind in kind_list:
+            if kind in ['int16', 'float32']:
+                try:
+                    volume_shape(parse_size(txt), np.dtype(kind).itemsize)
+                except ValueError as e:
+                    sys.exit('Unable to make {} {}: {}'.format(kind, txt, e))
+    for txt in sizes:
+        folder = outdir
+        if by_size:
+            folder = os.path.join(outdir, txt)
+        os.makedirs(folder, exist_ok=True)
+        manifest = {'seed': seed, 'numpy': np.__version__, 'files': {}}
+        manifestnm = os.path.join(folder, '.manifest.json')
+        if os.path.isfile(manifestnm):
+            with open(manifestnm) as fh:
+                manifest['files'] = json.load(fh).get('files', {})
+        size = parse_size(txt)
+        for kind in kind_list:
+            f = '{}_{}{}'.format(kind, txt, ext.get(kind, '.bin'))
+            written, sha = write_file(os.path.join(folder, f), kind, size, seed)
+            manifest['files'][f] = {'kind': kind, 'size': written, 'sha256': sha}
+            print('{}\t{}\t{}'.format(os.path.join(folder, f), written, sha[:16]))
+        # the dot keeps the manifest out of the benchmarks, which skip hidden files
+        with open(manifestnm, 'w') as fh:
+            json.dump(manifest, fh, indent=1)
+
+
+if __name__ == '__main__':
+    """Write a reproducible synthetic corpus
+
+    Parameters
+    ----------
+    outdir : str
+        folder for the corpus (default './synthetic')
+    --sizes : str
+     comma separated file sizes, e.g. 1K,1M,100M,10G (default 1K,1M,100M)
+    --kinds : str
+     comma separated kinds of data (default all): random, entropy2, entropy4,
+     entropy6, text, int16, float32
+    --seed : int
+     random seed, the same seed always makes the same files (default 0)
+    --by-size
+     write each size to its own subfolder, to run the benchmarks on each
+    """
+
+    parser = argparse.ArgumentParser(description='Synthetic corpus generator')
+    parser.add_argument('outdir', nargs='?', default='./synthetic', help='folder for the corpus')
+    parser.add_argument('--sizes', default='1K,1M,100M', help='comma separated sizes, e.g. 1K,1M,10G')
+    parser.add_argument('--kinds', default=','.join(kinds), help='comma separated kinds of data')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--by-size', action='store_true', help='one subfolder per size')
+    args = parser.parse_args()
+    make_corpus(args.outdir, args.kinds.split(','), args.sizes.split(','),
+                args.seed, args.by_size)
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 j_small_files.py              : compress sets of 1000 small synthetic files of 1K..256K
+# python3 j_small_files.py indir        : compress the (small) files of folder 'indir'
+# python3 j_small_files.py indir 3      : as above, with 3 repeats of each cell
+# python3 j_small_files.py --count 5000 --sizes 1K,4K,16K : sets of 5000 files of each size
+
+import os
+import sys
+import math
+import stat
+import shutil
+import ntpath
+import argparse
+import subprocess
+import psutil
+import stats
+import runner
+import results
+import i_make_corpus
+
+methods = ['per-file', 'recursive', 'tar']
+# below this ratio of per-file speed to the best single process, process
+# spawn dominates and invoking the compressor once per file is not viable
+viable_ratio = 0.5
+
+
+def make_files(outdir, count, size, kind='text', seed=0):
+    """
+    write 'count' synthetic files of 'size' bytes to folder 'outdir', see i_make_corpus.py
+
+    Parameters
+    ----------
+    outdir : str
+        folder for the files, created if needed
+    count : int
+        number of files
+    size : int
+        bytes per file
+    kind : str
+        kind of data (default 'text', like logs)
+    seed : int
+        random seed of the set (default 0)
+    """
+
+    os.makedirs(outdir, exist_ok=True)
+    if kind in ['int16', 'float32']:
+        # every volume needs its own header
+        for i in range(count):
+            fnm = os.path.join(outdir, '{:07d}.nii'.format(i))
+            i_make_corpus.write_file(fnm, kind, size, seed + i)
+        return
+    # one stream for the whole set, cut into files: generating the text
+    # vocabulary for each small file would take far longer than compressing it
+    chunks = i_make_corpus.generate(kind, count * size, seed)
+    data = b''
+    for i in range(count):
+        while len(data) < size:
+            data += next(chunks)
+        fnm = os.path.join(outdir, '{:07d}.txt'.format(i))
+        with open(fnm, 'wb') as fh:
+            fh.write(data[:size])
+        data = data[size:]
+
+
+def _input_files(indir):
+    files = []
+    for f in sorted(os.listdir(indir)):
+        fnm = os.path.join(indir, f)
+        if not os.path.isfile(fnm) or f.startswith('.'):
+            continue
+        if f.endswith(('.gz', '.zst', '.bz2')):
+            continue
+        files.append(fnm)
+    return files
+
+
+def _clean(indir):
+    for f in os.listdir(indir):
+        if f.endswith('.gz'):
+            os.remove(os.path.join(indir, f))
+
+
+def _opts(exe, lvl, threads):
+    args = [exe, '-{}'.format(lvl)]
+    if threads > 0:
+        args += ['-p', str(threads)]
+    return args
+
+
+def run_method(method, exe, indir, files, lvl=6, threads=0):
+    """
+    compress every file of 'indir' once with 'method'
+
+    Parameters
+    ----------
+    method : str
+        'per-file': one process per file, as _cmp does in the other scripts,
+        'recursive': one 'exe -r' process for the folder,
+        'tar': 'tar -cf - | exe -c' streaming the folder through a pipe
+    exe : str
+        name of compression executable
+    indir : str
+        folder with files to compress
+    files : list of str
+        names of the files in 'indir'
+    lvl : int
+        compression level (default 6)
+    threads : int
+        number of threads (-p), 0 to use the default of exe
+
+    Returns
+    -------
+    total seconds, compressed bytes and a list of seconds per file ('per-file' only)
+    """
+
+    latencies = []
+    if method == 'per-file':
+        seconds = 0
+        for fnm in files:
+            usage = runner.run(_opts(exe, lvl, threads) + ['-k', '-f', fnm])
+            latencies.append(usage['wall'])
+            seconds += usage['wall']
+    elif method == 'recursive':
+        seconds = runner.run(_opts(exe, lvl, threads) + ['-r', '-k', '-f', indir])['wall']
+    else:
+        tar = subprocess.Popen(['tar', '-cf', '-', '-C', indir] +
+                               [os.path.basename(fnm) for fnm in files],
+                               stdout=subprocess.PIPE)
+        try:
+            usage = runner.run_stream(_opts(exe, lvl, threads) + ['-c'], stdin=tar.stdout)
+        finally:
+            tar.stdout.close()
+            tar.wait()
+        return usage['wall'], usage['bytes_out'], latencies
+    nsize = 0
+    for fnm in files:
+        if os.path.isfile(fnm + '.gz'):
+            nsize += os.stat(fnm + '.gz').st_size
+    _clean(indir)
+    return seconds, nsize, latencies
+
+
+def test_exe(exe, indir, threads=0, lvl=6, repeats=3, rel_width=0, budget=60.0,
+             results_file='small_files.db', label=''):
+    """
+    compare per-file, recursive and tar streaming compression of the files in folder 'indir'
+
+    Parameters
+    ----------
+    exe : str
+        name of compression executable
+    indir : str
+        folder with small files
+    threads : int
+        number of threads (-p), 0 to use the default of exe
+    lvl : int
+        compression level (default 6)
+    repeats : int
+        number of repeats (minimum number when adaptive)
+    rel_width : float
+        target relative width of the 95% CI, 0 for a fixed number of repeats
+    budget : float
+        maximum seconds spent on adaptive repeats of one cell
+    results_file : str
+        SQLite file where results are appended
+    label : str
+        name of the file set, e.g. its file size (default '', the folder name)
+
+    Returns
+    -------
+    the per-file row with its 'per-file ratio' and 'viable' flag, () if skipped
+    or when the ratio is unknown
+    """
+
+    if not os.path.exists(exe) and not shutil.which(exe):
+        print('Skipping test: Unable to find "' + exe + '"')
+        return ()
+    meth = ntpath.basename(exe)
+    exe_hash = results.exe_hash(exe)
+    if len(label) < 1:
+        label = ntpath.basename(os.path.normpath(indir))
+    files = _input_files(indir)
+    if len(files) < 1:
+        print('Skipping test: no files in ' + indir)
+        return ()
+    _clean(indir)
+    size = sum(os.stat(fnm).st_size for fnm in files)
+    bytes_per_mb = 1000000
+    speeds = {}
+    rows = []
+    for method in methods:
+        if method == 'tar' and not shutil.which('tar'):
+            print('Skipping tar: Unable to find "tar"')
+            continue
+        reps = []
+
+        def measure():
+            reps.append(run_method(method, exe, indir, files, lvl, threads))
+            return reps[-1][0]
+
+        summary = stats.repeat(measure, repeats, rel_width, budget)
+        seconds, nsize, latencies = min(reps, key=lambda r: r[0])
+        speeds[method] = size / bytes_per_mb / seconds
+        row = {'exe': meth, 'exe_hash': exe_hash, 'method': method,
+               'set': label, 'files': len(files),
+               'mean file bytes': size / len(files), 'level': lvl,
+               'threads': threads, 'size %': nsize / size * 100,
+               'files/s': len(files) / seconds, 'speed mb/s': speeds[method]}
+        for q in [50, 90, 99]:
+            row['p{} ms'.format(q)] = stats.percentile(latencies, q) * 1000
+        row.update(stats.cell_fields(summary))
+        rows.append(row)
+        print('{}\t{}\t{}\t{}\t{:.0f}\t{:.1f}\t{:.2f}\t{:.2f}'.format(meth,
+              label, method, len(files), row['files/s'], row['speed mb/s'],
+              row['p50 ms'], row['p99 ms']))
+    single = [speeds[method] for method in speeds if method != 'per-file']
+    if 'per-file' not in speeds or len(single) < 1:
+        results.append(results_file, 'cells', rows)
+        print('Skipping per-file ratio: per-file and a single process method are both needed')
+        return ()
+    row = [row for row in rows if row['method'] == 'per-file'][0]
+    ratio = speeds['per-file'] / max(single)
+    row['per-file ratio'] = ratio
+    row['viable'] = int(ratio >= viable_ratio)
+    results.append(results_file, 'cells', rows)
+    print('{}\t{}\tper-file speed is {:.2f} of the best single process{}'.format(
+          meth, label, ratio, '' if ratio >= viable_ratio else ', not viable'))
+    return row
+
+
+def crossover(cells):
+    """
+    mean file size above which one process per file becomes viable
+
+    Parameters
+    ----------
+    cells : list of dict
+        per-file rows of one exe from test_exe(), one for each file set
+
+    Returns
+    -------
+    mean file bytes where the per-file ratio reaches 'viable_ratio',
+    interpolated on a log scale between the sets either side of it. The
+    smallest set when every set is viable, nan when none is
+    """
+
+    cells = sorted(cells, key=lambda c: c['mean file bytes'])
+    if len(cells) < 1 or cells[-1]['per-file ratio'] < viable_ratio:
+        return float('nan')
+    if cells[0]['per-file ratio'] >= viable_ratio:
+        return cells[0]['mean file bytes']
+    # the last set below the threshold and the next, viable, set
+    i = max(j for j, c in enumerate(cells) if c['per-file ratio'] < viable_ratio)
+    lo, hi = cells[i], cells[i + 1]
+    frac = ((viable_ratio - lo['per-file ratio']) /
+            (hi['per-file ratio'] - lo['per-file ratio']))
+    return math.exp(math.log(lo['mean file bytes']) + frac *
+                    (math.log(hi['mean file bytes']) - math.log(lo['mean file bytes'])))
+
+
+def plot(results_file):
+    """line-plot of files per second against mean file size for each method
+
+    Parameters
+    ----------
+    results_file : str
+        name of SQLite results file to plot
+    """
+
+    if not os.path.exists(results_file):
+        print('No file named "' + results_file + '"')
+        return ()
+    if os.name == 'posix' and 'DISPLAY' not in os.environ:
+        print('Plot the results on a machine with a graphical display')
+        return ()
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    df = results.load(results_file, 'cells',
+                      ['exe', 'method', 'mean file bytes', 'speed mb/s'],
+                      'run_id = ?', (results.latest_run(results_file),))
+    sns.set()
+    ax = sns.lineplot(x='mean file bytes', y='speed mb/s', hue='exe',
+                      style='method', data=df, marker='o')
+    ax.set_xscale('log')
+    ax.set_title('Small File Compression')
+    plt.savefig(results_file.replace('.db', '.png'))
+
+
+if __name__ == '__main__':
+    """Compare ways to compress many small files
+
+    Parameters
+    ----------
+    indir : str
+        folder with small files (default '', make synthetic sets of '--count' files of each of '--sizes')
+    repeats : int
+     how many times is each set compressed (default 3)
+    --count : int
+     number of files in each synthetic set (default 1000)
+    --sizes : str
+     comma separated file sizes of the synthetic sets (default 1K,4K,16K,64K,256K)
+    --kind : str
+     kind of synthetic data, see i_make_corpus.py (default text)
+    --level : int
+     compression level (default 6)
+    --threads : int
+     pigz threads (default number of physical cores)
+    --adaptive : float
+     repeat each cell until its 95% CI is narrower than this fraction of the median
+    --budget : float
+     maximum seconds spent on adaptive repeats of one cell (default 60)
+    """
+
+    parser = argparse.ArgumentParser(description='Small file compression')
+    parser.add_argument('indir', nargs='?', default='', help='folder with small files')
+    parser.add_argument('repeats', nargs='?', type=int, default=3, help='repeats (minimum repeats when adaptive)')
+    parser.add_argument('--count', type=int, default=1000, help='files in each synthetic set')
+    parser.add_argument('--sizes', default='1K,4K,16K,64K,256K', help='comma separated file sizes of the synthetic sets')
+    parser.add_argument('--kind', default='text', choices=i_make_corpus.kinds, help='kind of synthetic data')
+    parser.add_argument('--level', type=int, default=6, help='compression level')
+    parser.add_argument('--threads', type=int, default=0, help='pigz threads (default: physical cores)')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='REL',
+                        help='repeat until the 95%% CI of the median is narrower than REL, e.g. 0.02')
+    parser.add_argument('--budget', type=float, default=60.0, help='maximum seconds for adaptive repeats of one cell')
+    args = parser.parse_args()
+    threads = args.threads
+    if threads < 1:
+        threads = psutil.cpu_count(logical=False) or 1
+    exes = [('gzip', 0)]
+    exedir = './exe'
+    if os.path.isdir(exedir):
+        for exe in sorted(os.listdir(exedir)):
+            exe = os.path.join(exedir, exe)
+            if os.path.isfile(exe):
+                mode = os.stat(exe).st_mode
+                executable = stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH
+                if mode & executable:
+                    exes.append((os.path.abspath(exe), threads))
+    sets = []
+    tmpdir = ''
+    if len(args.indir) > 0:
+        if not os.path.isdir(args.indir):
+            sys.exit('Unable to find ' + args.indir)
+        sets.append((args.indir, ''))
+        results_file = ntpath.basename(os.path.normpath(args.indir)) + '_small_files.db'
+    else:
+        tmpdir = os.path.abspath('./temp_small')
+        results_file = 'small_files.db'
+        for txt in args.sizes.split(','):
+            folder = os.path.join(tmpdir, txt)
+            print('Writing {} files of {} to {}'.format(args.count, txt, folder))
+            make_files(folder, args.count, i_make_corpus.parse_size(txt), args.kind)
+            sets.append((folder, txt))
+    print('exe\tset\tmethod\tfiles\tfiles/s\tmb/s\tp50 ms\tp99 ms')
+    cells = {}
+    for indir, label in sets:
+        for exe, exe_threads in exes:
+            cell = test_exe(exe, indir, exe_threads, args.level, args.repeats,
+                            args.adaptive, args.budget, results_file, label)
+            if len(cell) > 0:
+                cells.setdefault(cell['exe'], []).append(cell)
+    rows = []
+    for meth, exe_cells in cells.items():
+        size = crossover(exe_cells)
+        largest = max(c['mean file bytes'] for c in exe_cells)
+        rows.append({'exe': meth, 'exe_hash': exe_cells[0]['exe_hash'],
+                     'sets': len(exe_cells), 'viable ratio': viable_ratio,
+                     'crossover bytes': size})
+        if size != size:
+            print('{}\tper-file is not viable up to {:.0f} bytes per file'.format(meth, largest))
+        else:
+            print('{}\tper-file is viable from {:.0f} bytes per file'.format(meth, size))
+    if len(rows) > 0:
+        results.append(results_file, 'crossover', rows)
+    if len(tmpdir) > 0:
+        shutil.rmtree(tmpdir)
+    plot(results_file)
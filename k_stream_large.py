@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 k_stream_large.py               : stream 4 GB of synthetic text through each pigz build
+# python3 k_stream_large.py --size 20G --kind int16  : 20 GB of a synthetic NIfTI series
+# python3 k_stream_large.py --corpus ./corpus --size 10G : the files of './corpus', repeated up to 10 GB
+# python3 k_stream_large.py --threads 1,4,16 --window 0.5
+
+import os
+import sys
+import stat
+import time
+import zlib
+import shutil
+import ntpath
+import argparse
+import threading
+import subprocess
+import numpy as np
+import psutil
+import runner
+import results
+import i_make_corpus
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+bytes_per_mb = 1000000
+
+
+def make_block(nbytes, kind='text', corpus='', seed=0):
+    """
+    bytes held in memory and repeated to form the stream, so generating the input costs nothing
+
+    Deflate only looks back 32 KB, so repeating a block of many megabytes
+    compresses like the same amount of new data of that kind.
+
+    Parameters
+    ----------
+    nbytes : int
+        size of the block
+    kind : str
+        kind of synthetic data, see i_make_corpus.py (default 'text')
+    corpus : str
+        folder whose files are concatenated instead of synthetic data (default '')
+    seed : int
+        random seed of synthetic data (default 0)
+    """
+
+    if len(corpus) < 1:
+        return b''.join(i_make_corpus.generate(kind, nbytes, seed))
+    pieces = []
+    size = 0
+    for f in sorted(os.listdir(corpus)):
+        fnm = os.path.join(corpus, f)
+        if not os.path.isfile(fnm) or f.startswith('.'):
+            continue
+        with open(fnm, 'rb') as fh:
+            pieces.append(fh.read(nbytes - size))
+        size += len(pieces[-1])
+        if size >= nbytes:
+            break
+    if size < 1:
+        sys.exit('No files in ' + corpus)
+    return b''.join(pieces)
+
+
+def _pipe():
+    r, w = os.pipe()
+    if hasattr(fcntl, 'F_SETPIPE_SZ'):
+        try:
+            # fewer, larger writes: 1 MB is the default limit for unprivileged users
+            fcntl.fcntl(w, fcntl.F_SETPIPE_SZ, 1 << 20)
+        except OSError:
+            pass
+    return r, w
+
+
+def _feed(fd, block, size, fed):
+    """write 'block' repeatedly to pipe 'fd' until 'size' bytes were written, then close it"""
+
+    view = memoryview(block)
+    try:
+        while fed[0] < size:
+            piece = view[:min(len(view), size - fed[0])]
+            while len(piece) > 0:
+                n = os.write(fd, piece[:1 << 20])
+                piece = piece[n:]
+                fed[0] += n
+    except BrokenPipeError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _cpu_rss(proc):
+    """user+sys seconds and RSS bytes of 'proc' and its descendants (e.g. pigz under perf)"""
+
+    cpu = 0.0
+    rss = 0
+    for p in [proc] + proc.children(recursive=True):
+        try:
+            t = p.cpu_times()
+            cpu += t.user + t.system
+            rss += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return cpu, rss
+
+
+def stream(args, block, size, window=1.0, check=False):
+    """
+    stream 'size' bytes made of repeats of 'block' through command 'args', nothing touches the disk
+
+    Parameters
+    ----------
+    args : list of str
+        command reading stdin and writing stdout, e.g. ['pigz', '-c', '-p', '4']
+    block : bytes
+        data repeated to form the input
+    size : int
+        bytes of input
+    window : float
+        seconds between throughput samples (default 1)
+    check : bool
+        compute the CRC32 of the output (default False)
+
+    Returns
+    -------
+    dict from runner.run() plus 'bytes_in', 'bytes_out', 'crc32' and 'windows',
+    a list of (seconds, bytes in, bytes out, cpu seconds, rss bytes) samples
+    """
+
+    r_in, w_in = _pipe()
+    r_out, w_out = _pipe()
+    fed = [0]
+    out = {'bytes_out': 0, 'crc32': 0}
+    windows = []
+
+    def monitor(pid, stop):
+        t0 = time.perf_counter()
+        try:
+            proc = psutil.Process(pid)
+        except psutil.Error:
+            return
+        while not stop.wait(window):
+            cpu, rss = _cpu_rss(proc)
+            windows.append((time.perf_counter() - t0, fed[0], out['bytes_out'], cpu, rss))
+
+    def during(pid):
+        # only the child may hold these ends, or the pipes never reach EOF
+        os.close(r_in)
+        os.close(w_out)
+        stop = threading.Event()
+        threads = [threading.Thread(target=_feed, args=(w_in, block, size, fed), daemon=True),
+                   threading.Thread(target=monitor, args=(pid, stop), daemon=True)]
+        for thread in threads:
+            thread.start()
+        buf = bytearray(1 << 20)
+        view = memoryview(buf)
+        crc = 0
+        with os.fdopen(r_out, 'rb', buffering=0) as fh:
+            while True:
+                n = fh.readinto(buf)
+                if not n:
+                    break
+                if check:
+                    crc = zlib.crc32(view[:n], crc)
+                out['bytes_out'] += n
+        out['crc32'] = crc
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    usage = runner.run(args, r_in, w_out, during=during)
+    usage.update(out)
+    usage['bytes_in'] = fed[0]
+    usage['windows'] = windows
+    return usage
+
+
+def steady_state(times, rates):
+    """
+    split a throughput series into warm-up and steady state
+
+    Parameters
+    ----------
+    times : list of float
+        end of each window in seconds
+    rates : list of float
+        throughput of each window
+
+    Returns
+    -------
+    dict with 'warmup s' (end of the first window reaching 90% of the median of
+    the second half), 'steady mb/s' (median after warm-up), 'min window mb/s',
+    'cv %' of the steady windows and 'stalls' (steady windows below half the median)
+    """
+
+    if len(rates) < 1:
+        return {}
+    target = 0.9 * float(np.median(rates[len(rates) // 2:]))
+    start = 0
+    while start < len(rates) - 1 and rates[start] < target:
+        start += 1
+    steady = np.array(rates[start:])
+    median = float(np.median(steady))
+    return {'warmup s': times[start], 'steady mb/s': median,
+            'min window mb/s': float(steady.min()),
+            'cv %': float(steady.std() / max(steady.mean(), 1e-9) * 100),
+            'stalls': int(np.sum(steady < 0.5 * median))}
+
+
+def test_exe(exe, block, size, thread_list, lvl=6, window=1.0,
+             results_file='stream_large.db', label=''):
+    """
+    compress and decompress a multi-GB stream at each thread count, sampling throughput over time
+
+    Parameters
+    ----------
+    exe : str
+        name of compression executable
+    block : bytes
+        data repeated to form the stream, see make_block
+    size : int
+        bytes of uncompressed input
+    thread_list : list of int
+        thread counts (-p), 0 to use the default of exe
+    lvl : int
+        compression level (default 6)
+    window : float
+        seconds between throughput samples (default 1)
+    results_file : str
+        SQLite file where results are appended
+    label : str
+        description of the data, e.g. 'text' (default '')
+    """
+
+    if not os.path.exists(exe) and not shutil.which(exe):
+        print('Skipping test: Unable to find "' + exe + '"')
+        return ()
+    meth = ntpath.basename(exe)
+    exe_hash = results.exe_hash(exe)
+    # decompression reads whole gzip members, each the compressed block
+    member = subprocess.run([exe, '-c', '-{}'.format(lvl)], input=block,
+                            stdout=subprocess.PIPE, check=True).stdout
+    members = max(size // len(block), 1)
+    crc = 0
+    for i in range(members):
+        crc = zlib.crc32(block, crc)
+    for threads in thread_list:
+        opts = []
+        if threads > 0:
+            opts = ['-p', str(threads)]
+        for mode in ['compress', 'decompress']:
+            if mode == 'compress':
+                usage = stream([exe, '-c', '-{}'.format(lvl)] + opts, block, size, window)
+                raw = usage['bytes_in']
+            else:
+                usage = stream([exe, '-d', '-c'] + opts, member,
+                               members * len(member), window, True)
+                raw = usage['bytes_out']
+                if raw != members * len(block) or usage['crc32'] != crc:
+                    sys.exit('{} -d -c {}: output differs from the input'.format(
+                        meth, ' '.join(opts)))
+            times = []
+            rates = []
+            rows = []
+            # throughput is counted in uncompressed bytes both ways
+            col = 1
+            if mode == 'decompress':
+                col = 2
+            prev = (0.0, 0, 0, 0.0, 0)
+            for w in usage['windows']:
+                dt = w[0] - prev[0]
+                rate = (w[col] - prev[col]) / bytes_per_mb / dt
+                times.append(w[0])
+                rates.append(rate)
+                rows.append({'exe': meth, 'exe_hash': exe_hash, 'mode': mode,
+                             'threads': threads, 'seconds': w[0],
+                             'speed mb/s': rate,
+                             'cpu cores': (w[3] - prev[3]) / dt,
+                             'rss mb': w[4] / bytes_per_mb})
+                prev = w
+            results.append(results_file, 'windows', rows)
+            row = {'exe': meth, 'exe_hash': exe_hash, 'mode': mode,
+                   'data': label, 'threads': threads, 'level': lvl,
+                   'gb': raw / 1e9, 'size %': len(member) / len(block) * 100,
+                   'speed mb/s': raw / bytes_per_mb / usage['wall'],
+                   'cpu cores': (usage['user'] + usage['sys']) / usage['wall'],
+                   'peak rss mb': usage['maxrss'] / bytes_per_mb}
+            row.update(steady_state(times, rates))
+            results.append(results_file, 'cells', [row])
+            print('{}\t{}\t{}\t{:.0f}\t{:.0f}\t{:.1f}\t{}\t{:.1f}\t{:.0f}'.format(
+                  meth, mode, threads, row['speed mb/s'],
+                  row.get('steady mb/s', float('nan')),
+                  row.get('warmup s', float('nan')), row.get('stalls', 0),
+                  row['cpu cores'], row['peak rss mb']))
+
+
+def plot(results_file):
+    """line-plot of throughput over time for each exe and thread count
+
+    Parameters
+    ----------
+    results_file : str
+        name of SQLite results file to plot
+    """
+
+    if not os.path.exists(results_file):
+        print('No file named "' + results_file + '"')
+        return ()
+    if os.name == 'posix' and 'DISPLAY' not in os.environ:
+        print('Plot the results on a machine with a graphical display')
+        return ()
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    df = results.load(results_file, 'windows',
+                      ['exe', 'mode', 'threads', 'seconds', 'speed mb/s'],
+                      'run_id = ?', (results.latest_run(results_file),))
+    sns.set()
+    sns.relplot(x='seconds', y='speed mb/s', hue='exe', style='threads',
+                col='mode', data=df, kind='line')
+    plt.savefig(results_file.replace('.db', '.png'))
+
+
+if __name__ == '__main__':
+    """Sustained throughput of a multi-GB stream
+
+    Parameters
+    ----------
+    --size : str
+     bytes streamed through each command, e.g. 4G or 20G (default 4G)
+    --kind : str
+     kind of synthetic data, see i_make_corpus.py (default text)
+    --corpus : str
+     folder whose files are repeated instead of synthetic data
+    --block : str
+     size of the data held in memory and repeated (default 64M)
+    --threads : str
+     comma separated thread counts (default 1 and the number of physical cores)
+    --level : int
+     compression level (default 6)
+    --window : float
+     seconds between throughput samples (default 1)
+    """
+
+    parser = argparse.ArgumentParser(description='Multi-GB streaming benchmark')
+    parser.add_argument('--size', default='4G', help='bytes streamed, e.g. 4G')
+    parser.add_argument('--kind', default='text', choices=i_make_corpus.kinds, help='kind of synthetic data')
+    parser.add_argument('--corpus', default='', help='folder whose files are repeated instead of synthetic data')
+    parser.add_argument('--block', default='64M', help='size of the data repeated to form the stream')
+    parser.add_argument('--threads', default='', help='comma separated thread counts (pigz -p)')
+    parser.add_argument('--level', type=int, default=6, help='compression level')
+    parser.add_argument('--window', type=float, default=1.0, help='seconds between throughput samples')
+    args = parser.parse_args()
+    size = i_make_corpus.parse_size(args.size)
+    if len(args.threads) > 0:
+        thread_list = [int(x) for x in args.threads.split(',')]
+    else:
+        thread_list = sorted(set([1, psutil.cpu_count(logical=False) or 1]))
+    label = args.kind
+    if len(args.corpus) > 0:
+        if not os.path.isdir(args.corpus):
+            sys.exit('Unable to find ' + args.corpus)
+        label = ntpath.basename(os.path.normpath(args.corpus))
+    block = make_block(min(i_make_corpus.parse_size(args.block), size),
+                       args.kind, args.corpus)
+    results_file = label + '_stream_large.db'
+    print('exe\tmode\tthreads\tmb/s\tsteady mb/s\twarmup s\tstalls\tcpu cores\tpeak rss mb')
+    test_exe('gzip', block, size, [0], args.level, args.window, results_file, label)
+    exedir = './exe'
+    if os.path.isdir(exedir):
+        for exe in sorted(os.listdir(exedir)):
+            exe = os.path.join(exedir, exe)
+            if os.path.isfile(exe):
+                mode = os.stat(exe).st_mode
+                executable = stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH
+                if mode & executable:
+                    test_exe(os.path.abspath(exe), block, size, thread_list,
+                             args.level, args.window, results_file, label)
+    plot(results_file)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 l_python_backends.py          : test installed Python compression libraries on folder 'corpus'
+# python3 l_python_backends.py indir    : as above for folder 'indir'
+# python3 l_python_backends.py indir 3  : as above, with 3 repeats of each cell
+# python3 l_python_backends.py indir 3 --backends py-isal,py-zstd --threads 1,8 --chunk 4M
+
+import os
+import sys
+import time
+import ntpath
+import argparse
+import psutil
+import stats
+import results
+import backends
+import i_make_corpus
+import g_zlib_inprocess
+
+
+def test_backend(
+    backend,
+    corpus,
+    levels=None,
+    thread_list=(1, ),
+    chunk=10 ** 6,
+    repeats=3,
+    rel_width=0,
+    budget=60.0,
+    results_file='speed_size.db',
+    ):
+    """
+    time in-process compression and decompression of in-memory files with one backend
+
+    Parameters
+    ----------
+    backend : dict
+        entry of backends.backends
+    corpus : list of (str, bytes)
+        file names and contents, see g_zlib_inprocess.read_corpus
+    levels : list of int
+        compression levels to test (default None, the levels of the backend)
+    thread_list : list of int
+        threads compressing and decompressing chunks
+    chunk : int
+        uncompressed bytes per chunk (default 10**6), 0 for one chunk per file
+    repeats : int
+        number of repeats (minimum number when adaptive)
+    rel_width : float
+        target relative width of the 95% CI, 0 for a fixed number of repeats
+    budget : float
+        maximum seconds spent on adaptive repeats of one cell
+    results_file : str
+        SQLite file where results are appended, the same as for the pigz builds
+    """
+
+    if levels is None:
+        levels = backend['levels']
+    levels = [lvl for lvl in levels if lvl in backend['levels']]
+    name = backend['name']
+    size = sum(len(data) for f, data in corpus)
+    bytes_per_mb = 1000000
+    for threads in thread_list:
+        pool = backends.pool(threads)
+        for lvl in levels:
+            compressed = []
+
+            def measure_compress():
+                compressed.clear()
+                seconds = 0
+                for f, data in corpus:
+                    t0 = time.perf_counter()
+                    compressed.append(backends.compress_chunks(backend, data, lvl,
+                                                               pool, chunk, threads))
+                    seconds += time.perf_counter() - t0
+                return seconds
+
+            def measure_decompress():
+                seconds = 0
+                for chunks in compressed:
+                    t0 = time.perf_counter()
+                    backends.decompress_chunks(backend, chunks, pool, threads)
+                    seconds += time.perf_counter() - t0
+                return seconds
+
+            csummary = stats.repeat(measure_compress, repeats, rel_width, budget)
+            for (f, data), chunks in zip(corpus, compressed):
+                if backends.decompress_chunks(backend, chunks, pool, threads) != data:
+                    sys.exit('{} level {} threads {}: round trip differs for {}'.format(
+                        name, lvl, threads, f))
+            dsummary = stats.repeat(measure_decompress, repeats, rel_width, budget)
+            nsize = sum(len(c) for chunks in compressed for c in chunks)
+            cspeed = size / bytes_per_mb / csummary['min']
+            dspeed = size / bytes_per_mb / dsummary['min']
+            print('{}\t{}\t{}\t{:.0f}\t{:.0f}\t{:.2f}'.format(name, lvl, threads,
+                  cspeed, dspeed, nsize / size * 100))
+            rows = []
+            for mode, speed, summary in [('compress', cspeed, csummary),
+                                         ('decompress', dspeed, dsummary)]:
+                row = {'exe': name, 'exe_hash': backend['version'], 'mode': mode,
+                       'level': lvl, 'threads': threads, 'chunk kb': chunk / 1000,
+                       'size %': nsize / size * 100, 'speed mb/s': speed}
+                row.update(stats.cell_fields(summary))
+                rows.append(row)
+            results.append(results_file, 'cells', rows)
+        if pool is not None:
+            pool.shutdown()
+
+
+if __name__ == '__main__':
+    """Compare in-process Python compression libraries
+
+    Parameters
+    ----------
+    indir : str
+        folder with files to compress (default './corpus')
+    repeats : int
+     how many times is each file compressed (default 3)
+    --backends : str
+     comma separated backends (default all installed): py-zlib, py-gzip,
+     py-mgzip, py-isal, py-zlib-ng, py-zstd
+    --levels : str
+     comma separated compression levels (default the levels of each backend)
+    --threads : str
+     comma separated thread counts (default 1 and the number of physical cores)
+    --chunk : str
+     uncompressed bytes per chunk, e.g. 1M (default 1M), 0 for whole files
+    --adaptive : float
+     repeat each cell until its 95% CI is narrower than this fraction of the median
+    --budget : float
+     maximum seconds spent on adaptive repeats of one cell (default 60)
+    """
+
+    parser = argparse.ArgumentParser(description='In-process Python compression backends')
+    parser.add_argument('indir', nargs='?', default='./corpus', help='folder with files to compress')
+    parser.add_argument('repeats', nargs='?', type=int, default=3, help='repeats (minimum repeats when adaptive)')
+    parser.add_argument('--backends', default='', help='comma separated backends, e.g. py-isal,py-zstd')
+    parser.add_argument('--levels', default='', help='comma separated compression levels')
+    parser.add_argument('--threads', default='', help='comma separated thread counts')
+    parser.add_argument('--chunk', default='1M', help='uncompressed bytes per chunk, 0 for whole files')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='REL',
+                        help='repeat until the 95%% CI of the median is narrower than REL, e.g. 0.02')
+    parser.add_argument('--budget', type=float, default=60.0, help='maximum seconds for adaptive repeats of one cell')
+    args = parser.parse_args()
+    indir = args.indir
+    if not os.path.isdir(indir):
+        sys.exit('Run a_compile.py first: Unable to find ' + indir)
+    names = None
+    if len(args.backends) > 0:
+        names = args.backends.split(',')
+    levels = None
+    if len(args.levels) > 0:
+        levels = [int(x) for x in args.levels.split(',')]
+    if len(args.threads) > 0:
+        thread_list = [int(x) for x in args.threads.split(',')]
+    else:
+        thread_list = sorted(set([1, psutil.cpu_count(logical=False) or 1]))
+    chunk = i_make_corpus.parse_size(args.chunk)
+    corpus = g_zlib_inprocess.read_corpus(indir)
+    # the same table as f_speed_size_decompress.py, so libraries and pigz builds share charts
+    results_file = ntpath.basename(os.path.normpath(indir)) + '_speed_size.db'
+    print('Backend\tLevel\tThreads\tcomp mb/s\tdecomp mb/s\t%')
+    for backend in backends.available(names):
+        test_backend(backend, corpus, levels, thread_list, chunk, args.repeats,
+                     args.adaptive, args.budget, results_file)
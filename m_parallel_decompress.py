@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 m_parallel_decompress.py          : parallel decompression of blocked gzip formats for folder 'corpus'
+# python3 m_parallel_decompress.py indir    : as above for folder 'indir'
+# python3 m_parallel_decompress.py indir 3  : as above, with 3 repeats of each cell
+# python3 m_parallel_decompress.py indir 3 --threads 1,2,4,8 --level 6
+
+import os
+import sys
+import stat
+import time
+import zlib
+import ntpath
+import shutil
+import struct
+import argparse
+import psutil
+import stats
+import cache
+import runner
+import results
+import backends
+import validate
+
+bytes_per_mb = 1000000
+
+
+def gzip_header_size(data):
+    """
+    bytes of the gzip member header at the start of 'data' (RFC 1952)
+
+    Parameters
+    ----------
+    data : bytes
+        gzip file
+    """
+
+    if len(data) < 18 or data[0] != 0x1f or data[1] != 0x8b or data[2] != 8:
+        raise ValueError('not a gzip file')
+    flags = data[3]
+    pos = 10
+    if flags & 4:  # FEXTRA
+        pos += 2 + struct.unpack_from('<H', data, pos)[0]
+    for flag in [8, 16]:  # FNAME, FCOMMENT
+        if flags & flag:
+            pos = data.index(b'\0', pos) + 1
+    if flags & 2:  # FHCRC
+        pos += 2
+    return pos
+
+
+def split_points(data, pieces):
+    """
+    offsets where 'data' can be cut into about 'pieces' parts of independent deflate blocks
+
+    pigz -i ends every block with an empty stored block, the bytes 00 00 ff ff,
+    and starts the next block without a dictionary, so inflate can start right
+    after any such marker. The same bytes can also occur inside compressed data:
+    inflate_split detects false cuts and then decodes serially.
+
+    Parameters
+    ----------
+    data : bytes
+        gzip file made by 'pigz -i'
+    pieces : int
+        number of parts wanted
+
+    Returns
+    -------
+    list of offsets, starting with the end of the gzip header
+    """
+
+    start = gzip_header_size(data)
+    points = [start]
+    if pieces < 2:
+        return points
+    step = (len(data) - start) // pieces
+    pos = start + step
+    while pos < len(data) - 8:
+        pos = data.find(b'\x00\x00\xff\xff', pos, len(data) - 8)
+        if pos < 0:
+            break
+        points.append(pos + 4)
+        pos = pos + 4 + step
+    return points
+
+
+def _inflate_piece(view, last):
+    d = zlib.decompressobj(-15)
+    out = d.decompress(view)
+    if d.eof != last:
+        raise zlib.error('cut inside a deflate block')
+    return out
+
+
+def inflate_split(data, pool=None, pieces=0):
+    """
+    decompress a 'pigz -i' file by inflating its independent blocks in parallel
+
+    Parameters
+    ----------
+    data : bytes
+        single member gzip file made by 'pigz -i'
+    pool : concurrent.futures.Executor
+        pool inflating the parts (default None, serial)
+    pieces : int
+        number of parts (default 0, a single part)
+
+    Returns
+    -------
+    uncompressed bytes and True if the parts were inflated in parallel,
+    False if a false cut forced serial decoding
+    """
+
+    points = split_points(data, pieces) + [len(data)]
+    view = memoryview(data)
+    parts = [(view[points[i]:points[i + 1]], i == len(points) - 2)
+             for i in range(len(points) - 1)]
+    crc, isize = struct.unpack_from('<II', data, len(data) - 8)
+    try:
+        if pool is None or len(parts) < 2:
+            outs = [_inflate_piece(v, last) for v, last in parts]
+        else:
+            outs = list(pool.map(lambda part: _inflate_piece(*part), parts))
+        out = b''.join(outs)
+        if len(out) & 0xffffffff == isize and zlib.crc32(out) == crc:
+            return out, len(parts) > 1
+    except zlib.error:
+        pass
+    out = _inflate_piece(view[points[0]:], True)
+    if zlib.crc32(out) != crc:
+        raise zlib.error('CRC32 of the decompressed data differs')
+    return out, False
+
+
+def _input_files(indir):
+    files = []
+    for f in sorted(os.listdir(indir)):
+        fnm = os.path.join(indir, f)
+        if not os.path.isfile(fnm) or f.startswith('.'):
+            continue
+        if f.endswith(('.gz', '.zst', '.bz2')):
+            continue
+        files.append(fnm)
+    return files
+
+
+def _compress_exe(exe, opts, lvl, fnm, outnm):
+    """compress 'fnm' to 'outnm' with 'exe opts -lvl -c', reusing cached outputs"""
+
+    if cache.fetch(exe, opts, lvl, fnm, outnm):
+        return
+    args = runner.command(exe, opts, lvl) + [fnm]
+    with open(outnm, 'wb') as fh:
+        usage = runner.run(args, stdout=fh)
+    if usage['returncode'] != 0:
+        sys.exit('Unable to compress ' + fnm)
+    cache.store(exe, opts, lvl, fnm, outnm)
+
+
+def _mgzip_compress(backend, lvl, fnm, outnm):
+    with open(fnm, 'rb') as fh:
+        data = fh.read()
+    with open(outnm, 'wb') as fh:
+        fh.write(b''.join(backends.compress_chunks(backend, data, lvl)))
+
+
+def make_formats(exes, lvl):
+    """
+    blocked gzip formats to test, plain gzip first as the baseline
+
+    Each format is a dict with 'format', 'exe', a 'compress' function (fnm, outnm)
+    and a list of 'decoders': (name, function, threaded). The function is called
+    with (outnm, data, threads, pool) and returns a dict with 'wall', 'bytes_out'
+    and 'crc32'. Decoders that are not threaded are only timed with one thread.
+
+    Parameters
+    ----------
+    exes : list of str
+        pigz executables
+    lvl : int
+        compression level
+    """
+
+    def run_decoder(args):
+        return lambda outnm, data, threads, pool: runner.run_stream(args(threads) + [outnm])
+
+    def in_process(decode):
+        def measure(outnm, data, threads, pool):
+            t0 = time.perf_counter()
+            out = decode(data, threads, pool)
+            wall = time.perf_counter() - t0
+            return {'wall': wall, 'bytes_out': len(out), 'crc32': zlib.crc32(out)}
+        return measure
+
+    formats = [{'format': 'gzip', 'exe': 'gzip',
+                'compress': lambda fnm, outnm: _compress_exe('gzip', ' -c -', lvl, fnm, outnm),
+                'decoders': [('gzip -d', run_decoder(lambda n: ['gzip', '-d', '-c']), False)]}]
+    for exe in exes:
+        meth = ntpath.basename(exe)
+        formats.append({'format': 'pigz -i', 'exe': meth,
+                        'compress': lambda fnm, outnm, exe=exe: _compress_exe(exe, ' -i -c -', lvl, fnm, outnm),
+                        'decoders': [(meth + ' -d', run_decoder(
+                                          lambda n, exe=exe: [exe, '-d', '-c', '-p', str(n)]), True),
+                                     ('split inflate', in_process(
+                                          lambda data, n, pool: inflate_split(data, pool, 4 * n)[0]), True)]})
+    mgzip = backends.get('py-mgzip')
+    if mgzip is not None:
+        formats.append({'format': 'mgzip', 'exe': 'py-mgzip',
+                        'compress': lambda fnm, outnm: _mgzip_compress(mgzip, lvl, fnm, outnm),
+                        'decoders': [('mgzip', in_process(
+                                          lambda data, n, pool: backends.decompress_chunks(mgzip, [data], threads=n)),
+                                      True)]})
+    if shutil.which('bgzip'):
+        formats.append({'format': 'bgzf', 'exe': 'bgzip',
+                        'compress': lambda fnm, outnm: _compress_exe('bgzip', ' -c -l ', lvl, fnm, outnm),
+                        'decoders': [('bgzip -d', run_decoder(
+                                          lambda n: ['bgzip', '-d', '-c', '-@', str(n)]), True)]})
+    else:
+        print('Skipping test: Unable to find "bgzip"')
+    return formats
+
+
+def test_format(fmt, files, tmpdir, thread_list, lvl, gzip_size=0, repeats=3,
+                rel_width=0, budget=60.0, results_file='parallel_decompress.db'):
+    """
+    compress 'files' once in format 'fmt', check that gzip -d reads the result, then time
+    each decoder of the format at each thread count
+
+    Parameters
+    ----------
+    fmt : dict
+        format, see make_formats
+    files : list of str
+        uncompressed files
+    tmpdir : str
+        folder where compressed files are written
+    thread_list : list of int
+        thread counts
+    lvl : int
+        compression level
+    gzip_size : int
+        bytes of the same files compressed by plain gzip, 0 for the gzip baseline itself (default 0)
+    repeats : int
+        number of repeats (minimum number when adaptive)
+    rel_width : float
+        target relative width of the 95% CI, 0 for a fixed number of repeats
+    budget : float
+        maximum seconds spent on adaptive repeats of one cell
+    results_file : str
+        SQLite file where results are appended
+
+    Returns
+    -------
+    bytes of the compressed files
+    """
+
+    outnms = []
+    for fnm in files:
+        outnm = os.path.join(tmpdir, '{}_{}_{}.gz'.format(fmt['exe'], lvl, ntpath.basename(fnm)))
+        fmt['compress'](fnm, outnm)
+        outnms.append(outnm)
+    size = sum(os.stat(fnm).st_size for fnm in files)
+    nsize = sum(os.stat(outnm).st_size for outnm in outnms)
+    # blocked formats are only worth it if every gzip reader can still open them
+    compatible = validate.check_all([(['gzip', '-d', '-c', outnm], fnm)
+                                     for fnm, outnm in zip(files, outnms)]) == 0
+    overhead = 0.0
+    if gzip_size > 0:
+        overhead = (nsize / gzip_size - 1) * 100
+    datas = []
+    for outnm in outnms:
+        with open(outnm, 'rb') as fh:
+            datas.append(fh.read())
+    for decoder, decode, threaded in fmt['decoders']:
+        threads_tested = thread_list
+        if not threaded:
+            threads_tested = [1]
+        for threads in threads_tested:
+            pool = backends.pool(threads)
+            parallel = [0]
+
+            def measure():
+                seconds = 0
+                for fnm, outnm, data in zip(files, outnms, datas):
+                    usage = decode(outnm, data, threads, pool)
+                    ref = validate.reference(fnm)
+                    if usage['bytes_out'] != ref['bytes_out'] or usage['crc32'] != ref['crc32']:
+                        sys.exit('{}: decompressed {} differs from {}'.format(decoder, outnm, fnm))
+                    seconds += usage['wall']
+                return seconds
+
+            summary = stats.repeat(measure, repeats, rel_width, budget)
+            if pool is not None:
+                pool.shutdown()
+            speed = size / bytes_per_mb / summary['min']
+            row = {'exe': fmt['exe'], 'format': fmt['format'], 'decoder': decoder,
+                   'mode': 'decompress', 'level': lvl, 'threads': threads,
+                   'size %': nsize / size * 100, 'overhead %': overhead,
+                   'gzip -d': int(compatible), 'speed mb/s': speed}
+            row.update(stats.cell_fields(summary))
+            results.append(results_file, 'cells', [row])
+            print('{}\t{}\t{}\t{}\t{:.0f}\t{:.2f}\t{:.2f}\t{}'.format(fmt['exe'],
+                  fmt['format'], decoder, threads, speed, row['size %'], overhead,
+                  'yes' if compatible else 'no'))
+    return nsize
+
+
+def plot(results_file):
+    """line-plot of decompression speed against threads for each decoder
+
+    Parameters
+    ----------
+    results_file : str
+        name of SQLite results file to plot
+    """
+
+    if not os.path.exists(results_file):
+        print('No file named "' + results_file + '"')
+        return ()
+    if os.name == 'posix' and 'DISPLAY' not in os.environ:
+        print('Plot the results on a machine with a graphical display')
+        return ()
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    df = results.load(results_file, 'cells',
+                      ['exe', 'decoder', 'threads', 'speed mb/s'],
+                      'run_id = ?', (results.latest_run(results_file),))
+    sns.set()
+    sns.lineplot(x='threads', y='speed mb/s', hue='decoder', style='exe',
+                 data=df, marker='o')
+    plt.savefig(results_file.replace('.db', '.png'))
+
+
+if __name__ == '__main__':
+    """Parallel decompression of blocked gzip formats
+
+    Parameters
+    ----------
+    indir : str
+        folder with files to compress (default './corpus')
+    repeats : int
+     how many times is each file decompressed (default 3)
+    --threads : str
+     comma separated thread counts (default 1, 2, 4... up to the number of physical cores)
+    --level : int
+     compression level (default 6)
+    --adaptive : float
+     repeat each cell until its 95% CI is narrower than this fraction of the median
+    --budget : float
+     maximum seconds spent on adaptive repeats of one cell (default 60)
+    """
+
+    parser = argparse.ArgumentParser(description='Parallel decompression of blocked gzip formats')
+    parser.add_argument('indir', nargs='?', default='./corpus', help='folder with files to compress')
+    parser.add_argument('repeats', nargs='?', type=int, default=3, help='repeats (minimum repeats when adaptive)')
+    parser.add_argument('--threads', default='', help='comma separated thread counts')
+    parser.add_argument('--level', type=int, default=6, help='compression level')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='REL',
+                        help='repeat until the 95%% CI of the median is narrower than REL, e.g. 0.02')
+    parser.add_argument('--budget', type=float, default=60.0, help='maximum seconds for adaptive repeats of one cell')
+    args = parser.parse_args()
+    indir = args.indir
+    if not os.path.isdir(indir):
+        sys.exit('Run a_compile.py first: Unable to find ' + indir)
+    if len(args.threads) > 0:
+        thread_list = [int(x) for x in args.threads.split(',')]
+    else:
+        cores = psutil.cpu_count(logical=False) or 1
+        thread_list = [1]
+        while thread_list[-1] * 2 < cores:
+            thread_list.append(thread_list[-1] * 2)
+        thread_list = sorted(set(thread_list + [cores]))
+    exes = []
+    exedir = './exe'
+    if os.path.isdir(exedir):
+        for exe in sorted(os.listdir(exedir)):
+            exe = os.path.join(exedir, exe)
+            if os.path.isfile(exe):
+                mode = os.stat(exe).st_mode
+                executable = stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH
+                if mode & executable:
+                    exes.append(os.path.abspath(exe))
+    files = _input_files(indir)
+    results_file = ntpath.basename(os.path.normpath(indir)) + '_parallel_decompress.db'
+    tmpdir = './temp_parallel'
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.mkdir(tmpdir)
+    print('exe\tformat\tdecoder\tthreads\tmb/s\t%\toverhead %\tgzip -d')
+    gzip_size = 0
+    for fmt in make_formats(exes, args.level):
+        nsize = test_format(fmt, files, tmpdir, thread_list, args.level, gzip_size,
+                            args.repeats, args.adaptive, args.budget, results_file)
+        if fmt['format'] == 'gzip':
+            gzip_size = nsize
+    shutil.rmtree(tmpdir)
+    plot(results_file)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 n_random_access.py          : random reads from compressed copies of folder 'corpus'
+# python3 n_random_access.py indir    : as above for folder 'indir'
+# python3 n_random_access.py indir --spans 256K,1M,4M --slices 4K,1M,16M --levels 1,6,9 --reads 200
+
+import os
+import sys
+import stat
+import time
+import random
+import ntpath
+import shutil
+import argparse
+import stats
+import cache
+import runner
+import results
+import zran
+import zlibctypes
+import i_make_corpus
+
+bytes_per_mb = 1000000
+
+
+def _input_files(indir):
+    files = []
+    for f in sorted(os.listdir(indir)):
+        fnm = os.path.join(indir, f)
+        if not os.path.isfile(fnm) or f.startswith('.'):
+            continue
+        if f.endswith(('.gz', '.zst', '.bz2')):
+            continue
+        files.append(fnm)
+    return files
+
+
+def _compress(exe, lvl, fnm, outnm):
+    """compress 'fnm' to 'outnm' with 'exe -c -lvl', reusing cached outputs"""
+
+    opts = ' -c -'
+    if cache.fetch(exe, opts, lvl, fnm, outnm):
+        return
+    with open(outnm, 'wb') as fh:
+        usage = runner.run(runner.command(exe, opts, lvl, fnm), stdout=fh)
+    if usage['returncode'] != 0:
+        sys.exit('Unable to compress ' + fnm)
+    cache.store(exe, opts, lvl, fnm, outnm)
+
+
+def test_exe(
+    exe,
+    lib,
+    files,
+    tmpdir,
+    levels,
+    spans,
+    slices,
+    reads=100,
+    seed=0,
+    results_file='random_access.db',
+    ):
+    """
+    build access point indexes over the output of 'exe' and time random reads against full decompression
+
+    Parameters
+    ----------
+    exe : str
+        name of compression executable
+    lib : ctypes.CDLL
+        zlib library used to read, see zlibctypes.load
+    files : list of str
+        uncompressed files
+    tmpdir : str
+        folder where compressed files are written
+    levels : list of int
+        compression levels
+    spans : list of int
+        uncompressed bytes between access points
+    slices : list of int
+        bytes read at each random offset
+    reads : int
+        random reads of each slice size (default 100)
+    seed : int
+        random seed, the same for every exe so all read the same slices (default 0)
+    results_file : str
+        SQLite file where results are appended
+    """
+
+    if not os.path.exists(exe) and not shutil.which(exe):
+        print('Skipping test: Unable to find "' + exe + '"')
+        return ()
+    meth = ntpath.basename(exe)
+    exe_hash = results.exe_hash(exe)
+    originals = []
+    for fnm in files:
+        with open(fnm, 'rb') as fh:
+            originals.append(fh.read())
+    for lvl in levels:
+        datas = []
+        sequential = []
+        for fnm, orig in zip(files, originals):
+            outnm = os.path.join(tmpdir, '{}_{}_{}.gz'.format(meth, lvl, ntpath.basename(fnm)))
+            _compress(exe, lvl, fnm, outnm)
+            with open(outnm, 'rb') as fh:
+                datas.append(fh.read())
+            t0 = time.perf_counter()
+            zlibctypes.decompress(lib, datas[-1], len(orig), 31)
+            sequential.append(time.perf_counter() - t0)
+        size = sum(len(orig) for orig in originals)
+        nsize = sum(len(data) for data in datas)
+        for span in spans:
+            t0 = time.perf_counter()
+            indexes = [zran.build_index(lib, data, span) for data in datas]
+            build = time.perf_counter() - t0
+            points = sum(len(index['points']) for index in indexes)
+            ibytes = sum(zran.index_bytes(index) for index in indexes)
+            rows = []
+            for length in slices:
+                # files are chosen in proportion to their size, as a reader of the whole corpus would
+                eligible = [i for i, orig in enumerate(originals) if len(orig) >= length]
+                if len(eligible) < 1:
+                    continue
+                rng = random.Random(seed)
+                latencies = []
+                ratios = []
+                for i in rng.choices(eligible, [len(originals[i]) for i in eligible], k=reads):
+                    offset = rng.randrange(0, len(originals[i]) - length + 1)
+                    t0 = time.perf_counter()
+                    out = zran.extract(lib, datas[i], indexes[i], offset, length)
+                    seconds = time.perf_counter() - t0
+                    if out != originals[i][offset:offset + length]:
+                        sys.exit('{} level {}: slice at {} of {} differs'.format(
+                            meth, lvl, offset, files[i]))
+                    latencies.append(seconds)
+                    ratios.append(sequential[i] / seconds)
+                row = {'exe': meth, 'exe_hash': exe_hash, 'level': lvl,
+                       'span kb': span / 1000, 'slice kb': length / 1000,
+                       'size %': nsize / size * 100, 'build s': build,
+                       'build mb/s': size / bytes_per_mb / build,
+                       'index points': points, 'index mb': ibytes / bytes_per_mb,
+                       'index %': ibytes / nsize * 100,
+                       'sequential ms': sum(sequential) / len(sequential) * 1000,
+                       'reads': len(latencies),
+                       'speedup': stats.percentile(ratios, 50)}
+                for q in [50, 90, 99]:
+                    row['p{} ms'.format(q)] = stats.percentile(latencies, q) * 1000
+                rows.append(row)
+                print('{}\t{}\t{:.0f}\t{:.0f}\t{:.3f}\t{:.1f}\t{:.2f}\t{:.2f}\t{:.1f}'.format(
+                      meth, lvl, span / 1000, length / 1000, build,
+                      row['index mb'], row['p50 ms'], row['p99 ms'], row['speedup']))
+            results.append(results_file, 'cells', rows)
+
+
+def plot(results_file):
+    """line-plot of median read latency against slice size for each exe and span
+
+    Parameters
+    ----------
+    results_file : str
+        name of SQLite results file to plot
+    """
+
+    if not os.path.exists(results_file):
+        print('No file named "' + results_file + '"')
+        return ()
+    if os.name == 'posix' and 'DISPLAY' not in os.environ:
+        print('Plot the results on a machine with a graphical display')
+        return ()
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    df = results.load(results_file, 'cells',
+                      ['exe', 'level', 'span kb', 'slice kb', 'p50 ms'],
+                      'run_id = ?', (results.latest_run(results_file),))
+    sns.set()
+    grid = sns.relplot(x='slice kb', y='p50 ms', hue='exe', style='level',
+                       col='span kb', data=df, kind='line', marker='o')
+    grid.set(xscale='log', yscale='log')
+    plt.savefig(results_file.replace('.db', '.png'))
+
+
+if __name__ == '__main__':
+    """Random access into gzip files with zran-style indexes
+
+    Parameters
+    ----------
+    indir : str
+        folder with files to compress (default './corpus')
+    --spans : str
+     comma separated uncompressed bytes between access points (default 256K,1M,4M)
+    --slices : str
+     comma separated bytes per random read (default 4K,64K,1M,16M)
+    --levels : str
+     comma separated compression levels (default 1,6,9)
+    --reads : int
+     random reads of each slice size (default 100)
+    --seed : int
+     random seed for the read offsets (default 0)
+    --lib : str
+     zlib library used to read (default '', the system zlib)
+    """
+
+    parser = argparse.ArgumentParser(description='Random access into gzip files')
+    parser.add_argument('indir', nargs='?', default='./corpus', help='folder with files to compress')
+    parser.add_argument('--spans', default='256K,1M,4M', help='comma separated bytes between access points')
+    parser.add_argument('--slices', default='4K,64K,1M,16M', help='comma separated bytes per random read')
+    parser.add_argument('--levels', default='1,6,9', help='comma separated compression levels')
+    parser.add_argument('--reads', type=int, default=100, help='random reads of each slice size')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the read offsets')
+    parser.add_argument('--lib', default='', help='zlib library used to read, e.g. ./lib/libz-ng.so')
+    args = parser.parse_args()
+    indir = args.indir
+    if not os.path.isdir(indir):
+        sys.exit('Run a_compile.py first: Unable to find ' + indir)
+    lib = zlibctypes.load(args.lib)
+    spans = [i_make_corpus.parse_size(x) for x in args.spans.split(',')]
+    slices = [i_make_corpus.parse_size(x) for x in args.slices.split(',')]
+    levels = [int(x) for x in args.levels.split(',')]
+    files = _input_files(indir)
+    results_file = ntpath.basename(os.path.normpath(indir)) + '_random_access.db'
+    tmpdir = './temp_random'
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.mkdir(tmpdir)
+    print('exe\tlevel\tspan kb\tslice kb\tbuild s\tindex mb\tp50 ms\tp99 ms\tspeedup')
+    exes = ['gzip']
+    exedir = './exe'
+    if os.path.isdir(exedir):
+        for exe in sorted(os.listdir(exedir)):
+            exe = os.path.join(exedir, exe)
+            if os.path.isfile(exe):
+                mode = os.stat(exe).st_mode
+                executable = stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH
+                if mode & executable:
+                    exes.append(os.path.abspath(exe))
+    for exe in exes:
+        test_exe(exe, lib, files, tmpdir, levels, spans, slices, args.reads,
+                 args.seed, results_file)
+    shutil.rmtree(tmpdir)
+    plot(results_file)
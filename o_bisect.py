@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# python3 o_bisect.py ~/src/zlib-ng 2.1.6 develop                : find the commit that slowed pigz at level 6
+# python3 o_bisect.py ~/src/zlib-ng good bad --corpus ./silesia --files dickens,mr --threshold 0.05 --adaptive 0.02
+
+import os
+import sys
+import json
+import ntpath
+import platform
+import argparse
+import subprocess
+import stats
+import runner
+import results
+import a_compile
+from distutils.dir_util import copy_tree
+
+bytes_per_mb = 1000000
+
+# pigz is built against the bisected zlib-ng checkout in 'zlib-bisect'
+method = {'name': 'bisect',
+          'cmake_args': '-DZLIB_COMPAT=ON'}
+
+
+def _git(repo, *args):
+    """output of 'git args' run in folder 'repo', exits when git fails"""
+
+    proc = subprocess.run(['git'] + list(args), cwd=repo,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        sys.exit('git {}: {}'.format(' '.join(args), proc.stderr.decode(errors='replace').strip()))
+    return proc.stdout.decode().strip()
+
+
+def commit_range(repo, good, bad):
+    """
+    commits to bisect in the local clone 'repo', oldest first
+
+    Only first parents are followed, so every commit is one that was on the
+    branch of 'bad'. The list starts with 'good' and ends with 'bad'
+
+    Returns
+    -------
+    list of (sha, subject)
+    """
+
+    good = _git(repo, 'rev-parse', '--verify', good + '^{commit}')
+    bad = _git(repo, 'rev-parse', '--verify', bad + '^{commit}')
+    if _git(repo, 'merge-base', good, bad) != good:
+        sys.exit('The good commit {} is not an ancestor of the bad commit {}'.format(good[:12], bad[:12]))
+    log = _git(repo, 'log', '--reverse', '--first-parent', '--ancestry-path',
+               '--format=%H %s', '{}..{}'.format(good, bad))
+    commits = [(good, _git(repo, 'log', '-1', '--format=%s', good))]
+    for line in log.split('\n'):
+        if len(line) > 0:
+            sha, _, subject = line.partition(' ')
+            commits.append((sha, subject))
+    return commits
+
+
+def prepare(repo, basedir, mirror=''):
+    """
+    check out the zlib-ng clone and the pigz sources used for the bisect builds
+
+    Parameters
+    ----------
+    repo : str
+        local zlib-ng clone with the commits to test
+    basedir : str
+        folder with the 'pigz' CMake files, where 'zlib-bisect' and 'pigz-bisect' are created
+    mirror : str
+        folder with local clones of the repositories (default '', see a_compile.py)
+    """
+
+    zlibdir = os.path.join(basedir, 'zlib-bisect')
+    a_compile._clone(os.path.abspath(repo), 'zlib-bisect', basedir, False)
+    # commits on branches or tags of 'repo' that the first clone did not have
+    _git(zlibdir, 'fetch', '--quiet', '--tags', os.path.abspath(repo),
+         '+refs/heads/*:refs/remotes/bisect/*')
+    a_compile._clone('https://github.com/madler/pigz', 'pigz-bisect', basedir, False, mirror)
+    copy_tree(os.path.join(basedir, 'pigz'), os.path.join(basedir, 'pigz-bisect'))
+
+
+def build_commit(sha, basedir, cachedir, manifest, jobs=1):
+    """
+    pigz built with zlib-ng at commit 'sha', reusing the cached build when nothing changed
+
+    Parameters
+    ----------
+    sha : str
+        zlib-ng commit
+    basedir : str
+        folder with 'zlib-bisect' and 'pigz-bisect', see prepare
+    cachedir : str
+        folder where builds are kept as 'pigz-ng-<sha>'
+    manifest : dict
+        manifest entries of the cached builds, by commit, updated in place
+    jobs : int
+        number of parallel compile jobs (default 1)
+
+    Returns
+    -------
+    path of the executable, '' if this commit does not build
+    """
+
+    ext = ''
+    if platform.system() == 'Windows':
+        ext = '.exe'
+    exe = os.path.join(cachedir, 'pigz-ng-{}{}'.format(sha[:12], ext))
+    previous = manifest.get(sha, {})
+    cmake_files = a_compile._tree_hash(os.path.join(basedir, 'pigz'))
+    if previous.get('cmake_files') == cmake_files and previous.get('cmake_args') == method['cmake_args']:
+        if os.path.isfile(exe):
+            print('Using cached build of ' + sha[:12])
+            return exe
+        if previous.get('failed', False):
+            return ''
+    _git(os.path.join(basedir, 'zlib-bisect'), 'checkout', '--quiet', '--force', sha)
+    entry = a_compile.build_flavor(method, {'name': ''}, basedir, cachedir, jobs)
+    built = os.path.join(cachedir, 'pigz-{}{}'.format(method['name'], ext))
+    if len(entry) < 1 or not os.path.isfile(built):
+        # remembered, so a commit that does not build is not compiled again
+        manifest[sha] = {'cmake_files': cmake_files, 'cmake_args': method['cmake_args'],
+                         'failed': True}
+        return ''
+    os.replace(built, exe)
+    manifest[sha] = entry
+    return exe
+
+
+def measure_cell(exe, files, level, threads, repeats, rel_width, budget):
+    """
+    compress 'files' to a pipe with 'exe' at 'level', repeating until the timing is stable
+
+    Returns
+    -------
+    summary of the repeat durations (see stats.repeat), bytes in and bytes out
+    """
+
+    sizes = {'in': sum(os.stat(fnm).st_size for fnm in files), 'out': 0}
+
+    def measure():
+        seconds = 0
+        out = 0
+        for fnm in files:
+            args = runner.command(exe, ' -c -', level)
+            if threads > 0:
+                args += ['-p', str(threads)]
+            usage = runner.run_stream(args + [fnm])
+            if usage['returncode'] != 0:
+                sys.exit('Unable to compress {} with {}'.format(fnm, exe))
+            seconds += usage['wall']
+            out += usage['bytes_out']
+        sizes['out'] = out
+        return seconds
+
+    summary = stats.repeat(measure, repeats, rel_width, budget)
+    return summary, sizes['in'], sizes['out']
+
+
+def bisect(repo, good, bad, files, level=6, threads=0, threshold=0.05,
+           repeats=3, rel_width=0.02, budget=60.0, jobs=1, mirror='',
+           results_file='bisect.db'):
+    """
+    find the first zlib-ng commit between 'good' and 'bad' where pigz compression slowed by more than 'threshold'
+
+    Each commit is classified by the median time of one fixed cell: 'files'
+    compressed to a pipe at 'level' with 'threads', repeated with the adaptive
+    engine of stats.repeat. A commit is bad when its speed is more than
+    'threshold' (e.g. 0.05 for 5%) below the speed of 'good'. Commits that do
+    not build are skipped, like 'git bisect skip'
+
+    Parameters
+    ----------
+    repo : str
+        local zlib-ng clone
+    good, bad : str
+        commits, branches or tags of 'repo': fast and slow
+    files : list of str
+        uncompressed files of the benchmark cell
+    level : int
+        compression level (default 6)
+    threads : int
+        pigz -p, 0 for the pigz default (default 0)
+    threshold : float
+        relative slowdown that counts as a regression (default 0.05)
+    repeats : int
+        minimum repeats of the cell (default 3)
+    rel_width : float
+        target relative width of the 95% CI of the median, 0 for a fixed number of repeats (default 0.02)
+    budget : float
+        maximum seconds spent on the repeats of one commit (default 60)
+    jobs : int
+        number of parallel compile jobs (default 1)
+    mirror : str
+        folder with local clones of the repositories (default '')
+    results_file : str
+        SQLite file where the 'commits' and 'culprit' tables are appended
+
+    Returns
+    -------
+    sha of the first bad commit, '' if 'bad' is not slower than 'good' by 'threshold'
+    """
+
+    basedir = os.getcwd()
+    cachedir = os.path.join(basedir, 'bisect')
+    if not os.path.isdir(cachedir):
+        os.mkdir(cachedir)
+    manifest_file = os.path.join(cachedir, 'build_manifest.json')
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as fh:
+            manifest = json.load(fh)
+    commits = commit_range(repo, good, bad)
+    print('{} commits from good {} to bad {}'.format(len(commits), commits[0][0][:12], commits[-1][0][:12]))
+    prepare(repo, basedir, mirror)
+    speeds = {}
+    skipped = []
+
+    def speed_of(i):
+        sha, subject = commits[i]
+        if sha in speeds:
+            return speeds[sha]
+        exe = build_commit(sha, basedir, cachedir, manifest, jobs)
+        with open(manifest_file, 'w') as fh:
+            json.dump(manifest, fh, indent=1)
+        if len(exe) < 1:
+            print('Skipping {}: unable to build'.format(sha[:12]))
+            return None
+        summary, size, nsize = measure_cell(exe, files, level, threads, repeats, rel_width, budget)
+        # the median is the estimate the adaptive repeats narrow down
+        speed = size / bytes_per_mb / summary['median']
+        speeds[sha] = speed
+        slowdown = float('nan')
+        verdict = ''
+        if commits[0][0] in speeds:
+            slowdown = 1 - speed / speeds[commits[0][0]]
+            verdict = 'good'
+            if slowdown > threshold:
+                verdict = 'bad'
+        print('{}\t{}\t{:.1f}\t{:.1f}\t{:.1f}\t{}\t{}\t{}'.format(
+              sha[:12], level, speed, nsize / size * 100, slowdown * 100,
+              summary['n'], verdict, subject))
+        row = {'commit': sha, 'subject': subject, 'exe_hash': results.exe_hash(exe),
+               'level': level, 'threads': threads, 'files': len(files),
+               'speed mb/s': speed, 'size %': nsize / size * 100,
+               'slowdown %': slowdown * 100, 'verdict': verdict}
+        row.update(stats.cell_fields(summary))
+        results.append(results_file, 'commits', [row])
+        return speed
+
+    print('commit\tlevel\tmb/s\t%\tslowdown %\tn\tverdict\tsubject')
+    good_speed = speed_of(0)
+    bad_speed = speed_of(len(commits) - 1)
+    if good_speed is None or bad_speed is None:
+        sys.exit('Unable to build the good and bad commits')
+    if 1 - bad_speed / good_speed <= threshold:
+        print('No regression: {} is {:.1f}% slower than {}, the threshold is {:.1f}%'.format(
+              commits[-1][0][:12], (1 - bad_speed / good_speed) * 100,
+              commits[0][0][:12], threshold * 100))
+        return ''
+    lo = 0
+    hi = len(commits) - 1
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        speed = speed_of(mid)
+        if speed is None:
+            skipped.append(commits.pop(mid))
+            hi -= 1
+            continue
+        if 1 - speed / good_speed > threshold:
+            hi = mid
+        else:
+            lo = mid
+    sha, subject = commits[hi]
+    print('First bad commit: {} {}'.format(sha, subject))
+    print('{:.1f} mb/s, {:.1f}% slower than {:.1f} mb/s of {}'.format(
+          speeds[sha], (1 - speeds[sha] / good_speed) * 100, good_speed, commits[0][0][:12]))
+    candidates = _git(repo, 'rev-list', '--first-parent', '{}..{}'.format(commits[lo][0], sha))
+    untested = [c for c in candidates.split('\n') if c != sha and len(c) > 0]
+    if len(untested) > 0:
+        print('The regression may also come from {} commits that did not build: {}'.format(
+              len(untested), ' '.join(c[:12] for c in untested)))
+    results.append(results_file, 'culprit',
+                   [{'commit': sha, 'subject': subject, 'last good': commits[lo][0],
+                     'good': commits[0][0], 'bad': commits[-1][0],
+                     'level': level, 'threads': threads, 'threshold %': threshold * 100,
+                     'good mb/s': good_speed, 'culprit mb/s': speeds[sha],
+                     'tested': len(speeds), 'unbuildable': len(skipped),
+                     'untested': ' '.join(untested)}])
+    return sha
+
+
+def _input_files(indir, names):
+    """files of folder 'indir', only those listed in 'names' unless it is empty"""
+
+    files = []
+    for f in sorted(os.listdir(indir)):
+        fnm = os.path.join(indir, f)
+        if not os.path.isfile(fnm) or f.startswith('.'):
+            continue
+        if f.endswith(('.gz', '.zst', '.bz2')):
+            continue
+        if len(names) > 0 and f not in names:
+            continue
+        files.append(fnm)
+    missing = set(names) - set(ntpath.basename(fnm) for fnm in files)
+    if len(missing) > 0:
+        sys.exit('Unable to find {} in {}'.format(', '.join(sorted(missing)), indir))
+    return files
+
+
+if __name__ == '__main__':
+    """Bisect zlib-ng commits for a pigz compression speed regression
+
+    Parameters
+    ----------
+    repo : str
+        local clone of zlib-ng
+    good : str
+        commit, branch or tag without the regression
+    bad : str
+        commit, branch or tag with the regression
+    --corpus : str
+     folder with files to compress (default './corpus')
+    --files : str
+     comma separated names of files in the corpus for the benchmark cell (default all)
+    --level : int
+     compression level (default 6)
+    --threads : int
+     pigz -p, 0 for the pigz default (default 0)
+    --threshold : float
+     relative slowdown that counts as a regression (default 0.05)
+    --repeats : int
+     minimum repeats of the cell (default 3)
+    --adaptive : float
+     repeat until the 95% CI of the median is narrower than this fraction (default 0.02, 0 for fixed repeats)
+    --budget : float
+     maximum seconds for the repeats of one commit (default 60)
+    -j : int
+     parallel compile jobs (default number of CPUs)
+    --mirror : str
+     folder with local clones of the pigz repository
+    """
+
+    parser = argparse.ArgumentParser(description='Bisect zlib-ng for a pigz speed regression')
+    parser.add_argument('repo', help='local clone of zlib-ng')
+    parser.add_argument('good', help='commit without the regression')
+    parser.add_argument('bad', help='commit with the regression')
+    parser.add_argument('--corpus', default='./corpus', help='folder with files to compress')
+    parser.add_argument('--files', default='', help='comma separated file names for the benchmark cell (default all)')
+    parser.add_argument('--level', type=int, default=6, help='compression level')
+    parser.add_argument('--threads', type=int, default=0, help='pigz -p, 0 for the default')
+    parser.add_argument('--threshold', type=float, default=0.05, help='relative slowdown that is a regression, e.g. 0.05')
+    parser.add_argument('--repeats', type=int, default=3, help='minimum repeats of the cell')
+    parser.add_argument('--adaptive', type=float, default=0.02, metavar='REL',
+                        help='repeat until the 95%% CI of the median is narrower than REL, 0 for fixed repeats')
+    parser.add_argument('--budget', type=float, default=60.0, help='maximum seconds for the repeats of one commit')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='parallel compile jobs (default: number of CPUs)')
+    parser.add_argument('--mirror', default='', help='folder with local clones of the pigz repository')
+    args = parser.parse_args()
+    if not os.path.isdir(args.repo):
+        sys.exit('Unable to find zlib-ng clone ' + args.repo)
+    if not os.path.isdir(args.corpus):
+        sys.exit('Run a_compile.py first: Unable to find ' + args.corpus)
+    if not os.path.isdir('./pigz'):
+        sys.exit('Run from the folder of a_compile.py: Unable to find ./pigz')
+    names = [f for f in args.files.split(',') if len(f) > 0]
+    files = _input_files(args.corpus, names)
+    jobs = args.jobs
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    results_file = ntpath.basename(os.path.normpath(args.corpus)) + '_bisect.db'
+    bisect(args.repo, args.good, args.bad, files, args.level, args.threads,
+           args.threshold, args.repeats, args.adaptive, args.budget, jobs,
+           args.mirror, results_file)
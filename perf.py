@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Optional hardware performance counters for every compressor invocation.
+#
+# When 'enabled' is set, runner.run() wraps each command in 'perf stat' and
+# adds cycles, instructions, IPC, branch and cache misses and context switches
+# to its usage dict. If perf is missing or the kernel refuses access (see
+# /proc/sys/kernel/perf_event_paranoid) a message is printed once and the
+# commands run unwrapped. The counters include the small overhead of perf itself.
+
+import os
+import shutil
+import tempfile
+import subprocess
+
+enabled = False
+
+# results column: perf event
+events = {'cycles': 'cycles',
+          'instructions': 'instructions',
+          'branch misses': 'branch-misses',
+          'l1d misses': 'L1-dcache-load-misses',
+          'llc misses': 'LLC-load-misses',
+          'context switches': 'context-switches'}
+
+_status = {}
+
+
+def available():
+    """True if 'perf stat' can count events for this user, the answer is cached"""
+
+    if 'ok' in _status:
+        return _status['ok']
+    exe = shutil.which('perf')
+    reason = ''
+    if exe is None:
+        reason = 'Unable to find "perf"'
+    else:
+        fd, outnm = tempfile.mkstemp(prefix='perf-', suffix='.csv')
+        os.close(fd)
+        try:
+            proc = subprocess.run([exe, 'stat', '-x', ',', '-e', 'instructions',
+                                   '-o', outnm, '--', 'true'],
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.PIPE)
+            counts = parse(outnm)
+        finally:
+            os.remove(outnm)
+        if proc.returncode != 0:
+            reason = proc.stderr.decode(errors='replace').strip().split('\n')[0]
+        elif not counts.get('instructions', 0) > 0:
+            reason = 'instructions are not counted (virtual machine or perf_event_paranoid?)'
+    if len(reason) > 0:
+        print('Skipping perf counters: ' + reason)
+    _status['exe'] = exe
+    _status['ok'] = len(reason) < 1
+    return _status['ok']
+
+
+def wrap(args, outnm):
+    """
+    prefix command 'args' with 'perf stat', writing the counts as CSV to 'outnm'
+
+    Parameters
+    ----------
+    args : list of str
+        executable followed by its arguments
+    outnm : str
+        file for the perf output, read with parse()
+    """
+
+    return [_status['exe'], 'stat', '-x', ',', '-e', ','.join(events.values()),
+            '-o', outnm, '--'] + args
+
+
+def parse(outnm):
+    """
+    read the CSV written by 'perf stat -x,'
+
+    Parameters
+    ----------
+    outnm : str
+        file written by perf stat -o
+
+    Returns
+    -------
+    dict with a count for each column of 'events' (nan if not counted) and 'ipc'
+    """
+
+    names = {event: col for col, event in events.items()}
+    counts = {col: float('nan') for col in events}
+    with open(outnm) as fh:
+        for line in fh:
+            fields = line.strip().split(',')
+            if len(fields) < 3 or line.startswith('#'):
+                continue
+            # event names may carry modifiers, e.g. 'cycles:u'
+            event = fields[2].split(':')[0]
+            if event not in names:
+                continue
+            try:
+                counts[names[event]] = float(fields[0])
+            except ValueError:
+                # '<not counted>' or '<not supported>'
+                pass
+    counts['ipc'] = float('nan')
+    if counts['cycles'] > 0:
+        counts['ipc'] = counts['instructions'] / counts['cycles']
+    return counts
+
+
+def totals(rows):
+    """
+    sum the counters of several runs, e.g. every file of one repeat, and recompute IPC
+
+    Parameters
+    ----------
+    rows : list of dict
+        usage dicts from runner.run() with perf counters
+
+    Returns
+    -------
+    dict of summed counters and 'ipc', empty if the rows have no counters
+    """
+
+    if len(rows) < 1 or 'cycles' not in rows[0]:
+        return {}
+    out = {col: sum(r[col] for r in rows) for col in events}
+    out['ipc'] = float('nan')
+    if out['cycles'] > 0:
+        out['ipc'] = out['instructions'] / out['cycles']
+    return out
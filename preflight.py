@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# Benchmark environment checks and interference detection.
+#
+# check() reads the CPU frequency governor, turbo state, load average,
+# temperature and dirty page cache before a run and prints what is likely to
+# make timings noisy. begin() and end() bracket one benchmark cell: a thread
+# samples frequency, temperature and load while it runs, and end() adds the
+# CPU time used by other processes (including steal time of a virtual
+# machine) and any thermal throttling. A cell is flagged when these exceed
+# the limits below, so the caller can run it again. Values that the host
+# does not expose (e.g. cpufreq inside most virtual machines) are left out.
+# The frequency drop is measured against the frequency under load, not the
+# idle snapshot of begin(): with turbo boost, one busy core runs faster than
+# many, so an idle baseline would flag every cell with many threads. The
+# baseline is the mean frequency sampled during the warm-up runs when the
+# caller passes it to begin(), otherwise the first sample taken while the
+# cell runs. Only samples taken while the cell runs are compared with it.
+
+import os
+import glob
+import time
+import threading
+import psutil
+
+enabled = False
+
+# check() warns when the 1 minute load average is above this before the first run
+max_load = 0.5
+# a cell is flagged when other processes used more than this many cores on average
+max_foreign_cores = 0.25
+# ... or the hottest thermal zone went above this many degrees Celsius
+max_temp = 90.0
+# ... or the mean frequency fell by more than this fraction of the baseline under load
+max_freq_drop = 0.1
+# seconds between samples while a cell runs
+interval = 0.5
+
+cpu_root = '/sys/devices/system/cpu'
+
+
+def _read(fnm):
+    try:
+        with open(fnm) as fh:
+            return fh.read().strip()
+    except OSError:
+        return None
+
+
+def governor():
+    """scaling governors of all CPUs, e.g. 'performance' or 'powersave,performance', '' if unknown"""
+
+    found = []
+    for fnm in sorted(glob.glob(os.path.join(cpu_root, 'cpu[0-9]*', 'cpufreq', 'scaling_governor'))):
+        value = _read(fnm)
+        if value is not None and value not in found:
+            found.append(value)
+    return ','.join(found)
+
+
+def turbo():
+    """1 if turbo/boost is enabled, 0 if disabled, -1 if unknown"""
+
+    value = _read(os.path.join(cpu_root, 'intel_pstate', 'no_turbo'))
+    if value is not None:
+        return 1 - int(value)
+    value = _read(os.path.join(cpu_root, 'cpufreq', 'boost'))
+    if value is not None:
+        return int(value)
+    return -1
+
+
+def frequency():
+    """mean current frequency of all CPUs in MHz, nan if unknown"""
+
+    khz = []
+    for fnm in glob.glob(os.path.join(cpu_root, 'cpu[0-9]*', 'cpufreq', 'scaling_cur_freq')):
+        value = _read(fnm)
+        if value is not None:
+            khz.append(int(value))
+    if len(khz) > 0:
+        return sum(khz) / len(khz) / 1000
+    try:
+        freq = psutil.cpu_freq()
+    except (OSError, NotImplementedError):
+        freq = None
+    if freq is None or freq.current <= 0:
+        return float('nan')
+    return freq.current
+
+
+def temperature():
+    """temperature of the hottest thermal zone in degrees Celsius, nan if unknown"""
+
+    temps = []
+    for fnm in glob.glob('/sys/class/thermal/thermal_zone*/temp'):
+        value = _read(fnm)
+        if value is not None and value.lstrip('-').isdigit():
+            temps.append(int(value) / 1000)
+    if len(temps) < 1:
+        return float('nan')
+    return max(temps)
+
+
+def throttles():
+    """thermal throttling events counted by the kernel since boot, summed over CPUs"""
+
+    total = 0
+    for pattern in ['core_throttle_count', 'package_throttle_count']:
+        for fnm in glob.glob(os.path.join(cpu_root, 'cpu[0-9]*', 'thermal_throttle', pattern)):
+            value = _read(fnm)
+            if value is not None:
+                total += int(value)
+    return total
+
+
+def dirty_mb():
+    """page cache waiting to be written back, in MB: writeback competes with the timed runs"""
+
+    text = _read('/proc/meminfo')
+    if text is None:
+        return float('nan')
+    for line in text.split('\n'):
+        if line.startswith('Dirty:'):
+            return int(line.split()[1]) * 1024 / 1000000
+    return float('nan')
+
+
+def snapshot():
+    """governor, turbo, frequency (MHz), 1 minute load, temperature, throttle count and dirty MB now"""
+
+    return {'governor': governor(), 'turbo': turbo(), 'mhz': frequency(),
+            'load': os.getloadavg()[0], 'temp c': temperature(),
+            'throttles': throttles(), 'dirty mb': dirty_mb()}
+
+
+def check():
+    """
+    print the environment and anything likely to make timings noisy
+
+    Returns
+    -------
+    list of warnings, empty when nothing was found
+    """
+
+    snap = snapshot()
+    cores = psutil.cpu_count(logical=True)
+    print('governor {}, turbo {}, {:.0f} MHz, load {:.2f} on {} CPUs, {:.0f} C, {:.0f} MB dirty'.format(
+          snap['governor'] or 'unknown', {1: 'on', 0: 'off'}.get(snap['turbo'], 'unknown'),
+          snap['mhz'], snap['load'], cores, snap['temp c'], snap['dirty mb']))
+    warnings = []
+    governors = [g for g in snap['governor'].split(',') if len(g) > 0]
+    if len(governors) > 0 and governors != ['performance']:
+        warnings.append('frequency governor is {}, not performance '
+                        '(sudo cpupower frequency-set -g performance)'.format(snap['governor']))
+    if snap['turbo'] == 1:
+        warnings.append('turbo boost is on, its frequency depends on temperature and active cores')
+    if snap['load'] > max_load:
+        # the first cpu_percent() of each process starts its measurement
+        procs = list(psutil.process_iter(['pid', 'name', 'cpu_percent']))
+        time.sleep(interval)
+        top = []
+        for proc in procs:
+            try:
+                top.append((proc.cpu_percent(), proc.info['name'], proc.info['pid']))
+            except psutil.Error:
+                continue
+        top = [t for t in sorted(top, reverse=True)[:3] if t[0] > 5]
+        warnings.append('load average is {:.2f}{}'.format(snap['load'], ''.join(
+                        ', {} ({}) {:.0f}%'.format(name, pid, pct) for pct, name, pid in top)))
+    if snap['temp c'] > max_temp:
+        warnings.append('CPU is at {:.0f} C before the first run'.format(snap['temp c']))
+    if snap['dirty mb'] > 100:
+        os.sync()
+        warnings.append('{:.0f} MB of dirty page cache was written back before starting'.format(snap['dirty mb']))
+    for warning in warnings:
+        print('Warning: ' + warning)
+    return warnings
+
+
+def _cpu_busy():
+    """seconds all CPUs spent busy since boot (everything except idle and iowait)"""
+
+    t = psutil.cpu_times()
+    # guest time is already part of user time
+    return (sum(t) - t.idle - getattr(t, 'iowait', 0) - getattr(t, 'guest', 0)
+            - getattr(t, 'guest_nice', 0))
+
+
+def _own_cpu():
+    """CPU seconds of this process"""
+
+    t = psutil.Process().cpu_times()
+    return t.user + t.system
+
+
+def begin(baseline_mhz=float('nan')):
+    """
+    start monitoring a cell: take a snapshot and sample frequency, temperature and load until end()
+
+    Parameters
+    ----------
+    baseline_mhz : float
+        frequency under load to compare with, e.g. 'loaded mhz' from end() of
+        the warm-up runs (default nan, the first sample taken during the cell)
+
+    Returns
+    -------
+    monitor state, passed to end()
+    """
+
+    os.sync()
+    state = {'start': snapshot(), 't0': time.perf_counter(), 'busy': _cpu_busy(),
+             'own': _own_cpu(), 'samples': [], 'stop': threading.Event(),
+             'baseline mhz': baseline_mhz}
+
+    def sample():
+        while not state['stop'].wait(interval):
+            state['samples'].append((frequency(), temperature(), os.getloadavg()[0]))
+
+    state['thread'] = threading.Thread(target=sample, daemon=True)
+    state['thread'].start()
+    return state
+
+
+def end(state, child_cpu):
+    """
+    stop monitoring a cell and decide whether it was disturbed
+
+    Parameters
+    ----------
+    state : dict
+        returned by begin()
+    child_cpu : float
+        user + sys seconds of the benchmarked processes during the cell
+
+    Returns
+    -------
+    dict of result columns: environment at the start, minimum and mean MHz,
+    'loaded mhz' (mean of the samples taken while the cell ran, nan if it
+    was shorter than one interval), the 'baseline mhz' it is compared with,
+    peak temperature and load, throttle events, cores used by other
+    processes and 'interference', the reasons the cell is suspect ('' if none)
+    """
+
+    state['stop'].set()
+    state['thread'].join()
+    wall = time.perf_counter() - state['t0']
+    start = state['start']
+    # samples taken while the cell ran, the last one after it finished
+    loaded = [s[0] for s in state['samples'] if s[0] == s[0]]
+    samples = state['samples'] + [(frequency(), temperature(), os.getloadavg()[0])]
+    # busy CPU time not used by the compressors or by this script
+    foreign = _cpu_busy() - state['busy'] - child_cpu - (_own_cpu() - state['own'])
+    foreign_cores = max(foreign, 0) / max(wall, 1e-9)
+    mhz = [s[0] for s in samples if s[0] == s[0]]
+    temps = [s[1] for s in samples if s[1] == s[1]]
+    fields = {'governor': start['governor'], 'turbo': start['turbo'],
+              'start mhz': start['mhz'], 'min mhz': float('nan'),
+              'mean mhz': float('nan'), 'loaded mhz': float('nan'),
+              'baseline mhz': state['baseline mhz'], 'peak temp c': float('nan'),
+              'peak load': max(s[2] for s in samples),
+              'throttles': throttles() - start['throttles'],
+              'dirty mb': start['dirty mb'], 'foreign cores': foreign_cores}
+    if len(mhz) > 0:
+        fields['min mhz'] = min(mhz)
+        fields['mean mhz'] = sum(mhz) / len(mhz)
+    if len(loaded) > 0:
+        fields['loaded mhz'] = sum(loaded) / len(loaded)
+    if len(temps) > 0:
+        fields['peak temp c'] = max(temps)
+    compared = loaded
+    if not fields['baseline mhz'] > 0 and len(loaded) > 1:
+        fields['baseline mhz'] = loaded[0]
+        compared = loaded[1:]
+    reasons = []
+    if foreign_cores > max_foreign_cores:
+        reasons.append('other processes used {:.2f} cores'.format(foreign_cores))
+    if fields['throttles'] > 0:
+        reasons.append('{} thermal throttling events'.format(fields['throttles']))
+    if fields['peak temp c'] > max_temp:
+        reasons.append('{:.0f} C'.format(fields['peak temp c']))
+    if fields['baseline mhz'] > 0 and len(compared) > 0:
+        mean = sum(compared) / len(compared)
+        if mean < fields['baseline mhz'] * (1 - max_freq_drop):
+            reasons.append('frequency fell from {:.0f} to {:.0f} MHz'.format(fields['baseline mhz'], mean))
+    if governor() != start['governor']:
+        reasons.append('governor changed to ' + governor())
+    fields['interference'] = '; '.join(reasons)
+    return fields
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Registry of command line compressors, loaded from compressors.json.
+#
+# Each tool is described once: its binary, the file extension it writes, its
+# range of levels, argument templates to compress and decompress a file, the
+# option that sets the number of threads and whether -c writes to standard
+# output. The benchmarks build every command with command(), so a new
+# compressor is added to the comparison by adding an entry to the JSON file.
+
+import os
+import json
+import shlex
+import shutil
+import ntpath
+
+registry_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'compressors.json')
+
+_defaults = {'threads': '', 'all_threads': None, 'stdout': True, 'default': False}
+
+
+def load(fnm=''):
+    """
+    read the compressor registry
+
+    Parameters
+    ----------
+    fnm : str
+        JSON file (default '', compressors.json next to this script)
+
+    Returns
+    -------
+    dict of entries keyed by name, each with a 'name' key added
+    """
+
+    if len(fnm) < 1:
+        fnm = registry_file
+    with open(fnm) as fh:
+        raw = json.load(fh)
+    entries = {}
+    for name, entry in raw.items():
+        if name.startswith('_'):
+            continue
+        full = dict(_defaults)
+        full.update(entry)
+        full['name'] = name
+        for key in ['exe', 'ext', 'levels', 'compress', 'decompress']:
+            if key not in full:
+                raise ValueError('{}: compressor "{}" has no "{}"'.format(fnm, name, key))
+        entries[name] = full
+    return entries
+
+
+def get(name, exe=''):
+    """
+    entry for compressor 'name', None if the registry does not know it
+
+    Parameters
+    ----------
+    name : str
+        key in the registry, e.g. 'zstd'
+    exe : str
+        binary to use instead of the one in the registry, e.g. a pigz build
+        in ./exe (default ''). The entry is then named after the binary
+    """
+
+    entry = load().get(name)
+    if entry is None:
+        return None
+    entry = dict(entry)
+    if len(exe) > 0:
+        entry['exe'] = exe
+        entry['name'] = ntpath.basename(exe)
+    return entry
+
+
+def installed(entry):
+    """True if the binary of 'entry' exists, otherwise print why the tool is skipped"""
+
+    if os.path.exists(entry['exe']) or shutil.which(entry['exe']):
+        return True
+    print('Skipping test: Unable to find "' + entry['exe'] + '"')
+    return False
+
+
+def selected(names=None):
+    """
+    installed compressors to test
+
+    Parameters
+    ----------
+    names : list of str
+        registry names (default None, every entry marked 'default')
+    """
+
+    entries = load()
+    if names is None:
+        names = [name for name, entry in entries.items() if entry['default']]
+    chosen = []
+    for name in names:
+        if name not in entries:
+            print('Skipping test: "' + name + '" is not in ' + registry_file)
+            continue
+        if installed(entries[name]):
+            chosen.append(entries[name])
+    return chosen
+
+
+def levels(entry):
+    """compression levels of 'entry', from the first to the last of its 'levels'"""
+
+    return range(entry['levels'][0], entry['levels'][-1] + 1)
+
+
+def exts(entries):
+    """extensions written by 'entries', without duplicates"""
+
+    found = []
+    for entry in entries:
+        if entry['ext'] not in found:
+            found.append(entry['ext'])
+    return found
+
+
+def command(entry, action, fnm, lvl=None, threads=None, stdout=False):
+    """
+    argument list to compress or decompress one file, without a shell
+
+    Parameters
+    ----------
+    entry : dict
+        registry entry
+    action : str
+        'compress' or 'decompress'
+    fnm : str
+        name of file to process
+    lvl : int
+        compression level (default None, first level of the entry)
+    threads : int
+        number of threads (default None, 'all_threads' of the entry if it has one)
+    stdout : bool
+        write to standard output with -c instead of a file (default False)
+    """
+
+    if lvl is None:
+        lvl = entry['levels'][0]
+    if stdout and not entry['stdout']:
+        raise ValueError('{} cannot write to standard output'.format(entry['name']))
+    args = [entry['exe']]
+    if threads is None:
+        threads = entry['all_threads']
+    if threads is not None and len(entry['threads']) > 0:
+        args += shlex.split(entry['threads'].format(n=threads))
+    for token in shlex.split(entry[action]):
+        if token == '{input}':
+            if stdout:
+                args.append('-c')
+            args.append(fnm)
+        else:
+            args.append(token.format(level=lvl))
+    return args
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# Append-only results store shared by the benchmark scripts.
+#
+# Rows are appended to tables of an SQLite database and committed at once,
+# so a crash mid-sweep keeps every cell measured so far. Each row carries the
+# run id, host and a hash of the executable, so results of many runs can share
+# one file and be told apart. Queries load only the columns and rows they need.
+
+import os
+import sys
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import platform
+
+run_id = time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:8]
+host = platform.node()
+
+_connections = {}
+_hashes = {}
+
+
+def file_hash(fnm):
+    """
+    sha256 digest of file 'fnm', memoized while its size and mtime do not change
+
+    Parameters
+    ----------
+    fnm : str
+        name of file to hash
+    """
+
+    st = os.stat(fnm)
+    key = (os.path.realpath(fnm), st.st_size, st.st_mtime_ns)
+    if key not in _hashes:
+        h = hashlib.sha256()
+        with open(fnm, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b''):
+                h.update(chunk)
+        _hashes[key] = h.hexdigest()
+    return _hashes[key]
+
+
+def exe_hash(exe):
+    """
+    sha256 digest of executable 'exe', which may be a path or a name on the PATH
+
+    Parameters
+    ----------
+    exe : str
+        name of compression executable
+    """
+
+    fnm = exe
+    if not os.path.isfile(fnm):
+        fnm = shutil.which(exe)
+    if fnm is None:
+        return ''
+    return file_hash(fnm)
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sql_type(value):
+    if isinstance(value, bool) or isinstance(value, int):
+        return 'INTEGER'
+    if isinstance(value, float):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _connect(db):
+    """open (once) database 'db' and register this run"""
+
+    if db in _connections:
+        return _connections[db]
+    con = sqlite3.connect(db)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, '
+                'host TEXT, script TEXT, argv TEXT, started REAL)')
+    con.execute('INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?)',
+                (run_id, host, os.path.basename(sys.argv[0]),
+                 ' '.join(sys.argv[1:]), time.time()))
+    con.commit()
+    _connections[db] = con
+    return con
+
+
+def _columns(con, table):
+    cur = con.execute('PRAGMA table_info({})'.format(_quote(table)))
+    return [r[1] for r in cur.fetchall()]
+
+
+def append(db, table, rows):
+    """
+    append rows to 'table' of database 'db', creating the table or new columns as needed
+
+    Parameters
+    ----------
+    db : str
+        name of SQLite results file, e.g. 'silesia_speed_threads.db'
+    table : str
+        table name, e.g. 'cells' for one row per level or 'files' for one row per file and repeat
+    rows : list of dict
+        values to store. 'run_id' and 'host' are added when missing
+    """
+
+    if len(rows) < 1:
+        return
+    con = _connect(db)
+    names = ['run_id', 'host']
+    types = {'run_id': 'TEXT', 'host': 'TEXT'}
+    for row in rows:
+        for k, v in row.items():
+            if k not in types:
+                names.append(k)
+                types[k] = _sql_type(v)
+            elif v is not None and types[k] == 'TEXT' and not isinstance(v, str):
+                types[k] = _sql_type(v)
+    existing = _columns(con, table)
+    if len(existing) < 1:
+        cols = ', '.join(_quote(n) + ' ' + types[n] for n in names)
+        con.execute('CREATE TABLE {} ({})'.format(_quote(table), cols))
+        con.execute('CREATE INDEX IF NOT EXISTS {} ON {} (run_id)'.format(
+            _quote(table + '_run'), _quote(table)))
+    else:
+        for n in names:
+            if n not in existing:
+                con.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    _quote(table), _quote(n), types[n]))
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        _quote(table), ', '.join(_quote(n) for n in names),
+        ', '.join('?' * len(names)))
+    values = []
+    for row in rows:
+        full = {'run_id': run_id, 'host': host}
+        full.update(row)
+        values.append([full.get(n) for n in names])
+    con.executemany(sql, values)
+    con.commit()
+
+
+def latest_run(db):
+    """
+    return the id of the most recent run stored in database 'db'
+
+    Parameters
+    ----------
+    db : str
+        name of SQLite results file
+    """
+
+    con = sqlite3.connect(db)
+    try:
+        row = con.execute('SELECT run_id FROM runs ORDER BY started DESC LIMIT 1').fetchone()
+    finally:
+        con.close()
+    if row is None:
+        return None
+    return row[0]
+
+
+def load(db, table, columns=None, where='', params=()):
+    """
+    load selected columns and rows of 'table' as a pandas DataFrame
+
+    Parameters
+    ----------
+    db : str
+        name of SQLite results file
+    table : str
+        table name, e.g. 'cells' or 'files'
+    columns : list of str
+        columns to load (default None, all columns)
+    where : str
+        SQL condition selecting rows, e.g. 'level = ? AND threads > ?'
+    params : tuple
+        values for the '?' placeholders in 'where'
+    """
+
+    import pandas as pd
+    cols = '*'
+    if columns is not None:
+        cols = ', '.join(_quote(c) for c in columns)
+    sql = 'SELECT {} FROM {}'.format(cols, _quote(table))
+    if len(where) > 0:
+        sql += ' WHERE ' + where
+    con = sqlite3.connect(db)
+    try:
+        df = pd.read_sql_query(sql, con, params=params)
+    finally:
+        con.close()
+    return df
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+# Shared process runner: spawns compressors directly (no shell) and reports
+# the resources used by each child process.
+
+import os
+import sys
+import json
+import time
+import zlib
+import shlex
+import socket
+import hashlib
+import threading
+import tempfile
+import subprocess
+import perf
+import sampler
+import topology
+import utilization
+
+# On Linux ru_maxrss also counts the memory of the process that called exec.
+# A child vforked from this interpreter would report everything pandas has
+# allocated, so children are forked from a small helper process instead.
+_HELPER = r'''
+import os, sys, json, time, socket
+sock = socket.socket(fileno=int(sys.argv[1]))
+os.set_inheritable(sock.fileno(), False)
+while True:
+    msg, fds, _, _ = socket.recv_fds(sock, 1 << 16, 2)
+    if not msg:
+        break
+    req = json.loads(msg)
+    t0 = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            for fd, target in zip(fds, req['targets']):
+                os.dup2(fd, target)
+                os.close(fd)
+            if req['cwd']:
+                os.chdir(req['cwd'])
+            if req['cpus']:
+                os.sched_setaffinity(0, req['cpus'])
+            os.execvp(req['args'][0], req['args'])
+        finally:
+            os._exit(127)
+    for fd in fds:
+        os.close(fd)
+    sock.send(json.dumps({'pid': pid}).encode())
+    _, status, ru = os.wait4(pid, 0)
+    wall = time.perf_counter() - t0
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    sock.send(json.dumps({'returncode': returncode, 'wall': wall,
+                          'user': ru.ru_utime, 'sys': ru.ru_stime,
+                          'maxrss': ru.ru_maxrss * 1024}).encode())
+'''
+
+_local = threading.local()
+# (thread, socket, process) of every spawn helper, see close_helpers()
+_helpers = []
+_helpers_lock = threading.Lock()
+
+
+def _maxrss_bytes(ru_maxrss):
+    """convert ru_maxrss to bytes: Linux reports kilobytes, macOS bytes"""
+
+    if sys.platform == 'darwin':
+        return ru_maxrss
+    return ru_maxrss * 1024
+
+
+def _helper():
+    """connection to this thread's spawn helper, started on first use"""
+
+    sock = getattr(_local, 'sock', None)
+    if sock is None:
+        sock, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        _local.proc = subprocess.Popen(
+            [sys.executable, '-S', '-c', _HELPER, str(child.fileno())],
+            pass_fds=[child.fileno()])
+        child.close()
+        _local.sock = sock
+        with _helpers_lock:
+            _helpers.append((threading.current_thread(), sock, _local.proc))
+    return sock
+
+
+def close_helpers():
+    """stop the spawn helpers of threads that have exited, e.g. after a thread pool is shut down"""
+
+    with _helpers_lock:
+        done = [h for h in _helpers if not h[0].is_alive()]
+        _helpers[:] = [h for h in _helpers if h[0].is_alive()]
+    for thread, sock, proc in done:
+        # the helper leaves its loop when the connection closes
+        sock.close()
+        proc.wait()
+
+
+def _fileno(f):
+    if isinstance(f, int):
+        return f
+    return f.fileno()
+
+
+def _run_helper(args, stdin, stdout, cwd, during):
+    """fork and exec 'args' from the spawn helper, return its usage report"""
+
+    sock = _helper()
+    fds = []
+    targets = []
+    for f, target in ((stdin, 0), (stdout, 1)):
+        if f is not None:
+            fds.append(_fileno(f))
+            targets.append(target)
+    req = {'args': args, 'cwd': cwd, 'targets': targets,
+           'cpus': topology.affinity()}
+    socket.send_fds(sock, [json.dumps(req).encode()], fds)
+    pid = json.loads(sock.recv(1 << 16))['pid']
+    if during is not None:
+        during(pid)
+    return json.loads(sock.recv(1 << 16))
+
+
+def command(exe, opts, lvl=None, fnm=None):
+    """
+    build an argument list for 'exe' without going through a shell
+
+    Parameters
+    ----------
+    exe : str
+        name of compression executable
+    opts : str
+        command line options, e.g. ' -q -f -k -'. The level is appended
+        to the final option, so ' -q -f -k -' with level 6 becomes '-6'
+    lvl : int
+        compression level (default None, do not append a level)
+    fnm : str
+        name of file to process (default None)
+    """
+
+    if lvl is not None:
+        opts = opts + str(lvl)
+    args = [exe] + shlex.split(opts)
+    if fnm is not None:
+        args.append(fnm)
+    return args
+
+
+def run(args, stdin=None, stdout=None, cwd=None, during=None):
+    """
+    run a command and report wall, user and sys time plus peak memory
+
+    Parameters
+    ----------
+    args : list of str
+        executable followed by its arguments
+    stdin : file object or int
+        standard input for the child (default None, inherit)
+    stdout : file object or int
+        standard output for the child (default None, inherit)
+    cwd : str
+        working directory for the child (default None, inherit)
+    during : function
+        called with the pid of the child once it started, the child is
+        reaped after it returns (default None)
+
+    Returns
+    -------
+    dict with 'returncode', 'wall', 'user', 'sys' (seconds) and 'maxrss' (bytes).
+    On Linux 'maxrss' never falls below the few megabytes used by the spawn helper.
+    With perf.enabled the counters from perf.parse() are added, with sampler.enabled
+    'timeline' holds (seconds, rss bytes) samples of the child and its descendants.
+    With utilization.enabled the summary from utilization.summarize() is added,
+    plus 'active cores', the mean number of cores busy: (user + sys) / wall
+    With a topology.apply() placement the child is pinned to its CPUs (Linux)
+    """
+
+    exe = args[0]
+    args = topology.wrap(args)
+    use_perf = perf.enabled and perf.available()
+    timeline = None
+    if sampler.enabled:
+        timeline = []
+        during = sampler.track(timeline, during)
+    threads = None
+    if utilization.enabled:
+        threads = {}
+        # perf stat starts the compressor as its child: follow that process
+        during = utilization.track(threads, during,
+                                   exe=os.path.basename(exe) if use_perf else '')
+    if use_perf:
+        fd, perfnm = tempfile.mkstemp(prefix='perf-', suffix='.csv')
+        os.close(fd)
+        try:
+            usage = _run(perf.wrap(args, perfnm), stdin, stdout, cwd, during)
+            usage.update(perf.parse(perfnm))
+        finally:
+            os.remove(perfnm)
+    else:
+        usage = _run(args, stdin, stdout, cwd, during)
+    if timeline is not None:
+        usage['timeline'] = timeline
+    if threads is not None:
+        usage.update(utilization.summarize(threads))
+        usage['active cores'] = (usage['user'] + usage['sys']) / max(usage['wall'], 1e-9)
+    if usage['returncode'] != 0:
+        print('Error {}: {}'.format(usage['returncode'], ' '.join(args)))
+    return usage
+
+
+def _run(args, stdin, stdout, cwd, during):
+    if sys.platform.startswith('linux'):
+        usage = _run_helper(args, stdin, stdout, cwd, during)
+    else:
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(args, stdin=stdin, stdout=stdout, cwd=cwd)
+        if during is not None:
+            during(proc.pid)
+        if hasattr(os, 'wait4'):
+            _, status, ru = os.wait4(proc.pid, 0)
+            wall = time.perf_counter() - t0
+            if os.WIFSIGNALED(status):
+                proc.returncode = -os.WTERMSIG(status)
+            else:
+                proc.returncode = os.WEXITSTATUS(status)
+            user = ru.ru_utime
+            sys_time = ru.ru_stime
+            maxrss = _maxrss_bytes(ru.ru_maxrss)
+        else:
+            # Windows: no wait4, only wall time is available
+            proc.wait()
+            wall = time.perf_counter() - t0
+            user = float('nan')
+            sys_time = float('nan')
+            maxrss = 0
+        usage = {'returncode': proc.returncode, 'wall': wall, 'user': user,
+                 'sys': sys_time, 'maxrss': maxrss}
+    return usage
+
+
+def run_stream(args, stdin=None, cwd=None, strong=False):
+    """
+    run a command writing to standard output, and count and hash its output
+    as it arrives through a pipe, so nothing is written to disk
+
+    Parameters
+    ----------
+    args : list of str
+        executable followed by its arguments, e.g. ['pigz', '-c', '-6', fnm]
+    stdin : file object or int
+        standard input for the child (default None, inherit)
+    cwd : str
+        working directory for the child (default None, inherit)
+    strong : bool
+        also compute a sha256 digest of the output (default False, only crc32)
+
+    Returns
+    -------
+    dict from run() plus 'bytes_out', 'crc32' and, if strong, 'sha256'
+    """
+
+    r, w = os.pipe()
+    unowned = [r, w]
+    out = {'bytes_out': 0, 'crc32': 0}
+    digest = None
+    if strong:
+        digest = hashlib.sha256()
+
+    def drain(pid):
+        # only the child may hold the write end, or the pipe never reaches EOF
+        os.close(w)
+        unowned.remove(w)
+        buf = bytearray(1 << 20)
+        view = memoryview(buf)
+        crc = 0
+        fh = os.fdopen(r, 'rb', buffering=0)
+        unowned.remove(r)
+        with fh:
+            while True:
+                n = fh.readinto(buf)
+                if not n:
+                    break
+                crc = zlib.crc32(view[:n], crc)
+                if digest is not None:
+                    digest.update(view[:n])
+                out['bytes_out'] += n
+        out['crc32'] = crc
+
+    try:
+        usage = run(args, stdin, w, cwd, drain)
+    except BaseException:
+        for fd in unowned:
+            os.close(fd)
+        raise
+    usage.update(out)
+    if digest is not None:
+        usage['sha256'] = digest.hexdigest()
+    return usage
+
+
+def cpu_seconds_per_gb(rows):
+    """
+    CPU (user+sys) seconds needed to process one gigabyte of input
+
+    Parameters
+    ----------
+    rows : list of dict
+        per-file results with 'user', 'sys' and 'bytes_in'
+    """
+
+    size = sum(r['bytes_in'] for r in rows)
+    if size < 1:
+        return float('nan')
+    cpu = sum(r['user'] + r['sys'] for r in rows)
+    bytes_per_gb = 1000000000
+    return cpu / (size / bytes_per_gb)
+
+
+def parallel_efficiency(rows, threads):
+    """
+    fraction of 'threads' cores kept busy: (user+sys) / (wall * threads)
+
+    Parameters
+    ----------
+    rows : list of dict
+        per-file results with 'wall', 'user' and 'sys'
+    threads : int
+        number of threads requested from the compressor
+    """
+
+    wall = sum(r['wall'] for r in rows)
+    if wall <= 0 or threads < 1:
+        return float('nan')
+    cpu = sum(r['user'] + r['sys'] for r in rows)
+    return cpu / (wall * threads)
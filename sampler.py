@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Optional RSS timeline of each child process, sampled with psutil.
+#
+# The peak RSS from wait4 (runner.run 'maxrss') is always recorded. When
+# 'enabled' is set, runner.run() also samples the resident memory of the child
+# and all of its descendants every 'default_interval' seconds, which shows how
+# memory grows while pigz reads ahead and its threads fill their buffers.
+
+import time
+import threading
+import psutil
+
+enabled = False
+default_interval = 0.02
+
+
+def _sample(pid, timeline, interval, stop=None):
+    """append (seconds, rss bytes) of process 'pid' and its children until it exits or 'stop' is set"""
+
+    t0 = time.perf_counter()
+    try:
+        proc = psutil.Process(pid)
+    except psutil.Error:
+        return
+    while stop is None or not stop.is_set():
+        try:
+            if proc.status() == psutil.STATUS_ZOMBIE:
+                break
+            rss = proc.memory_info().rss
+            for child in proc.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.Error:
+                    pass
+        except psutil.Error:
+            break
+        timeline.append((time.perf_counter() - t0, rss))
+        if stop is None:
+            time.sleep(interval)
+        else:
+            stop.wait(interval)
+
+
+def track(timeline, during=None, interval=0):
+    """
+    'during' callback for runner.run() that records the RSS timeline of the child
+
+    Parameters
+    ----------
+    timeline : list
+        receives (seconds since start, rss bytes) tuples
+    during : function
+        existing callback to run as well, e.g. the pipe reader of runner.run_stream
+        (default None). The samples are then taken in a background thread
+    interval : float
+        seconds between samples (default 0, use sampler.default_interval)
+    """
+
+    if interval <= 0:
+        interval = default_interval
+
+    def sample(pid):
+        if during is None:
+            _sample(pid, timeline, interval)
+            return
+        stop = threading.Event()
+        thread = threading.Thread(target=_sample,
+                                  args=(pid, timeline, interval, stop),
+                                  daemon=True)
+        thread.start()
+        try:
+            during(pid)
+        finally:
+            stop.set()
+            thread.join()
+
+    return sample
+
+
+def peak(timeline):
+    """largest sampled RSS in bytes, 0 for an empty timeline"""
+
+    if len(timeline) < 1:
+        return 0
+    return max(rss for t, rss in timeline)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Storage modes for the benchmark scripts, to separate compressor speed
+# from storage speed:
+#   disk : files stay where they are, page cache state is left alone
+#   warm : files are read before each repeat so they come from the page cache
+#   cold : files are evicted from the page cache before each repeat
+#   ram  : corpus and temporary files are staged in a tmpfs such as /dev/shm
+
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import psutil
+
+storage_modes = ['disk', 'warm', 'cold', 'ram']
+
+
+def ram_dir():
+    """return a tmpfs folder for staging files, preferring /dev/shm"""
+
+    mounts = []
+    try:
+        with open('/proc/mounts') as fh:
+            for line in fh:
+                parts = line.split()
+                if len(parts) > 2 and parts[2] == 'tmpfs':
+                    mounts.append(parts[1])
+    except OSError:
+        pass
+    for folder in ['/dev/shm', tempfile.gettempdir()] + mounts:
+        if folder in mounts and os.access(folder, os.W_OK):
+            return folder
+    return ''
+
+
+def _folder_size(indir):
+    size = 0
+    for f in os.listdir(indir):
+        fnm = os.path.join(indir, f)
+        if os.path.isfile(fnm):
+            size += os.stat(fnm).st_size
+    return size
+
+
+def stage(indir, mode='disk', tmpdir='./temp', artifacts=1.0):
+    """
+    prepare the corpus and temporary folder for storage mode 'mode'
+
+    Parameters
+    ----------
+    indir : str
+        folder with the uncompressed corpus
+    mode : str
+        one of storage_modes (default 'disk')
+    tmpdir : str
+        temporary folder used when not staging to RAM (default './temp')
+    artifacts : float
+        expected size of compressed files and other intermediates, as a
+        multiple of the corpus size, for the capacity check (default 1.0)
+
+    Returns
+    -------
+    (indir, tmpdir) to use for the benchmark. In 'ram' mode both are in a
+    tmpfs folder that is removed when Python exits
+    """
+
+    if mode not in storage_modes:
+        sys.exit('Unknown storage mode "{}", use one of {}'.format(mode, storage_modes))
+    if mode != 'ram':
+        return indir, tmpdir
+    root = ram_dir()
+    if len(root) < 1:
+        sys.exit('Unable to find a writable tmpfs folder for RAM storage')
+    needed = _folder_size(indir) * (1.0 + artifacts)
+    free = shutil.disk_usage(root).free
+    available = psutil.virtual_memory().available
+    if needed > min(free, available):
+        sys.exit('RAM storage needs {:.0f} MB, but {} has {:.0f} MB free and {:.0f} MB of memory is available'.format(
+            needed / 1e6, root, free / 1e6, available / 1e6))
+    stagedir = tempfile.mkdtemp(prefix='pigzbench-', dir=root)
+    atexit.register(shutil.rmtree, stagedir, True)
+    ramindir = os.path.join(stagedir, os.path.basename(os.path.normpath(indir)))
+    os.mkdir(ramindir)
+    for f in os.listdir(indir):
+        fnm = os.path.join(indir, f)
+        if os.path.isfile(fnm) and not f.startswith('.'):
+            # copy2 keeps the modification time, which validate.py uses to reuse digests
+            shutil.copy2(fnm, os.path.join(ramindir, f))
+    print('Staged {} to {}'.format(indir, ramindir))
+    return ramindir, os.path.join(stagedir, 'temp')
+
+
+def _evict(fnm):
+    """drop the cached pages of one file (they must be written back first)"""
+
+    fd = os.open(fnm, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def prepare(indir, mode='disk'):
+    """
+    bring the files in folder 'indir' into the page cache state of 'mode',
+    call this before each timed repeat
+
+    Parameters
+    ----------
+    indir : str
+        folder whose files are read by the next repeat
+    mode : str
+        one of storage_modes (default 'disk')
+    """
+
+    if mode not in ['warm', 'cold']:
+        return
+    files = []
+    for f in os.listdir(indir):
+        fnm = os.path.join(indir, f)
+        if os.path.isfile(fnm) and not f.startswith('.'):
+            files.append(fnm)
+    if mode == 'warm':
+        for fnm in files:
+            with open(fnm, 'rb') as fh:
+                while fh.read(1 << 20):
+                    pass
+        return
+    if not hasattr(os, 'posix_fadvise'):
+        print('Cold storage mode requires posix_fadvise, using the page cache as is')
+        return
+    for fnm in files:
+        _evict(fnm)
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+# Summary statistics and adaptive repetition for benchmark cells.
+#
+# A cell (one executable, level and thread count) is repeated until the 95%
+# confidence interval of its median (or trimmed mean) is narrow enough relative
+# to the estimate, or until its time budget is spent. Only the standard library
+# is used, so the scripts keep working without scipy. Thread scaling results
+# are summarized by the serial fractions of Amdahl's and Gustafson's laws.
+
+import math
+import time
+import statistics
+
+_z95 = 1.959964
+# smallest sample whose extremes bound the median with >= 95% confidence
+_min_samples = 6
+
+
+def _t95(df):
+    """two-sided 95% quantile of Student's t (Cornish-Fisher expansion)"""
+
+    z = _z95
+    if df < 1:
+        return float('inf')
+    return (z + (z ** 3 + z) / (4 * df)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2))
+
+
+def median_ci(samples):
+    """
+    distribution-free 95% confidence interval of the median from order statistics
+
+    Parameters
+    ----------
+    samples : list of float
+        measurements, e.g. seconds per repeat
+    """
+
+    x = sorted(samples)
+    n = len(x)
+    if n < _min_samples:
+        # with so few samples the extremes are the tightest honest bounds
+        return x[0], x[-1]
+    half = _z95 * math.sqrt(n) / 2
+    lo = max(int(round(n / 2 - half)), 1)
+    hi = min(int(round(1 + n / 2 + half)), n)
+    return x[lo - 1], x[hi - 1]
+
+
+def trimmed_mean_ci(samples, trim=0.2):
+    """
+    trimmed mean and its 95% confidence interval (Tukey-McLaughlin)
+
+    Parameters
+    ----------
+    samples : list of float
+        measurements, e.g. seconds per repeat
+    trim : float
+        fraction removed from each tail (default 0.2)
+    """
+
+    x = sorted(samples)
+    n = len(x)
+    g = int(math.floor(trim * n))
+    kept = x[g:n - g]
+    tm = statistics.mean(kept)
+    if n - 2 * g < 2:
+        return tm, x[0], x[-1]
+    winsorized = [kept[0]] * g + kept + [kept[-1]] * g
+    sw = statistics.stdev(winsorized)
+    se = sw / ((1 - 2 * g / n) * math.sqrt(n))
+    t = _t95(n - 2 * g - 1)
+    return tm, tm - t * se, tm + t * se
+
+
+def summarize(samples, estimator='median'):
+    """
+    median, min, stddev and 95% confidence interval of 'samples'
+
+    Parameters
+    ----------
+    samples : list of float
+        measurements, e.g. seconds per repeat
+    estimator : str
+        'median' or 'trimmed' (20% trimmed mean) for the CI (default 'median')
+
+    Returns
+    -------
+    dict with 'n', 'median', 'min', 'stddev', 'estimate', 'ci_low', 'ci_high' and 'rel_ci'
+    """
+
+    n = len(samples)
+    med = statistics.median(samples)
+    if estimator == 'trimmed':
+        est, lo, hi = trimmed_mean_ci(samples)
+    else:
+        est = med
+        lo, hi = median_ci(samples)
+    stddev = 0.0
+    if n > 1:
+        stddev = statistics.stdev(samples)
+    rel_ci = float('inf')
+    if est > 0 and n > 1:
+        rel_ci = (hi - lo) / est
+    return {'n': n, 'median': med, 'min': min(samples), 'stddev': stddev,
+            'estimate': est, 'ci_low': lo, 'ci_high': hi, 'rel_ci': rel_ci}
+
+
+def repeat(measure, repeats=3, rel_width=0, budget=60.0, max_repeats=100,
+           estimator='median'):
+    """
+    call 'measure' until its confidence interval is narrow enough
+
+    Parameters
+    ----------
+    measure : function
+        runs one repeat and returns its duration in seconds
+    repeats : int
+        minimum number of repeats. With 'rel_width' 0 exactly this many are run,
+        otherwise at least 6 are needed before the CI is trusted
+    rel_width : float
+        target width of the 95% CI relative to the estimate, e.g. 0.02 for 2%
+        (default 0, fixed number of repeats)
+    budget : float
+        stop once this many seconds were spent on the cell (default 60)
+    max_repeats : int
+        never run more repeats than this (default 100)
+    estimator : str
+        'median' or 'trimmed' (default 'median')
+
+    Returns
+    -------
+    dict from summarize() with 'converged' set when the CI target was reached
+    """
+
+    samples = []
+    t0 = time.perf_counter()
+    while True:
+        samples.append(measure())
+        n = len(samples)
+        if rel_width <= 0:
+            if n >= repeats:
+                break
+            continue
+        if n >= max(repeats, _min_samples):
+            summary = summarize(samples, estimator)
+            if summary['rel_ci'] <= rel_width:
+                summary['converged'] = True
+                return summary
+        if n >= max_repeats or time.perf_counter() - t0 >= budget:
+            break
+    summary = summarize(samples, estimator)
+    summary['converged'] = rel_width <= 0
+    return summary
+
+
+def percentile(samples, q):
+    """
+    q-th percentile of 'samples' with linear interpolation between order statistics
+
+    Parameters
+    ----------
+    samples : list of float
+        measurements, e.g. seconds per file
+    q : float
+        percentile, 0..100
+    """
+
+    x = sorted(samples)
+    if len(x) < 1:
+        return float('nan')
+    pos = (len(x) - 1) * q / 100
+    lo = int(math.floor(pos))
+    hi = min(lo + 1, len(x) - 1)
+    return x[lo] + (x[hi] - x[lo]) * (pos - lo)
+
+
+def cell_fields(summary):
+    """
+    columns for the results table describing the repeats of one cell in milliseconds
+
+    Parameters
+    ----------
+    summary : dict
+        as returned by repeat() or summarize()
+    """
+
+    return {'min ms': summary['min'] * 1000,
+            'median ms': summary['median'] * 1000,
+            'stddev ms': summary['stddev'] * 1000,
+            'ci low ms': summary['ci_low'] * 1000,
+            'ci high ms': summary['ci_high'] * 1000,
+            'repeats': summary['n'],
+            'converged': int(summary.get('converged', False))}
+
+
+def amdahl_fit(threads, speedups):
+    """
+    least squares serial fraction 's' of Amdahl's law, speedup = 1 / (s + (1 - s) / n)
+
+    Parameters
+    ----------
+    threads : list of int
+        thread counts n
+    speedups : list of float
+        measured speedup at each thread count relative to one thread
+
+    Returns
+    -------
+    serial fraction, nan when no thread count above 1 was measured
+    """
+
+    # 1/S - 1/n = s (1 - 1/n) is linear in s
+    num = 0.0
+    den = 0.0
+    for n, speedup in zip(threads, speedups):
+        if n <= 1 or not speedup > 0:
+            continue
+        x = 1 - 1 / n
+        num += (1 / speedup - 1 / n) * x
+        den += x * x
+    if den <= 0:
+        return float('nan')
+    return num / den
+
+
+def gustafson_fit(threads, speedups):
+    """
+    least squares serial fraction 's' of Gustafson's law, speedup = n - s (n - 1)
+
+    Parameters
+    ----------
+    threads : list of int
+        thread counts n
+    speedups : list of float
+        measured speedup at each thread count relative to one thread
+
+    Returns
+    -------
+    serial fraction, nan when no thread count above 1 was measured
+    """
+
+    num = 0.0
+    den = 0.0
+    for n, speedup in zip(threads, speedups):
+        if n <= 1 or not speedup > 0:
+            continue
+        num += (n - speedup) * (n - 1)
+        den += (n - 1) ** 2
+    if den <= 0:
+        return float('nan')
+    return num / den
+
+
+def amdahl_speedup(serial, threads):
+    """speedup predicted by Amdahl's law for serial fraction 'serial' on 'threads' cores"""
+
+    return 1 / (serial + (1 - serial) / threads)
+
+
+def efficient_threads(threads, speedups, min_efficiency=0.75):
+    """
+    largest measured thread count whose parallel efficiency (speedup / n) is at least 'min_efficiency'
+
+    Parameters
+    ----------
+    threads : list of int
+        thread counts n
+    speedups : list of float
+        measured speedup at each thread count relative to one thread
+    min_efficiency : float
+        lowest acceptable speedup / n (default 0.75)
+    """
+
+    best = 1
+    for n, speedup in zip(threads, speedups):
+        if n > best and speedup / n >= min_efficiency:
+            best = n
+    return best
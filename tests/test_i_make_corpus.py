@@ -0,0 +1,22 @@
+import os
+import sys
+import struct
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import i_make_corpus
+
+
+def test_volume_header_10g_int16():
+    size = i_make_corpus.parse_size('10G')
+    shape = i_make_corpus.volume_shape(size, 2)
+    assert max(shape) <= 32767
+    hdr = i_make_corpus.nifti_header(shape, np.int16)
+    assert len(hdr) == 352
+    dim = struct.unpack_from('<8h', hdr, 40)
+    assert dim[0] == 4
+    assert dim[1:5] == shape
+    voxels = shape[0] * shape[1] * shape[2] * shape[3]
+    # rounded down to whole slices of every time point
+    assert size - 352 - voxels * 2 < shape[0] * shape[1] * 2 * shape[3]
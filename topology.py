@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# CPU topology and thread placement for the compressors.
+#
+# read() lists the logical CPUs this process may use with their physical core,
+# package (socket) and NUMA node, from /sys/devices/system/cpu and
+# /sys/devices/system/node. apply() chooses the CPUs for one placement policy
+# and thread count. runner.run() then pins every child to them with
+# sched_setaffinity (in the spawn helper, before exec), and for the 'node' and
+# 'interleave' policies also sets the memory policy with numactl when it is
+# installed. Without numactl only the CPUs are pinned, and a message is
+# printed once. The default policy 'os' leaves scheduling to the kernel.
+
+import os
+import glob
+import shutil
+
+cpu_root = '/sys/devices/system/cpu'
+node_root = '/sys/devices/system/node'
+
+# os: no pinning, compact: fill SMT siblings of one core before the next,
+# spread: one thread per physical core, node: CPUs and memory of the first
+# NUMA node only, interleave: alternate NUMA nodes, memory interleaved
+policies = ['os', 'compact', 'spread', 'node', 'interleave']
+
+current = None
+
+_status = {}
+
+
+def parse_list(text):
+    """CPU numbers of a kernel CPU list such as '0-3,8,10-11'"""
+
+    cpus = []
+    for item in text.strip().split(','):
+        if len(item) < 1:
+            continue
+        if '-' in item:
+            lo, hi = item.split('-')
+            cpus += range(int(lo), int(hi) + 1)
+        else:
+            cpus.append(int(item))
+    return cpus
+
+
+def format_list(cpus):
+    """kernel CPU list for 'cpus', e.g. [0, 1, 2, 3, 8] gives '0-3,8'"""
+
+    items = []
+    cpus = sorted(cpus)
+    i = 0
+    while i < len(cpus):
+        j = i
+        while j + 1 < len(cpus) and cpus[j + 1] == cpus[j] + 1:
+            j += 1
+        if j > i:
+            items.append('{}-{}'.format(cpus[i], cpus[j]))
+        else:
+            items.append(str(cpus[i]))
+        i = j + 1
+    return ','.join(items)
+
+
+def _read_int(fnm, default=0):
+    try:
+        with open(fnm) as fh:
+            return int(fh.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def read():
+    """
+    logical CPUs available to this process
+
+    Returns
+    -------
+    list of dicts with 'cpu', 'core' (physical core id), 'package', 'node',
+    and 'smt' (0 for the first logical CPU of a core, 1 for its sibling, ...).
+    Where /sys is missing every CPU is its own core on node 0
+    """
+
+    if 'cpus' in _status:
+        return _status['cpus']
+    if hasattr(os, 'sched_getaffinity'):
+        allowed = sorted(os.sched_getaffinity(0))
+    else:
+        allowed = list(range(os.cpu_count() or 1))
+    nodes = {}
+    for path in glob.glob(os.path.join(node_root, 'node[0-9]*')):
+        node = int(os.path.basename(path)[4:])
+        try:
+            with open(os.path.join(path, 'cpulist')) as fh:
+                for cpu in parse_list(fh.read()):
+                    nodes[cpu] = node
+        except OSError:
+            continue
+    cpus = []
+    for cpu in allowed:
+        topo = os.path.join(cpu_root, 'cpu{}'.format(cpu), 'topology')
+        cpus.append({'cpu': cpu,
+                     'core': _read_int(os.path.join(topo, 'core_id'), cpu),
+                     'package': _read_int(os.path.join(topo, 'physical_package_id')),
+                     'node': nodes.get(cpu, 0)})
+    seen = {}
+    for c in cpus:
+        key = (c['package'], c['core'])
+        c['smt'] = seen.get(key, 0)
+        seen[key] = c['smt'] + 1
+    _status['cpus'] = cpus
+    return cpus
+
+
+def physical_cores(cpus=None):
+    """number of physical cores among 'cpus' (default None, see read)"""
+
+    if cpus is None:
+        cpus = read()
+    return len(set((c['package'], c['core']) for c in cpus))
+
+
+def nodes(cpus=None):
+    """NUMA nodes of 'cpus' (default None, see read), in order"""
+
+    if cpus is None:
+        cpus = read()
+    return sorted(set(c['node'] for c in cpus))
+
+
+def choose(policy, threads, cpus=None):
+    """
+    CPUs used by 'threads' threads under placement 'policy'
+
+    Parameters
+    ----------
+    policy : str
+        one of 'policies'
+    threads : int
+        number of threads, 0 for every CPU the policy allows
+    cpus : list of dict
+        topology (default None, see read)
+
+    Returns
+    -------
+    sorted list of CPU numbers, None for 'os'. More threads than CPUs share
+    the CPUs the policy allows: 'node' never leaves the first node
+    """
+
+    if policy not in policies:
+        raise ValueError('Unknown placement "{}", choose from {}'.format(policy, ', '.join(policies)))
+    if policy == 'os':
+        return None
+    if cpus is None:
+        cpus = read()
+    if policy == 'compact':
+        order = sorted(cpus, key=lambda c: (c['node'], c['package'], c['core'], c['smt']))
+    elif policy == 'spread':
+        order = sorted(cpus, key=lambda c: (c['smt'], c['node'], c['package'], c['core']))
+    elif policy == 'node':
+        first = nodes(cpus)[0]
+        order = sorted([c for c in cpus if c['node'] == first],
+                       key=lambda c: (c['smt'], c['package'], c['core']))
+    else:
+        # round robin over the nodes, one physical core of each in turn
+        rank = {}
+        ranked = []
+        for c in sorted(cpus, key=lambda c: (c['smt'], c['package'], c['core'])):
+            key = (c['smt'], c['node'])
+            rank[key] = rank.get(key, -1) + 1
+            ranked.append((c['smt'], rank[key], c['node'], c))
+        order = [r[3] for r in sorted(ranked, key=lambda r: r[:3])]
+    if threads > 0:
+        order = order[:threads]
+    return sorted(c['cpu'] for c in order)
+
+
+def apply(policy, threads):
+    """
+    place the following runner.run() children: pin them to the CPUs of 'policy'
+
+    Parameters
+    ----------
+    policy : str
+        one of 'policies', 'os' removes the placement
+    threads : int
+        number of threads the compressor will use, 0 for its default
+
+    Returns
+    -------
+    dict with 'policy', 'cpus' (list, None for 'os') and 'memory', the numactl
+    memory option ('' when the kernel default local allocation is kept)
+    """
+
+    global current
+    cpus = choose(policy, threads)
+    memory = ''
+    if policy == 'node':
+        memory = '--membind={}'.format(nodes()[0])
+    elif policy == 'interleave':
+        memory = '--interleave={}'.format(','.join(str(n) for n in nodes()))
+    placement = {'policy': policy, 'cpus': cpus, 'memory': memory}
+    current = None
+    if policy != 'os':
+        current = placement
+    return placement
+
+
+def affinity():
+    """CPUs the next child is pinned to, None to inherit the affinity of this process"""
+
+    if current is None or not hasattr(os, 'sched_setaffinity'):
+        return None
+    return current['cpus']
+
+
+def label(placement):
+    """CPU list of 'placement' from apply() for the results, '' for 'os'"""
+
+    if placement['cpus'] is None:
+        return ''
+    return format_list(placement['cpus'])
+
+
+def _numactl():
+    """path of numactl, None if missing (reported once)"""
+
+    if 'numactl' not in _status:
+        _status['numactl'] = shutil.which('numactl')
+        if _status['numactl'] is None:
+            print('Skipping NUMA memory policy: Unable to find "numactl", only CPUs are pinned')
+    return _status['numactl']
+
+
+def wrap(args):
+    """
+    prefix command 'args' with numactl to set the memory policy of the current placement
+
+    Parameters
+    ----------
+    args : list of str
+        executable followed by its arguments
+    """
+
+    # with a single node the memory policy changes nothing
+    if current is None or len(current['memory']) < 1 or len(nodes()) < 2:
+        return args
+    exe = _numactl()
+    if exe is None:
+        return args
+    return [exe, current['memory'], '--'] + args
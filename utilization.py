@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# Optional per-thread and per-core CPU timelines of each child process.
+#
+# When 'enabled' is set, runner.run() reads /proc/<pid>/task/*/stat of the
+# child and its descendants every 'default_interval' seconds: the user+sys
+# ticks of every thread and the CPU it last ran on. summarize() turns the
+# samples into utilization per thread and per core between samples, the
+# peak number of cores kept busy, and the share of intervals where the main
+# thread and the writer thread were saturated. The average number of active
+# cores comes from the exact CPU time of the child instead (runner.run), so
+# it is also known for runs shorter than two samples. pigz reads the input in
+# its main thread and writes the output in the first thread it starts, so
+# these two threads show when adding compression threads stops helping.
+# When perf stat wraps the command, only the compressor it starts and that
+# process's descendants are sampled, so perf's own threads do not shift the
+# thread numbers.
+# Linux only: elsewhere no samples are taken and the summary is NaN.
+
+import os
+import time
+import threading
+import psutil
+
+enabled = False
+default_interval = 0.1
+# a thread busy for at least this fraction of an interval is saturated
+saturated = 0.9
+
+_ticks = 100
+if hasattr(os, 'sysconf') and 'SC_CLK_TCK' in os.sysconf_names:
+    _ticks = os.sysconf('SC_CLK_TCK')
+
+
+def _tasks(pids):
+    """{tid: (user + sys ticks, last cpu)} of every thread of processes 'pids'"""
+
+    tasks = {}
+    for pid in pids:
+        taskdir = '/proc/{}/task'.format(pid)
+        try:
+            tids = os.listdir(taskdir)
+        except OSError:
+            continue
+        for tid in tids:
+            try:
+                with open(os.path.join(taskdir, tid, 'stat')) as fh:
+                    stat = fh.read()
+            except OSError:
+                continue
+            # the command name may contain spaces, the fields follow its ')'
+            fields = stat[stat.rfind(')') + 2:].split()
+            tasks[int(tid)] = (int(fields[11]) + int(fields[12]), int(fields[36]))
+    return tasks
+
+
+def _find(proc, exe):
+    """first of 'proc' and its descendants whose executable or argv[0] is named 'exe', None if not started yet"""
+
+    for p in [proc] + proc.children(recursive=True):
+        try:
+            names = [os.path.basename(p.exe())]
+            cmdline = p.cmdline()
+        except psutil.Error:
+            continue
+        if len(cmdline) > 0:
+            names.append(os.path.basename(cmdline[0]))
+        if exe in names:
+            return p
+    return None
+
+
+def _sample(pid, record, interval, stop=None, exe=''):
+    """append (seconds, tasks) of process 'pid' and its children to record['samples'] until it exits or 'stop' is set
+
+    With 'exe' only the descendant running it and its children are sampled,
+    and record['pid'] becomes its pid once it has started"""
+
+    t0 = time.perf_counter()
+    try:
+        proc = psutil.Process(pid)
+    except psutil.Error:
+        return
+    target = None
+    if len(exe) < 1:
+        target = proc
+    while stop is None or not stop.is_set():
+        try:
+            if proc.status() == psutil.STATUS_ZOMBIE:
+                break
+            if target is None:
+                target = _find(proc, exe)
+                if target is not None:
+                    record['pid'] = target.pid
+            if target is not None:
+                pids = [target.pid] + [child.pid for child in target.children(recursive=True)]
+        except psutil.Error:
+            break
+        if target is not None:
+            record['samples'].append((time.perf_counter() - t0, _tasks(pids)))
+        if stop is None:
+            time.sleep(interval)
+        else:
+            stop.wait(interval)
+
+
+def track(record, during=None, interval=0, exe=''):
+    """
+    'during' callback for runner.run() that records the thread timeline of the child
+
+    Parameters
+    ----------
+    record : dict
+        receives 'pid' and 'samples', a list of (seconds since start, {tid: (ticks, cpu)})
+    during : function
+        existing callback to run as well, e.g. sampler.track (default None).
+        The samples are then taken in a background thread
+    interval : float
+        seconds between samples (default 0, use utilization.default_interval)
+    exe : str
+        name of the executable to follow when the child only starts it, as
+        'perf stat' does (default '', sample the child itself). 'pid' is then
+        the pid of this descendant
+    """
+
+    if interval <= 0:
+        interval = default_interval
+    record['samples'] = []
+
+    def sample(pid):
+        record['pid'] = pid
+        if during is None:
+            _sample(pid, record, interval, exe=exe)
+            return
+        stop = threading.Event()
+        thread = threading.Thread(target=_sample,
+                                  args=(pid, record, interval, stop, exe),
+                                  daemon=True)
+        thread.start()
+        try:
+            during(pid)
+        finally:
+            stop.set()
+            thread.join()
+
+    return sample
+
+
+def summarize(record):
+    """
+    utilization timelines and summary of a record filled by track()
+
+    Threads are numbered in order of creation: 0 is the main thread, 1 the
+    first thread it started (the writer of pigz), and so on
+
+    Returns
+    -------
+    dict with 'peak cores' (most cores busy in one interval), 'main saturated %',
+    'writer saturated %' (NaN with fewer than three threads, pigz -p 1 has no
+    writer), 'cores used' (distinct CPUs), 'thread timeline', a list of
+    (seconds, thread, utilization), and 'core timeline', a list of
+    (seconds, cpu, utilization)
+    """
+
+    samples = record.get('samples', [])
+    out = {'peak cores': float('nan'),
+           'main saturated %': float('nan'), 'writer saturated %': float('nan'),
+           'cores used': 0, 'thread timeline': [], 'core timeline': []}
+    if len(samples) < 2:
+        return out
+    tids = sorted(set(tid for t, tasks in samples for tid in tasks))
+    pid = record.get('pid')
+    if pid in tids:
+        tids.remove(pid)
+        tids.insert(0, pid)
+    order = {tid: i for i, tid in enumerate(tids)}
+    busy = []
+    main = []
+    writer = []
+    cores = set()
+    for (t0, prev), (t1, tasks) in zip(samples[:-1], samples[1:]):
+        dt = t1 - t0
+        if dt <= 0:
+            continue
+        total = 0
+        per_core = {}
+        for tid, (ticks, cpu) in tasks.items():
+            util = (ticks - prev.get(tid, (ticks, cpu))[0]) / _ticks / dt
+            total += util
+            per_core[cpu] = per_core.get(cpu, 0) + util
+            out['thread timeline'].append((t1, order[tid], util))
+            if order[tid] == 0:
+                main.append(util >= saturated)
+            elif order[tid] == 1 and len(tids) > 2:
+                writer.append(util >= saturated)
+        for cpu, util in sorted(per_core.items()):
+            out['core timeline'].append((t1, cpu, util))
+            if util > 0:
+                cores.add(cpu)
+        busy.append(total)
+    if len(busy) < 1:
+        return out
+    out['peak cores'] = max(busy)
+    out['cores used'] = len(cores)
+    if len(main) > 0:
+        out['main saturated %'] = sum(main) / len(main) * 100
+    if len(writer) > 0:
+        out['writer saturated %'] = sum(writer) / len(writer) * 100
+    return out
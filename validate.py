@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Lossless round trip checks shared by the decompression benchmarks.
+#
+# Each original file is read once to compute its reference digests (size,
+# CRC32 and sha256), which are kept in the cache folder keyed by the real
+# path, size and modification time of the file. Entries that were not used
+# by this run and whose file is gone or changed, such as earlier copies staged
+# to RAM, are dropped when check_all() saves the digests. Decompressed data is never
+# written to disk: every check streams the output of 'exe -d -c' through a
+# pipe, hashes it as it arrives (runner.run_stream) and compares it with the
+# reference. Checks run in a pool of threads, each with its own spawn helper,
+# which is stopped when the pool exits.
+
+import os
+import json
+import zlib
+import hashlib
+import threading
+import concurrent.futures
+import psutil
+import cache
+import runner
+
+digests_file = os.path.join(cache.cache_dir, 'digests.json')
+
+_digests = {}
+_used = set()
+_status = {'dirty': False}
+_lock = threading.Lock()
+_fields = ['bytes_out', 'crc32', 'sha256']
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return '{}:{}:{}'.format(path, st.st_size, st.st_mtime_ns)
+
+
+def _load():
+    if len(_digests) > 0 or not os.path.isfile(digests_file):
+        return
+    try:
+        with open(digests_file) as fh:
+            _digests.update(json.load(fh))
+    except (OSError, ValueError):
+        pass
+
+
+def _save():
+    for stamp in list(_digests):
+        if stamp in _used:
+            continue
+        path = _digests[stamp].get('path', '')
+        # the file is gone or has changed since its digests were computed
+        if not os.path.exists(path) or _stamp(path) != stamp:
+            del _digests[stamp]
+    os.makedirs(os.path.dirname(digests_file), exist_ok=True)
+    tmpnm = digests_file + '.tmp'
+    with open(tmpnm, 'w') as fh:
+        json.dump(_digests, fh)
+    os.replace(tmpnm, digests_file)
+    _status['dirty'] = False
+
+
+def reference(fnm):
+    """
+    size, CRC32 and sha256 of uncompressed file 'fnm', computed once and cached
+
+    Parameters
+    ----------
+    fnm : str
+        name of an original (uncompressed) file
+
+    Returns
+    -------
+    dict with 'bytes_out', 'crc32' and 'sha256', as reported by runner.run_stream.
+    New digests are written to the cache by check_all()
+    """
+
+    path = os.path.realpath(fnm)
+    stamp = _stamp(path)
+    with _lock:
+        _load()
+        _used.add(stamp)
+        if stamp in _digests:
+            entry = _digests[stamp]
+            return {key: entry[key] for key in _fields}
+    crc = 0
+    digest = hashlib.sha256()
+    size = 0
+    with open(fnm, 'rb') as fh:
+        while True:
+            data = fh.read(1 << 20)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            digest.update(data)
+            size += len(data)
+    ref = {'bytes_out': size, 'crc32': crc, 'sha256': digest.hexdigest()}
+    with _lock:
+        _digests[stamp] = dict(ref, path=path)
+        _status['dirty'] = True
+    return ref
+
+
+def check(args, orignm):
+    """
+    run decompression command 'args' writing to stdout and compare its output with 'orignm'
+
+    Parameters
+    ----------
+    args : list of str
+        command writing the decompressed data to stdout, e.g. ['pigz', '-d', '-c', fnm]
+    orignm : str
+        name of the original file
+
+    Returns
+    -------
+    empty string if the output matches, otherwise a description of the difference
+    """
+
+    ref = reference(orignm)
+    usage = runner.run_stream(args, strong=True)
+    if usage['returncode'] != 0:
+        return 'exit code {}'.format(usage['returncode'])
+    if usage['bytes_out'] != ref['bytes_out']:
+        return '{} bytes instead of {}'.format(usage['bytes_out'], ref['bytes_out'])
+    if usage['crc32'] != ref['crc32'] or usage['sha256'] != ref['sha256']:
+        return 'content differs'
+    return ''
+
+
+def check_all(jobs, workers=0):
+    """
+    run many checks in parallel
+
+    Parameters
+    ----------
+    jobs : list of (list of str, str)
+        decompression command and original file name for each check
+    workers : int
+        number of concurrent checks (default 0, one per logical CPU)
+
+    Returns
+    -------
+    number of failed checks, each failure is printed
+    """
+
+    if workers < 1:
+        workers = psutil.cpu_count(logical=True) or 1
+    # each original is read once, before the pool competes for the disk
+    for orignm in sorted(set(orignm for args, orignm in jobs)):
+        reference(orignm)
+    with _lock:
+        if _status['dirty']:
+            _save()
+    err = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [(pool.submit(check, args, orignm), args, orignm)
+                       for args, orignm in jobs]
+            for future, args, orignm in futures:
+                msg = future.result()
+                if len(msg) > 0:
+                    err += 1
+                    print('Files differ "{}": {} ({})'.format(orignm, ' '.join(args), msg))
+    finally:
+        # the pool threads have exited, their spawn helpers are no longer needed
+        runner.close_helpers()
+    return err
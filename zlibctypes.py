@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Minimal ctypes binding of the zlib API, so each zlib variant built by
+# a_compile.py can be called in-process without writing a C extension.
+# Only the zlib-compatible interface is used (zlib-ng needs ZLIB_COMPAT=ON).
+
+import ctypes
+import ctypes.util
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+Z_NO_FLUSH = 0
+Z_SYNC_FLUSH = 2
+Z_FINISH = 4
+Z_BLOCK = 5
+Z_DEFLATED = 8
+Z_DEFAULT_STRATEGY = 0
+
+# largest chunk handed to zlib at once: avail_in and avail_out are 32-bit
+_max_chunk = 1 << 30
+
+
+class z_stream(ctypes.Structure):
+    _fields_ = [('next_in', ctypes.c_void_p),
+                ('avail_in', ctypes.c_uint),
+                ('total_in', ctypes.c_ulong),
+                ('next_out', ctypes.c_void_p),
+                ('avail_out', ctypes.c_uint),
+                ('total_out', ctypes.c_ulong),
+                ('msg', ctypes.c_char_p),
+                ('state', ctypes.c_void_p),
+                ('zalloc', ctypes.c_void_p),
+                ('zfree', ctypes.c_void_p),
+                ('opaque', ctypes.c_void_p),
+                ('data_type', ctypes.c_int),
+                ('adler', ctypes.c_ulong),
+                ('reserved', ctypes.c_ulong)]
+
+
+def load(fnm=''):
+    """
+    load a zlib shared library and declare the functions used here
+
+    Parameters
+    ----------
+    fnm : str
+        name of shared library, e.g. './lib/libz-ng.so' (default '', the system zlib)
+    """
+
+    if len(fnm) < 1:
+        fnm = ctypes.util.find_library('z')
+        if fnm is None:
+            raise OSError('Unable to find the system zlib')
+    lib = ctypes.CDLL(fnm)
+    p = ctypes.POINTER(z_stream)
+    lib.zlibVersion.restype = ctypes.c_char_p
+    lib.deflateInit2_.argtypes = [p, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                                  ctypes.c_int, ctypes.c_int, ctypes.c_char_p,
+                                  ctypes.c_int]
+    lib.deflateBound.argtypes = [p, ctypes.c_ulong]
+    lib.deflateBound.restype = ctypes.c_ulong
+    lib.deflate.argtypes = [p, ctypes.c_int]
+    lib.deflateEnd.argtypes = [p]
+    lib.inflateInit2_.argtypes = [p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+    lib.inflate.argtypes = [p, ctypes.c_int]
+    lib.inflateEnd.argtypes = [p]
+    lib.inflateReset.argtypes = [p]
+    lib.inflatePrime.argtypes = [p, ctypes.c_int, ctypes.c_int]
+    lib.inflateSetDictionary.argtypes = [p, ctypes.c_char_p, ctypes.c_uint]
+    return lib
+
+
+def _check(ret, strm, what):
+    if ret < 0:
+        msg = ''
+        if strm.msg:
+            msg = strm.msg.decode(errors='replace')
+        raise RuntimeError('{} failed ({}) {}'.format(what, ret, msg))
+
+
+def deflate_init(lib, strm, level=6, wbits=15, memlevel=8,
+                 strategy=Z_DEFAULT_STRATEGY):
+    """initialize 'strm' for compression, see deflateInit2 in zlib.h"""
+
+    ret = lib.deflateInit2_(ctypes.byref(strm), level, Z_DEFLATED, wbits,
+                            memlevel, strategy, lib.zlibVersion(),
+                            ctypes.sizeof(z_stream))
+    _check(ret, strm, 'deflateInit2')
+
+
+def inflate_init(lib, strm, wbits=15):
+    """initialize 'strm' for decompression, see inflateInit2 in zlib.h"""
+
+    ret = lib.inflateInit2_(ctypes.byref(strm), wbits, lib.zlibVersion(),
+                            ctypes.sizeof(z_stream))
+    _check(ret, strm, 'inflateInit2')
+
+
+def compress(lib, data, level=6, wbits=15, memlevel=8,
+             strategy=Z_DEFAULT_STRATEGY):
+    """
+    compress the in-memory buffer 'data' with deflateInit2/deflate/deflateEnd
+
+    Parameters
+    ----------
+    lib : ctypes.CDLL
+        library returned by load()
+    data : bytes
+        uncompressed data
+    level : int
+        compression level 0..9 (default 6)
+    wbits : int
+        window size as log2, 9..15. Add 16 for a gzip wrapper or negate for raw deflate
+    memlevel : int
+        memory level 1..9 (default 8)
+    strategy : int
+        compression strategy (default Z_DEFAULT_STRATEGY)
+    """
+
+    strm = z_stream()
+    deflate_init(lib, strm, level, wbits, memlevel, strategy)
+    out = ctypes.create_string_buffer(lib.deflateBound(ctypes.byref(strm), len(data)))
+    src = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+    strm.next_out = ctypes.addressof(out)
+    strm.avail_out = min(len(out), _max_chunk)
+    pos = 0
+    ret = Z_OK
+    while ret != Z_STREAM_END:
+        if strm.avail_in == 0 and pos < len(data):
+            strm.next_in = src + pos
+            strm.avail_in = min(len(data) - pos, _max_chunk)
+            pos += strm.avail_in
+        if strm.avail_out == 0:
+            strm.avail_out = min(len(out) - strm.total_out, _max_chunk)
+        flush = Z_NO_FLUSH
+        if pos >= len(data):
+            flush = Z_FINISH
+        ret = lib.deflate(ctypes.byref(strm), flush)
+        _check(ret, strm, 'deflate')
+    size = strm.total_out
+    lib.deflateEnd(ctypes.byref(strm))
+    return ctypes.string_at(out, size)
+
+
+def decompress(lib, data, size, wbits=15):
+    """
+    decompress the in-memory buffer 'data' with inflateInit2/inflate/inflateEnd
+
+    Parameters
+    ----------
+    lib : ctypes.CDLL
+        library returned by load()
+    data : bytes
+        compressed data
+    size : int
+        uncompressed size in bytes
+    wbits : int
+        window size as log2, as used for compress()
+    """
+
+    strm = z_stream()
+    inflate_init(lib, strm, wbits)
+    out = ctypes.create_string_buffer(max(size, 1))
+    src = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+    strm.next_out = ctypes.addressof(out)
+    strm.avail_out = min(len(out), _max_chunk)
+    pos = 0
+    ret = Z_OK
+    while ret != Z_STREAM_END:
+        if strm.avail_in == 0:
+            if pos >= len(data):
+                raise RuntimeError('inflate: truncated input')
+            strm.next_in = src + pos
+            strm.avail_in = min(len(data) - pos, _max_chunk)
+            pos += strm.avail_in
+        if strm.avail_out == 0:
+            if strm.total_out >= len(out):
+                raise RuntimeError('inflate: output larger than {} bytes'.format(size))
+            strm.avail_out = min(len(out) - strm.total_out, _max_chunk)
+        ret = lib.inflate(ctypes.byref(strm), Z_NO_FLUSH)
+        _check(ret, strm, 'inflate')
+        if ret == Z_NEED_DICT:
+            raise RuntimeError('inflate: preset dictionary required')
+    total = strm.total_out
+    lib.inflateEnd(ctypes.byref(strm))
+    return ctypes.string_at(out, total)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Random access into gzip files, after zran.c from the zlib examples.
+#
+# build_index() inflates the whole file once and records an access point at
+# the first deflate block boundary after every 'span' bytes of output: the
+# compressed and uncompressed offsets, the bit offset within the compressed
+# byte, and the 32 KB of output before the point. extract() starts inflating
+# at the nearest point before the requested offset, primed with those bits
+# (inflatePrime) and that window (inflateSetDictionary), so reading a slice
+# costs at most 'span' bytes of decompression instead of the whole file.
+# This is what indexed_gzip does for nibabel.
+
+import bisect
+import ctypes
+import zlibctypes
+
+_winsize = 32768
+# compressed bytes handed to inflate at once
+_chunk = 1 << 16
+
+
+def build_index(lib, data, span=1 << 20):
+    """
+    access points of the gzip or zlib stream 'data', about 'span' uncompressed bytes apart
+
+    Parameters
+    ----------
+    lib : ctypes.CDLL
+        zlib library returned by zlibctypes.load()
+    data : bytes
+        compressed file (single gzip member or zlib stream)
+    span : int
+        minimum uncompressed bytes between access points (default 1 MiB)
+
+    Returns
+    -------
+    dict with 'span', 'size' (uncompressed bytes) and 'points', a list of
+    (compressed offset, uncompressed offset, bits, window) tuples
+    """
+
+    strm = zlibctypes.z_stream()
+    # 47: detect the gzip or zlib header
+    zlibctypes.inflate_init(lib, strm, 47)
+    window = ctypes.create_string_buffer(_winsize)
+    src = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+    points = []
+    last = 0
+    pos = 0
+    ret = zlibctypes.Z_OK
+    try:
+        while True:
+            if strm.avail_in == 0:
+                if pos >= len(data):
+                    raise RuntimeError('inflate: truncated input')
+                strm.next_in = src + pos
+                strm.avail_in = min(len(data) - pos, _chunk)
+                pos += strm.avail_in
+            if strm.avail_out == 0:
+                strm.next_out = ctypes.addressof(window)
+                strm.avail_out = _winsize
+            # Z_BLOCK returns at every deflate block boundary
+            ret = lib.inflate(ctypes.byref(strm), zlibctypes.Z_BLOCK)
+            zlibctypes._check(ret, strm, 'inflate')
+            if ret == zlibctypes.Z_NEED_DICT:
+                raise RuntimeError('inflate: preset dictionary required')
+            if ret == zlibctypes.Z_STREAM_END:
+                break
+            # bit 7: at a block boundary, bit 6: after the last block
+            boundary = (strm.data_type & 128) and not (strm.data_type & 64)
+            totout = strm.total_out
+            if boundary and (totout == 0 or totout - last > span):
+                have = _winsize - strm.avail_out
+                win = window.raw[have:] + window.raw[:have]
+                points.append((strm.total_in, totout, strm.data_type & 7,
+                               win[_winsize - min(totout, _winsize):]))
+                last = totout
+        size = strm.total_out
+    finally:
+        lib.inflateEnd(ctypes.byref(strm))
+    return {'span': span, 'size': size, 'points': points}
+
+
+def index_bytes(index):
+    """bytes needed to store 'index': 17 bytes of offsets and bits plus the window of each point"""
+
+    return sum(17 + len(point[3]) for point in index['points'])
+
+
+def extract(lib, data, index, offset, length):
+    """
+    read 'length' uncompressed bytes starting at 'offset' using the access points of 'index'
+
+    Parameters
+    ----------
+    lib : ctypes.CDLL
+        zlib library returned by zlibctypes.load()
+    data : bytes
+        compressed file the index was built from
+    index : dict
+        see build_index
+    offset : int
+        uncompressed offset of the first byte
+    length : int
+        bytes to read, fewer are returned at the end of the file
+
+    Returns
+    -------
+    uncompressed bytes
+    """
+
+    length = max(min(length, index['size'] - offset), 0)
+    if length < 1:
+        return b''
+    outs = [point[1] for point in index['points']]
+    totin, totout, bits, win = index['points'][max(bisect.bisect_right(outs, offset) - 1, 0)]
+    strm = zlibctypes.z_stream()
+    zlibctypes.inflate_init(lib, strm, -15)
+    try:
+        if bits:
+            ret = lib.inflatePrime(ctypes.byref(strm), bits, data[totin - 1] >> (8 - bits))
+            zlibctypes._check(ret, strm, 'inflatePrime')
+        if len(win) > 0:
+            ret = lib.inflateSetDictionary(ctypes.byref(strm), win, len(win))
+            zlibctypes._check(ret, strm, 'inflateSetDictionary')
+        skip = offset - totout
+        out = ctypes.create_string_buffer(skip + length)
+        src = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+        strm.next_out = ctypes.addressof(out)
+        strm.avail_out = len(out)
+        pos = totin
+        ret = zlibctypes.Z_OK
+        while strm.avail_out > 0 and ret != zlibctypes.Z_STREAM_END:
+            if strm.avail_in == 0:
+                if pos >= len(data):
+                    raise RuntimeError('inflate: truncated input')
+                strm.next_in = src + pos
+                strm.avail_in = min(len(data) - pos, _chunk)
+                pos += strm.avail_in
+            ret = lib.inflate(ctypes.byref(strm), zlibctypes.Z_NO_FLUSH)
+            zlibctypes._check(ret, strm, 'inflate')
+        total = strm.total_out
+    finally:
+        lib.inflateEnd(ctypes.byref(strm))
+    return ctypes.string_at(ctypes.addressof(out) + skip, total - skip)